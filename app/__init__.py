@@ -4,13 +4,18 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask, flash, redirect, url_for
-from markupsafe import Markup
-import re
 from config import Config
 from .extensions import db, migrate, login, csrf, mail, limiter
 import cloudinary
 from flask_wtf.csrf import CSRFError
 from .context_processors import inject_sidebar_data
+from .page_cache import init_page_cache
+from .fragment_cache import init_fragment_cache
+from .conditional import init_conditional_get
+from .search import highlight, init_search_cache
+from .feeds import init_feed_cache
+from .sitemap import init_sitemap_cache
+from .outbox import init_outbox
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
 
@@ -31,6 +36,12 @@ def create_app(config_class=Config):
     mail.init_app(app)
     limiter.storage_uri = app.config.get('RATELIMIT_STORAGE_URI')    
     limiter.init_app(app)
+    init_page_cache(app)
+    init_fragment_cache(app)
+    init_search_cache(app)
+    init_feed_cache(app)
+    init_sitemap_cache(app)
+    init_outbox(app)
 
     csp = {
         'default-src': "'self'",
@@ -55,6 +66,7 @@ def create_app(config_class=Config):
         'img-src': ["'self'", 'data:', 'https://res.cloudinary.com']
     }
 
+    init_conditional_get(app)  # Before Talisman; see its docstring
     Talisman(app, content_security_policy=csp, content_security_policy_nonce_in=['script-src'], force_https=False)
 
     @app.errorhandler(CSRFError)
@@ -62,11 +74,6 @@ def create_app(config_class=Config):
         flash("Your session timed out. Please try again.", "info")
         return redirect(url_for('main.index'))
 
-    def highlight(text, query):
-        if not query:
-            return text
-        return Markup(re.sub(f'({re.escape(query)})', r'<mark>\1</mark>', text, flags=re.IGNORECASE))
-
     app.jinja_env.filters['highlight'] = highlight
 
     if app.config.get('CLOUDINARY_CLOUD_NAME'):
@@ -79,6 +86,9 @@ def create_app(config_class=Config):
 
     app.context_processor(inject_sidebar_data)
 
+    from .commands import register_commands
+    register_commands(app)
+
     with app.app_context():
         from . import routes
         app.register_blueprint(routes.bp)
@@ -0,0 +1,94 @@
+# app/cache.py
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from app.signals import post_changed
+
+
+class SidebarCache:
+    """
+    Holds the sidebar's recent posts and popular tags in memory.
+    The data is computed once and reused until a post changes or the
+    timeout expires (the timeout covers other worker processes, which
+    don't see our invalidations).
+    """
+
+    def __init__(self):
+        self._data = None
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def get(self, loader, timeout):
+        data = self._data
+        if data is not None and time.monotonic() < self._expires_at:
+            return data
+        with self._lock:
+            # Another thread may have filled the cache while we waited
+            if self._data is not None and time.monotonic() < self._expires_at:
+                return self._data
+            data = loader()
+            self._data = data
+            self._expires_at = time.monotonic() + timeout
+            return data
+
+    def clear(self):
+        with self._lock:
+            self._data = None
+            self._expires_at = 0
+
+
+sidebar_cache = SidebarCache()
+
+
+@post_changed.connect
+def _clear_sidebar_cache(sender, **extra):
+    sidebar_cache.clear()
+
+
+class SlugCache:
+    """
+    Remembers which post id a slug belongs to, for the most recently viewed
+    posts, so hot posts are fetched by primary key. Entries are only hints:
+    callers must check the loaded post's slug, since other worker processes
+    don't see our invalidations.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, slug):
+        with self._lock:
+            post_id = self._entries.get(slug)
+            if post_id is not None:
+                self._entries.move_to_end(slug)
+            return post_id
+
+    def set(self, slug, post_id):
+        with self._lock:
+            self._entries[slug] = post_id
+            self._entries.move_to_end(slug)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_post(self, post_id):
+        with self._lock:
+            for slug in [s for s, pid in self._entries.items() if pid == post_id]:
+                del self._entries[slug]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slug_cache = SlugCache()
+
+
+@post_changed.connect
+def _invalidate_slug_cache(sender, post_id=None, **extra):
+    if post_id is None:
+        slug_cache.clear()
+    else:
+        slug_cache.invalidate_post(post_id)
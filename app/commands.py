@@ -0,0 +1,151 @@
+# app/commands.py
+import time
+
+import click
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Tag, Comment, html_to_text, make_excerpt
+from app.freeze import freeze_site
+from app.outbox import (OutboxMetrics, drain_outbox, next_due_in, purge_outbox,
+                        queue_stats)
+from app.related import compute_related_posts
+from app.search import rebuild_index
+from app.signals import outbox_draining
+
+
+def register_commands(app):
+    """Registers the app's custom `flask` CLI commands."""
+
+    @app.cli.command("rebuild-tag-counts")
+    def rebuild_tag_counts_command():
+        """Recounts the published posts for every tag from scratch."""
+        print("Rebuilding tag post counts...")
+        try:
+            Tag.update_post_counts()
+            db.session.commit()
+            print("\nSUCCESS: Tag post counts have been rebuilt!")
+        except Exception as e:
+            db.session.rollback()
+            print(f"\nAN ERROR OCCURRED: {e}")
+
+    @app.cli.command("backfill-post-text")
+    @click.option('--batch-size', default=200, show_default=True,
+                  help='Posts to convert per transaction.')
+    def backfill_post_text_command(batch_size):
+        """Fills in plain_text and excerpt for posts saved before they existed."""
+        total = 0
+        while True:
+            batch = db.session.scalars(
+                sa.select(Post).where(Post.plain_text == None)
+                .order_by(Post.id).limit(batch_size)).all()
+            if not batch:
+                break
+            for post_item in batch:
+                post_item.plain_text = html_to_text(post_item.body)
+                post_item.excerpt = make_excerpt(post_item.plain_text)
+            db.session.commit()
+            total += len(batch)
+            print(f"Converted {total} posts...")
+        print(f"\nSUCCESS: Backfilled text for {total} posts.")
+
+    @app.cli.command("reconcile-comment-counts")
+    def reconcile_comment_counts_command():
+        """Repairs any drift in the post comment and comment reply counters."""
+        print("Reconciling comment counters...")
+        try:
+            fixed_posts = Post.update_comment_counts()
+            fixed_comments = Comment.update_reply_counts()
+            db.session.commit()
+            print(f"\nSUCCESS: Corrected {fixed_posts} post(s) and "
+                  f"{fixed_comments} comment(s).")
+        except Exception as e:
+            db.session.rollback()
+            print(f"\nAN ERROR OCCURRED: {e}")
+
+    @app.cli.command("rebuild-related-posts")
+    def rebuild_related_posts_command():
+        """Recomputes every post's related-post neighbours from scratch."""
+        print("Rebuilding related posts...")
+        try:
+            compute_related_posts()
+            db.session.commit()
+            print("\nSUCCESS: Related posts have been rebuilt!")
+        except Exception as e:
+            db.session.rollback()
+            print(f"\nAN ERROR OCCURRED: {e}")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index_command():
+        """Re-indexes every published post for full-text search."""
+        print("Rebuilding the search index...")
+        try:
+            rebuild_index()
+            db.session.commit()
+            print("\nSUCCESS: The search index has been rebuilt!")
+        except Exception as e:
+            db.session.rollback()
+            print(f"\nAN ERROR OCCURRED: {e}")
+
+    @app.cli.command("freeze")
+    @click.option('--output', default='build', show_default=True,
+                  help='Directory to write the static site to.')
+    @click.option('--base-url', default=lambda: app.config.get('FREEZE_BASE_URL'),
+                  help='Public URL of the site, used in feeds and sitemaps.')
+    @click.option('--workers', type=int, default=None,
+                  help='Rendering processes (default: one per CPU).')
+    @click.option('--full', is_flag=True,
+                  help='Re-render every page, e.g. after a template change.')
+    def freeze_command(output, base_url, workers, full):
+        """Exports the public pages as static files, re-rendering only what changed."""
+        print(f"Freezing {base_url} into {output}...")
+        try:
+            report = freeze_site(output, base_url, workers=workers, full=full)
+            print(f"\nSUCCESS: {report.pages} pages, {report.rendered} rendered, "
+                  f"{report.written} written, {report.removed} removed.")
+            if report.failed:
+                print(f"{report.failed} page(s) failed to render; see the log.")
+        except Exception as e:
+            print(f"\nAN ERROR OCCURRED: {e}")
+
+    @app.cli.command("mail-worker")
+    @click.option('--once', is_flag=True,
+                  help='Send what is due, then exit (e.g. from cron).')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Messages claimed at a time (default: MAIL_OUTBOX_BATCH_SIZE).')
+    @click.option('--poll-interval', type=float,
+                  default=lambda: app.config.get('MAIL_OUTBOX_POLL_INTERVAL', 30),
+                  help='Longest wait between checks when nothing is due.')
+    def mail_worker_command(once, batch_size, poll_interval):
+        """Sends the mail outbox, for when MAIL_OUTBOX_WORKERS is 0."""
+        metrics = OutboxMetrics()
+        purge_interval = app.config.get('MAIL_OUTBOX_PURGE_INTERVAL', 3600)
+        purged_at = None
+        print(f"Draining the mail outbox ({queue_stats()['pending']} pending)...")
+        try:
+            while True:
+                wait = poll_interval
+                try:
+                    outbox_draining.send(app)
+                    drain_outbox(batch_size, metrics,
+                                 idle_wait=None if once else time.sleep)
+                    if purged_at is None or time.monotonic() - purged_at >= purge_interval:
+                        purged_at = time.monotonic()
+                        purged = purge_outbox()
+                        if purged:
+                            print(f"Purged {purged} old messages.")
+                    due = next_due_in()
+                    if due is not None:
+                        wait = min(due, poll_interval)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"AN ERROR OCCURRED: {e}")
+                if once:
+                    break
+                db.session.remove()
+                time.sleep(wait)
+        except KeyboardInterrupt:
+            pass
+        stats = metrics.stats()
+        print(f"\nSUCCESS: {stats['sent']} sent, {stats['retried']} to retry, "
+              f"{stats['failed']} failed.")
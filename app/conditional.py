@@ -0,0 +1,64 @@
+# app/conditional.py
+import hashlib
+from datetime import timezone
+
+from flask import request, make_response
+
+
+def make_etag(*parts):
+    """Builds an ETag value from anything that identifies a version of a page."""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _as_http_date(value):
+    # Stored timestamps are naive UTC; HTTP dates have whole-second precision
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def not_modified_response(etag, last_modified=None, weak=False):
+    """
+    Returns a 304 response if the client's cached copy matches the given
+    validators, otherwise None. Call it before doing any rendering work.
+    """
+    last_modified = _as_http_date(last_modified)
+    if request.if_none_match:
+        if weak:
+            matches = request.if_none_match.contains_weak(etag)
+        else:
+            matches = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        matches = last_modified <= request.if_modified_since
+    else:
+        matches = False
+
+    if not matches:
+        return None
+    response = make_response('', 304)
+    return set_validators(response, etag, last_modified, weak=weak)
+
+
+def set_validators(response, etag, last_modified=None, weak=False):
+    """Adds ETag and Last-Modified headers to a full response."""
+    response.set_etag(etag, weak=weak)
+    if last_modified is not None:
+        response.last_modified = _as_http_date(last_modified)
+    return response
+
+
+def init_conditional_get(app):
+    """
+    Must be registered before Talisman so it runs after Talisman's own
+    after_request hook. A 304 carrying a fresh CSP nonce would replace the
+    nonce stored with the client's cached page and block its inline scripts,
+    so 304s go out without a policy and the cached one stays in force.
+    """
+
+    @app.after_request
+    def strip_csp_from_not_modified(response):
+        if response.status_code == 304:
+            response.headers.pop('Content-Security-Policy', None)
+        return response
@@ -4,46 +4,66 @@ import os
 from app.models import Post, Tag, Subscriber
 from app.forms import SubscriptionForm
 from app import db
+from app.cache import sidebar_cache
 import sqlalchemy as sa
 from flask import current_app  # To access app config for number of items
 from datetime import datetime
 from app.forms import SubscriptionForm
 
 
-
-def inject_sidebar_data():
+def load_sidebar_data():
     """
-    Injects data into the template context for the sidebar.
-    This includes recent posts and popular tags.
+    Queries the recent posts and popular tags shown in the sidebar.
+    Returns plain dicts rather than ORM objects so the result can be
+    cached and reused outside of the session that loaded it.
     """
     # --- Recent Posts ---
     # Get the number of recent posts from config, default to 5 for now but change later maybe
     num_recent_posts = current_app.config.get('SIDEBAR_RECENT_POSTS_COUNT', 5)
-    try:
-        recent_posts = db.session.scalars(
-            sa.select(Post).order_by(Post.timestamp.desc()).limit(num_recent_posts)
-        ).all()
-    except Exception as e:
-        # Log the error but don't crash the app if DB query fails during context processing
-        current_app.logger.error(f"Error fetching recent posts for sidebar: {e}", exc_info=True)
-        recent_posts = []
+    recent_posts = db.session.scalars(
+        Post.listing_select(with_tags=False)
+        .order_by(Post.timestamp.desc()).limit(num_recent_posts)
+    ).all()
 
     # --- Popular Tags ---
     # Get the number of popular tags from config, default to 10
     num_popular_tags = current_app.config.get('SIDEBAR_POPULAR_TAGS_COUNT', 10)
+    # Tags ordered by their maintained count of published posts (see Tag.update_post_counts)
+    popular_tags = db.session.scalars(
+        sa.select(Tag)
+        .where(Tag.post_count > 0)
+        .order_by(Tag.post_count.desc(), Tag.name)
+        .limit(num_popular_tags)
+    ).all()
+
+    return dict(
+        recent_posts=[{'title': p.title,
+                       'slug': p.slug,
+                       'author_username': p.author.username,
+                       'timestamp': p.timestamp} for p in recent_posts],
+        popular_tags=[{'name': t.name, 'post_count': t.post_count}
+                      for t in popular_tags]
+    )
+
+
+def cached_sidebar_data():
+    """The sidebar data, from the sidebar cache."""
+    return sidebar_cache.get(
+        load_sidebar_data,
+        timeout=current_app.config.get('SIDEBAR_CACHE_TIMEOUT', 3600))
+
+
+def inject_sidebar_data():
+    """
+    Injects data into the template context for the sidebar.
+    This includes recent posts and popular tags, served from the sidebar cache.
+    """
     try:
-        # This query gets tags ordered by the number of posts they are associated with.
-        # It requires joining Post and Tag through the post_tags association table.
-        popular_tags = db.session.scalars(
-            sa.select(Tag)
-            .join(Post.tags)  # Using the relationship attribute for the join condition
-            .group_by(Tag.id)
-            .order_by(sa.func.count(Post.id).desc())  # Order by post count
-            .limit(num_popular_tags)
-        ).all()
+        sidebar = cached_sidebar_data()
     except Exception as e:
-        current_app.logger.error(f"Error fetching popular tags for sidebar: {e}", exc_info=True)
-        popular_tags = []
+        # Log the error but don't crash the app if DB query fails during context processing
+        current_app.logger.error(f"Error fetching sidebar data: {e}", exc_info=True)
+        sidebar = dict(recent_posts=[], popular_tags=[])
 
     # --- START CACHE BUSTING ---
     try:
@@ -59,8 +79,8 @@ def inject_sidebar_data():
     sub_form = SubscriptionForm()
 
     return dict(
-        sidebar_recent_posts = recent_posts,
-        sidebar_popular_tags = popular_tags,
+        sidebar_recent_posts = sidebar['recent_posts'],
+        sidebar_popular_tags = sidebar['popular_tags'],
         now = datetime.utcnow,
         css_version = css_version,
         subscription_form = sub_form
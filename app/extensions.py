@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+
+import sqlalchemy.orm as so
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
@@ -15,3 +18,24 @@ login = LoginManager()
 login.login_view = 'main.login'
 login.login_message = 'Please log in to access this page.'
 login.login_message_category = 'info'
+
+
+@contextmanager
+def migration_session(connection):
+    """
+    Points db.session at a migration's connection for the block, so app code
+    that fills a new table runs in the migration's transaction. Changes are
+    flushed; Alembic commits them with the schema.
+    """
+    previous = db.session() if db.session.registry.has() else None
+    session = so.Session(bind=connection)
+    db.session.registry.set(session)
+    try:
+        yield session
+        session.flush()
+    finally:
+        session.close()  # Leaves the migration's transaction alone
+        if previous is None:
+            db.session.registry.clear()
+        else:
+            db.session.registry.set(previous)
@@ -0,0 +1,245 @@
+# app/feeds.py
+"""
+The blog's feeds of its latest published posts: the whole site's as RSS,
+Atom and JSON, and one per tag and per author.
+
+A feed's scope is ('site', None), ('tag', tag_id) or ('author', user_id).
+Each scope's entries are read once per version of its posts (their count and
+latest update) and every format is rendered from them once, then kept as
+bytes with a strong ETag in one bounded cache shared by all scopes. A post
+change drops only the scopes it touched; the version check on every request
+catches changes made by other processes.
+"""
+import hashlib
+import json
+from collections import namedtuple, OrderedDict
+from datetime import timezone
+from threading import Lock
+
+import sqlalchemy as sa
+from feedgen.feed import FeedGenerator
+from flask import current_app, has_request_context, request, url_for
+
+from app import db
+from app.models import Post, User, post_tags
+from app.signals import post_changed
+
+FEED_MIMETYPES = {
+    'rss': 'application/rss+xml',
+    'atom': 'application/atom+xml',
+    'json': 'application/feed+json',
+}
+FEED_ENDPOINTS = {'rss': 'main.rss_feed', 'atom': 'main.atom_feed',
+                  'json': 'main.json_feed'}
+
+SITE_FEED = ('site', None)
+
+RenderedFeed = namedtuple('RenderedFeed', 'body etag last_modified')
+FeedEntry = namedtuple('FeedEntry', 'url title summary published updated author')
+
+
+class FeedCache:
+    """
+    Entries and rendered feeds in a bounded, least-recently-used dict keyed
+    by host (entry links are absolute) and scope. Each holds one version of
+    its scope's posts; a newer version replaces it.
+    """
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._feeds = OrderedDict()  # (url_root, scope) -> (version, entries, {kind: RenderedFeed})
+        self._lock = Lock()
+
+    def get(self, url_root, scope, version):
+        with self._lock:
+            stored = self._feeds.get((url_root, scope))
+            if stored is None or stored[0] != version:
+                return None
+            self._feeds.move_to_end((url_root, scope))
+            return stored
+
+    def set(self, url_root, scope, version, entries, rendered):
+        with self._lock:
+            self._feeds[(url_root, scope)] = (version, entries, rendered)
+            self._feeds.move_to_end((url_root, scope))
+            while len(self._feeds) > self.max_entries:
+                self._feeds.popitem(last=False)
+
+    def invalidate_scopes(self, scopes):
+        with self._lock:
+            for key in [key for key in self._feeds if key[1] in scopes]:
+                del self._feeds[key]
+
+    def clear(self):
+        with self._lock:
+            self._feeds.clear()
+
+    def __len__(self):
+        return len(self._feeds)
+
+
+def init_feed_cache(app):
+    """Creates the feed cache sized by FEED_CACHE_MAX_ENTRIES."""
+    app.extensions['feed_cache'] = FeedCache(app.config.get('FEED_CACHE_MAX_ENTRIES', 500))
+
+
+def _utc(value):
+    # Stored timestamps are naive UTC; feed formats want a timezone
+    return value.replace(tzinfo=timezone.utc) if value else None
+
+
+def _scope_filter(scope):
+    kind, ident = scope
+    if kind == 'tag':
+        return [Post.id.in_(sa.select(post_tags.c.post_id)
+                            .where(post_tags.c.tag_id == ident))]
+    if kind == 'author':
+        return [Post.user_id == ident]
+    return []
+
+
+def scope_version(scope):
+    """(count, latest updated_at) of the published posts in a feed's scope."""
+    return tuple(db.session.execute(
+        sa.select(sa.func.count(Post.id), sa.func.max(Post.updated_at))
+        .where(Post.status == True, Post.published_at != None,
+               *_scope_filter(scope))).one())
+
+
+def _latest_entries(scope, limit):
+    # Only the columns a feed shows, author included, in one query
+    rows = db.session.execute(
+        sa.select(Post.slug, Post.title, Post.excerpt, Post.timestamp,
+                  Post.updated_at, User.username)
+        .outerjoin(User, User.id == Post.user_id)
+        .where(Post.status == True, Post.published_at != None,
+               *_scope_filter(scope))
+        .order_by(Post.published_at.desc())
+        .limit(limit))
+    return [FeedEntry(url_for('main.post', slug=slug, _external=True), title,
+                      excerpt or '', _utc(timestamp), _utc(updated_at or timestamp),
+                      username)
+            for slug, title, excerpt, timestamp, updated_at, username in rows]
+
+
+def _feed_details(scope, label, kind):
+    """The (title, home page, own url) of a feed."""
+    blog_name = current_app.config.get('BLOG_NAME', 'My Fragrance Blog')
+    if scope[0] == 'tag':
+        return (f"{blog_name} - Posts tagged '{label}'",
+                url_for('main.tag', tag_name=label, _external=True),
+                url_for('main.tag_feed', tag_name=label, _external=True))
+    if scope[0] == 'author':
+        return (f"{blog_name} - Posts by {label}",
+                url_for('main.index', _external=True),
+                url_for('main.author_feed', username=label, _external=True))
+    return (f"{blog_name} - Latest Posts", url_for('main.index', _external=True),
+            url_for(FEED_ENDPOINTS[kind], _external=True))
+
+
+def _feed_generator(entries, last_updated, details):
+    config = current_app.config
+    title, home_url, self_url = details
+    fg = FeedGenerator()
+    fg.id(self_url)
+    fg.title(title)
+    # RSS's channel <link> is the last link given, so the home page goes last
+    fg.link(href=self_url, rel='self')
+    fg.link(href=home_url, rel='alternate')
+    fg.subtitle(config.get('BLOG_SUBTITLE',
+                           'Reviews, musings, and guides on the world of scents.'))
+    fg.language(config.get('BLOG_LANGUAGE', 'en'))
+    fg.author({'name': config.get('BLOG_AUTHOR_NAME', 'Blog Admin'),
+               'email': config.get('BLOG_AUTHOR_EMAIL', 'noreply@example.com')})
+    if last_updated:
+        # Otherwise feedgen stamps the time of rendering, and two workers
+        # would disagree about the bytes (and the ETag) of the same version
+        fg.updated(last_updated)
+        fg.lastBuildDate(last_updated)
+    for entry in entries:
+        fe = fg.add_entry(order='append')
+        fe.id(entry.url)
+        fe.title(entry.title)
+        fe.link(href=entry.url)
+        fe.summary(entry.summary)
+        fe.pubDate(entry.published)
+        fe.updated(entry.updated)
+        if entry.author:
+            fe.author({'name': entry.author})
+    return fg
+
+
+def _json_feed(entries, details):
+    config = current_app.config
+    title, home_url, self_url = details
+    items = []
+    for entry in entries:
+        item = {'id': entry.url, 'url': entry.url, 'title': entry.title,
+                'summary': entry.summary,
+                'date_published': entry.published.isoformat(),
+                'date_modified': entry.updated.isoformat()}
+        if entry.author:
+            item['authors'] = [{'name': entry.author}]
+        items.append(item)
+    return json.dumps({
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': title,
+        'home_page_url': home_url,
+        'feed_url': self_url,
+        'description': config.get('BLOG_SUBTITLE',
+                                  'Reviews, musings, and guides on the world of scents.'),
+        'language': config.get('BLOG_LANGUAGE', 'en'),
+        'authors': [{'name': config.get('BLOG_AUTHOR_NAME', 'Blog Admin')}],
+        'items': items,
+    }, ensure_ascii=False).encode()
+
+
+def render_feed(kind, entries, version, details):
+    """Renders entries as one feed format: 'rss', 'atom' or 'json'."""
+    if kind == 'json':
+        body = _json_feed(entries, details)
+    else:
+        fg = _feed_generator(entries, _utc(version[1]), details)
+        body = fg.rss_str() if kind == 'rss' else fg.atom_str()
+    return RenderedFeed(body, hashlib.sha1(body).hexdigest(), version[1])
+
+
+def get_feed(kind, scope=SITE_FEED, label=None):
+    """
+    Returns the RenderedFeed of the given kind for a scope (`label` being the
+    tag name or username in its title and links) and the current request's
+    host. Entries are re-read when the scope's posts changed, and each kind
+    is rendered at most once per version.
+    """
+    cache = current_app.extensions['feed_cache']
+    version = scope_version(scope)
+    stored = cache.get(request.url_root, scope, version)
+    if stored is None:
+        entries = _latest_entries(scope, current_app.config.get('RSS_FEED_POST_LIMIT', 20))
+        rendered = {}
+    else:
+        _, entries, rendered = stored
+    if kind not in rendered:
+        rendered = {**rendered, kind: render_feed(
+            kind, entries, version, _feed_details(scope, label, kind))}
+        cache.set(request.url_root, scope, version, entries, rendered)
+    return rendered[kind]
+
+
+@post_changed.connect
+def _render_changed_feeds(app, post_id=None, tag_ids=None, author_id=None, **extra):
+    cache = app.extensions.get('feed_cache')
+    if cache is None:
+        return
+    if post_id is None or tag_ids is None:
+        cache.clear()
+    else:
+        # The site feed, the author's and those of the tags the post had
+        # before and after; every other tag's feed is untouched
+        scopes = {SITE_FEED, ('author', author_id)}
+        scopes.update(('tag', tag_id) for tag_id in tag_ids)
+        cache.invalidate_scopes(scopes)
+    # An admin's publish or edit pays for the new site feeds rather than a reader
+    if has_request_context():
+        for kind in FEED_MIMETYPES:
+            get_feed(kind)
@@ -65,20 +65,12 @@ class PostForm(FlaskForm):
     status = BooleanField('Publish this post immediately', default='checked')
     submit = SubmitField('Publish Post')
 
-class CommentForm(FlaskForm):
-    body = TextAreaField('Your Comment', validators=[DataRequired(), Length(min=1, max=500)])
-    submit_comment = SubmitField('Submit Comment')
-
-class ReplyForm(FlaskForm):
-    body = TextAreaField('Your Reply', validators=[DataRequired(), Length(min=1, max=500)])
-    parent_id = HiddenField('Parent ID', validators=[DataRequired()])
-    submit_reply = SubmitField('Submit Reply')
-
 class ContactForm(FlaskForm):
     name = StringField('Your Name', validators=[DataRequired(), Length(min=2, max=100)])
     email = StringField('Your Email', validators=[DataRequired(), Email(), Length(max=120)])
     subject = StringField('Subject', validators=[DataRequired(), Length(min=3, max=140)])
     message = TextAreaField('Message', validators=[DataRequired(), Length(min=10)])
+    honeypot = StringField('Leave this empty')
     submit = SubmitField('Send Message')
 
 class RequestPasswordResetForm(FlaskForm):
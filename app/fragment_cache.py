@@ -0,0 +1,119 @@
+# app/fragment_cache.py
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, has_request_context, request
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app.signals import post_changed
+
+
+class FragmentCache:
+    """
+    Keeps rendered template fragments in a bounded, least-recently-used dict.
+    Entries are grouped by the id of the post they belong to so that a post's
+    fragments can be dropped together.
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, post_id, key):
+        with self._lock:
+            html = self._entries.get((post_id, key))
+            if html is not None:
+                self._entries.move_to_end((post_id, key))
+            return html
+
+    def set(self, post_id, key, html):
+        with self._lock:
+            self._entries[(post_id, key)] = html
+            self._entries.move_to_end((post_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_post(self, post_id):
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == post_id]:
+                del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _version(value):
+    # Posts stand in for their id and last edit, so an edit is a new key
+    if hasattr(value, 'id') and hasattr(value, 'updated_at'):
+        return value.id, value.updated_at
+    if isinstance(value, (list, tuple)):
+        return tuple(_version(item) for item in value)
+    return value
+
+
+def fragment_key(key_parts):
+    """
+    Turns the arguments of a {% cache %} tag into (post_id, key). The first
+    argument is the post the fragment belongs to; the rest are anything
+    else the fragment shows that a post edit doesn't change.
+    """
+    post = key_parts[0]
+    host = request.host if has_request_context() else None
+    return post.id, (host,) + tuple(_version(part) for part in key_parts)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a {% cache post, 'name', ... %}...{% endcache %} block that renders
+    its body once per version of the post and reuses the HTML afterwards.
+    Only put markup in it that is the same for every visitor.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]),
+            [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        cache = current_app.extensions.get('fragment_cache')
+        if cache is None or not current_app.config.get('FRAGMENT_CACHE_ENABLED', True):
+            return caller()
+        post_id, key = fragment_key(key_parts)
+        html = cache.get(post_id, key)
+        if html is None:
+            html = str(caller())
+            cache.set(post_id, key, html)
+        return Markup(html)
+
+
+def init_fragment_cache(app):
+    """Creates the fragment cache and enables the {% cache %} template tag."""
+    app.extensions['fragment_cache'] = FragmentCache(
+        app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+@post_changed.connect
+def _drop_post_fragments(app, post_id=None, **extra):
+    # Keys already carry updated_at; this frees the memory (and covers
+    # deletions) as soon as the change is committed
+    cache = app.extensions.get('fragment_cache')
+    if cache is None:
+        return
+    if post_id is None:
+        cache.clear()
+    else:
+        cache.invalidate_post(post_id)
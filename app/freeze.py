@@ -0,0 +1,260 @@
+# app/freeze.py
+"""
+Static export of the public site (`flask freeze`).
+
+Every public page is requested through the Flask test client, exactly as a
+visitor would get it, and written under an output directory that nginx or a
+CDN can serve: HTML pages as <path>/index.html, feeds and sitemaps under
+their own names.
+
+A manifest in the output directory records, per URL, a version built from
+everything the page shows (its post's edit time and comments, its tag's
+posts, the sidebar...) and a hash of the rendered bytes. Later runs only
+render pages whose version changed, only rewrite files whose bytes changed,
+and delete the files of pages that are gone. Pages are rendered across a
+process pool.
+
+Paginated listings (?after=/?before=) have query strings, which static
+files can't; only their first pages are exported.
+
+A static copy can't take form posts: the CSRF tokens in a page belong to
+the export's own session, so any form would be rejected. POST forms (the
+newsletter signup, comment forms...) are removed from the exported HTML
+and the csrf-token meta tag is left empty; those features stay on the
+live site.
+"""
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app, url_for
+
+from app import db, limiter
+from app.conditional import make_etag
+from app.context_processors import load_sidebar_data
+from app.feeds import SITE_FEED, scope_version
+from app.models import Comment, Post, RelatedPost, Tag, User, post_tags
+from app.sitemap import post_shards
+
+MANIFEST_NAME = '.freeze-manifest.json'
+# URLs handed to a worker process at a time
+FREEZE_BATCH_SIZE = 50
+
+# Forms carrying the export session's CSRF token, and that token on its own
+_POST_FORM_RE = re.compile(rb'<form\b[^>]*\bmethod="post"[^>]*>.*?</form>\s*',
+                           re.IGNORECASE | re.DOTALL)
+_CSRF_META_RE = re.compile(rb'(<meta name="csrf-token" content=")[^"]*')
+
+Page = namedtuple('Page', 'url version')
+FreezeReport = namedtuple('FreezeReport', 'pages rendered written removed failed')
+
+
+def _published(*criteria):
+    return [Post.status == True, Post.published_at != None, *criteria]
+
+
+def public_pages():
+    """
+    Returns a Page for every public URL, each with a version that changes
+    whenever anything shown on that page does. Call it in a request context
+    whose base URL is the site's.
+    """
+    # Post.author is a backref, which only exists once the mappers are
+    # configured; in a CLI command nothing may have queried the models yet
+    so.configure_mappers()
+    sidebar = make_etag(load_sidebar_data())
+    site = scope_version(SITE_FEED)
+    listing = make_etag(site, db.session.scalar(
+        sa.select(sa.func.sum(Post.comment_count)).where(*_published())))
+
+    # url_for('main.index') is /index; the home page file belongs at the root
+    pages = [Page('/', make_etag('index', sidebar, listing)),
+             Page(url_for('main.about'), make_etag('about', sidebar)),
+             Page(url_for('main.privacy_policy'), make_etag('privacy', sidebar))]
+    for endpoint in ('main.rss_feed', 'main.atom_feed', 'main.json_feed',
+                     'main.sitemap', 'main.sitemap_pages'):
+        pages.append(Page(url_for(endpoint), make_etag(endpoint, site)))
+    pages += [Page(url_for('main.sitemap_posts', shard=shard), make_etag('shard', site))
+              for shard, _ in post_shards()]
+
+    # Posts: their own edits and comments, and the titles of their neighbours
+    latest_comments = dict(db.session.execute(
+        sa.select(Comment.post_id,
+                  sa.func.max(sa.func.coalesce(Comment.edited_at, Comment.timestamp)))
+        .group_by(Comment.post_id)).all())
+    related = dict(db.session.execute(
+        sa.select(RelatedPost.post_id, sa.func.max(Post.updated_at))
+        .join(Post, Post.id == RelatedPost.related_id)
+        .group_by(RelatedPost.post_id)).all())
+    for post_id, slug, updated_at, comment_count in db.session.execute(
+            sa.select(Post.id, Post.slug, Post.updated_at, Post.comment_count)
+            .where(*_published()).order_by(Post.id)):
+        pages.append(Page(url_for('main.post', slug=slug), make_etag(
+            'post', sidebar, updated_at, comment_count,
+            latest_comments.get(post_id), related.get(post_id))))
+
+    # Tags: the posts listed on their first page, and their feeds
+    for name, post_count, latest, comments in db.session.execute(
+            sa.select(Tag.name, Tag.post_count, sa.func.max(Post.updated_at),
+                      sa.func.sum(Post.comment_count))
+            .join(post_tags, post_tags.c.tag_id == Tag.id)
+            .join(Post, Post.id == post_tags.c.post_id)
+            .where(*_published())
+            .group_by(Tag.id, Tag.name, Tag.post_count).order_by(Tag.name)):
+        version = (post_count, latest)
+        pages.append(Page(url_for('main.tag', tag_name=name),
+                          make_etag('tag', sidebar, *version, comments)))
+        pages.append(Page(url_for('main.tag_feed', tag_name=name),
+                          make_etag('tag-feed', *version)))
+
+    for username, post_count, latest in db.session.execute(
+            sa.select(User.username, sa.func.count(Post.id), sa.func.max(Post.updated_at))
+            .join(Post, Post.user_id == User.id)
+            .where(*_published())
+            .group_by(User.id, User.username).order_by(User.username)):
+        pages.append(Page(url_for('main.author_feed', username=username),
+                          make_etag('author-feed', post_count, latest)))
+    return pages
+
+
+def _output_file(url, mimetype):
+    path = unquote(urlsplit(url).path).strip('/')
+    if mimetype == 'text/html':
+        return os.path.join(path, 'index.html')
+    return path
+
+
+def _static_html(body):
+    body = _POST_FORM_RE.sub(b'', body)
+    return _CSRF_META_RE.sub(rb'\1', body)
+
+
+def render_pages(app, base_url, output_dir, batch):
+    """
+    Renders (url, previous hash) pairs with the test client and writes the
+    ones whose bytes changed. Returns (url, file, hash) per page, with a None
+    hash for pages that didn't render.
+    """
+    results = []
+    # The test client's requests share the caller's app context, and so its
+    # session; objects an earlier export loaded there would be shown as they were
+    db.session.expire_all()
+    # The export is one client asking for every page; don't rate limit it
+    limiter_enabled, limiter.enabled = limiter.enabled, False
+    try:
+        with app.test_client() as client:
+            for url, previous_hash in batch:
+                response = client.get(url, base_url=base_url)
+                if response.status_code != 200:
+                    app.logger.warning(f"FREEZE: {url} returned {response.status_code}")
+                    results.append((url, None, None))
+                    continue
+                body = response.get_data()
+                if response.mimetype == 'text/html':
+                    body = _static_html(body)
+                content_hash = hashlib.sha256(body).hexdigest()
+                relative = _output_file(url, response.mimetype)
+                target = os.path.join(output_dir, relative)
+                if content_hash != previous_hash or not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, 'wb') as f:
+                        f.write(body)
+                results.append((url, relative, content_hash))
+    finally:
+        limiter.enabled = limiter_enabled
+    return results
+
+
+_worker_app = None
+
+
+def _init_worker(settings):
+    # Each worker builds its own app (and database connections) from the
+    # command's app's settings, not just the environment's Config
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(type('FreezeWorkerConfig', (), settings))
+
+
+def _render_in_worker(base_url, output_dir, batch):
+    return render_pages(_worker_app, base_url, output_dir, batch)
+
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def freeze_site(output_dir, base_url, workers=None, full=False):
+    """
+    Exports the public pages to `output_dir`, rendering only what changed
+    since the last export unless `full` is set. `workers` processes render
+    in parallel; with one, pages are rendered in this process.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+    previous = manifest.get('pages', {}) if manifest.get('base_url') == base_url else {}
+
+    with current_app.test_request_context(base_url=base_url):
+        pages = public_pages()
+
+    to_render = [(page.url, previous.get(page.url, {}).get('hash'))
+                 for page in pages
+                 if full or previous.get(page.url, {}).get('version') != page.version]
+    batches = [to_render[i:i + FREEZE_BATCH_SIZE]
+               for i in range(0, len(to_render), FREEZE_BATCH_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(batches) <= 1:
+        app = current_app._get_current_object()
+        results = [r for batch in batches
+                   for r in render_pages(app, base_url, output_dir, batch)]
+    else:
+        settings = {key: value for key, value in current_app.config.items()
+                    if key.isupper()}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(settings,)) as pool:
+            results = [r for batch_results in pool.map(
+                _render_in_worker, [base_url] * len(batches),
+                [output_dir] * len(batches), batches) for r in batch_results]
+
+    versions = {page.url: page.version for page in pages}
+    rendered = {url: (relative, content_hash) for url, relative, content_hash in results}
+    entries, written, failed = {}, 0, 0
+    for url, version in versions.items():
+        if url in rendered:
+            relative, content_hash = rendered[url]
+            if content_hash is None:
+                failed += 1
+                if url in previous:
+                    # Keep the last good file; no version, so the next run retries
+                    entries[url] = dict(previous[url], version=None)
+                continue
+            if content_hash != previous.get(url, {}).get('hash'):
+                written += 1
+            entries[url] = {'version': version, 'hash': content_hash, 'file': relative}
+        else:
+            entries[url] = previous[url]
+
+    # Pages that no longer exist (deleted posts, emptied tags...)
+    removed = 0
+    kept_files = {entry['file'] for entry in entries.values()}
+    for url, entry in previous.items():
+        if url not in entries and entry.get('file') not in kept_files:
+            try:
+                os.remove(os.path.join(output_dir, entry['file']))
+                removed += 1
+            except OSError:
+                pass
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({'base_url': base_url, 'pages': entries}, f, indent=1, sort_keys=True)
+    return FreezeReport(len(pages), len(to_render), written, removed, failed)
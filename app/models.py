@@ -1,12 +1,34 @@
 # app/models.py
-from datetime import datetime, timezone
+import re
+from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from .extensions import db, login
 from slugify import slugify as default_slugify
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from itsdangerous import URLSafeTimedSerializer as Serializer
 from flask import current_app
+from markupsafe import Markup
+
+EXCERPT_LENGTH = 300
+# Block-level tags get replaced by a space so paragraphs don't run together
+BLOCK_TAG_RE = re.compile(r'</?(?:p|div|br|li|ul|ol|h[1-6]|blockquote|tr|td|th)\b[^>]*>',
+                          re.IGNORECASE)
+
+
+def html_to_text(html_string):
+    """Strips tags and entities from post HTML, like Jinja's striptags filter."""
+    if not html_string:
+        return ""
+    return Markup(BLOCK_TAG_RE.sub(' ', html_string)).striptags()
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH, end='...'):
+    """Cuts plain text down to at most `length` characters for summaries."""
+    if len(text) <= length:
+        return text
+    return text[:length - len(end)] + end
 
 post_tags = db.Table('post_tags',
     db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True),
@@ -49,6 +71,31 @@ class Tag(db.Model):
     __tablename__ = 'tags'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, index=True, nullable=False)
+    # Number of published posts with this tag, kept up to date by update_post_counts()
+    post_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0', index=True)
+
+    @staticmethod
+    def update_post_counts(tag_ids=None):
+        """
+        Recounts the published posts for the given tag ids (all tags if None).
+        Runs inside the caller's transaction; the caller commits.
+        """
+        if tag_ids is not None and not tag_ids:
+            return
+        published_count = (
+            sa.select(sa.func.count(post_tags.c.post_id))
+            .join(Post, Post.id == post_tags.c.post_id)
+            .where(post_tags.c.tag_id == Tag.id,
+                   Post.status == True,
+                   Post.published_at != None)
+            .scalar_subquery()
+        )
+        stmt = sa.update(Tag).values(post_count=published_count)
+        if tag_ids is not None:
+            stmt = stmt.where(Tag.id.in_(tag_ids))
+        db.session.flush()
+        db.session.execute(stmt.execution_options(synchronize_session=False))
 
 class Post(db.Model):
     __tablename__ = 'posts'
@@ -58,21 +105,164 @@ class Post(db.Model):
     body = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.String(255))
     image_public_id = db.Column(db.String(255))
-    timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.Boolean, default=False, index=True)
     published_at = db.Column(db.DateTime, index=True)
+    # Set whenever the post's content or tags are edited; drives HTTP caching.
+    # Like every timestamp here, naive UTC (datetime.utcnow())
+    updated_at = db.Column(db.DateTime, index=True,
+                           default=datetime.utcnow)
+    # Comments and replies on this post, kept up to date by the comment routes
+    comment_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
+    # Plain-text copies of the body, derived in _derive_text_fields()
+    plain_text = db.Column(db.Text)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH))
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     tags = db.relationship('Tag', secondary=post_tags, lazy='select', backref=db.backref('posts', lazy='dynamic'))
+    old_slugs = db.relationship('SlugHistory', backref='post', lazy='dynamic', cascade='all, delete-orphan')
+
+    @so.validates('body')
+    def _derive_text_fields(self, key, body):
+        """Keeps plain_text and excerpt in step whenever the body is set."""
+        self.plain_text = html_to_text(body)
+        self.excerpt = make_excerpt(self.plain_text)
+        return body
+
+    @staticmethod
+    def update_comment_counts(post_ids=None):
+        """
+        Recounts comments (replies included) for the given post ids, or for
+        every post if None. Only rows that were wrong are written; returns
+        how many. Runs inside the caller's transaction.
+        """
+        if post_ids is not None and not post_ids:
+            return 0
+        actual_count = (
+            sa.select(sa.func.count(Comment.id))
+            .where(Comment.post_id == Post.id)
+            .scalar_subquery()
+        )
+        stmt = (sa.update(Post).values(comment_count=actual_count)
+                .where(Post.comment_count != actual_count))
+        if post_ids is not None:
+            stmt = stmt.where(Post.id.in_(post_ids))
+        db.session.flush()
+        return db.session.execute(
+            stmt.execution_options(synchronize_session=False)).rowcount
+
     @staticmethod
-    def generate_unique_slug(title):
+    def content_version(published_only=True):
+        """
+        Returns (post count, latest updated_at) for the posts a feed or sitemap
+        is built from. The count changes when a post is deleted or unpublished,
+        which the latest update time alone would miss.
+        """
+        stmt = sa.select(sa.func.count(Post.id), sa.func.max(Post.updated_at))
+        if published_only:
+            stmt = stmt.where(Post.status == True, Post.published_at != None)
+        return tuple(db.session.execute(stmt).one())
+
+    @staticmethod
+    def listing_select(with_tags=True):
+        """
+        Base SELECT for any page that lists posts. Loads each post's author in
+        the same query and its tags in one extra query for the whole page,
+        instead of two lazy loads per row. The full body and plain text are
+        left unloaded; listings show the excerpt.
+        """
+        options = [so.joinedload(Post.author),
+                   so.defer(Post.body), so.defer(Post.plain_text)]
+        if with_tags:
+            options.append(so.selectinload(Post.tags))
+        return sa.select(Post).options(*options)
+
+    @staticmethod
+    def generate_unique_slug(title, exclude_post_id=None):
+        """
+        Returns the base slug for `title`, or base-N with the lowest free N.
+        Slugs other posts used to have stay taken so their old links keep
+        redirecting. The base and every taken base-N come back from one
+        query that seeks the slug indexes; "base-of-..." slugs are filtered
+        out in SQL.
+        """
         base_slug = default_slugify(title) or "post"
-        slug = base_slug
+        prefix = f"{base_slug}-"
+
+        def candidates(column):
+            if db.engine.dialect.name == 'postgresql':
+                # Seeks the varchar_pattern_ops indexes; a plain range would
+                # follow the database collation, which may ignore the '-'
+                in_prefix = column.startswith(prefix, autoescape=True)
+            else:
+                # Byte order: everything from 'base-' up to 'base.', '.'
+                # being the character after '-'
+                in_prefix = sa.and_(column >= prefix, column < f"{base_slug}.")
+            suffix = sa.func.substr(column, len(prefix) + 1)
+            numbered = sa.and_(in_prefix, suffix != '',
+                               sa.func.ltrim(suffix, '0123456789') == '')
+            return sa.or_(column == base_slug, numbered)
+
+        live = sa.select(Post.slug).where(candidates(Post.slug))
+        history = sa.select(SlugHistory.slug).where(candidates(SlugHistory.slug))
+        if exclude_post_id is not None:
+            live = live.where(Post.id != exclude_post_id)
+            history = history.where(SlugHistory.post_id != exclude_post_id)
+        taken = set(db.session.scalars(sa.union_all(live, history)))
+        if base_slug not in taken:
+            return base_slug
+        suffixes = {int(slug[len(prefix):]) for slug in taken if slug != base_slug}
         i = 1
-        while db.session.scalar(sa.select(Post.id).filter_by(slug=slug)):
-            slug = f"{base_slug}-{i}"
+        while i in suffixes:
             i += 1
-        return slug
+        return f"{base_slug}-{i}"
+
+    def allocate_slug(self, title, max_attempts=5):
+        """
+        Gives the post a unique slug derived from `title` and flushes it,
+        adding a new post to the session (don't add it beforehand: a pending
+        post would be flushed without a slug). If a concurrent request claims
+        the same slug first, the unique index rejects ours, only the
+        savepoint is rolled back and the next free slug is tried.
+        """
+        for attempt in range(max_attempts):
+            # The post may be pending without a slug; don't flush it yet
+            with db.session.no_autoflush:
+                slug = Post.generate_unique_slug(title, exclude_post_id=self.id)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(self)
+                    if not sa.inspect(self).has_identity:
+                        self.slug = slug
+                    else:
+                        self.change_slug(slug)
+                    db.session.flush()
+                return slug
+            except sa.exc.IntegrityError:
+                if attempt == max_attempts - 1:
+                    raise
+
+    def change_slug(self, new_slug):
+        """Gives the post a new slug, keeping the old one so its links redirect."""
+        old_slug = self.slug
+        if new_slug == old_slug:
+            return
+        # Each old slug points at one post; a slug in use again is live, not history
+        db.session.execute(sa.delete(SlugHistory).where(
+            SlugHistory.slug.in_([old_slug, new_slug])))
+        self.old_slugs.append(SlugHistory(slug=old_slug))
+        self.slug = new_slug
+
+
+class SlugHistory(db.Model):
+    """A slug a post used to have; requests for it are redirected to the post."""
+    __tablename__ = 'slug_history'
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(150), unique=True, index=True, nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Comment(db.Model):
@@ -80,15 +270,90 @@ class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, index=True,
-                          default=lambda: datetime.now(timezone.utc))
+                          default=datetime.utcnow)
+    # Set when the body is edited, so cached copies of the post are revalidated
+    edited_at = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('comments.id'))
+    # Direct replies to this comment, kept up to date by the comment routes
+    reply_count = db.Column(db.Integer, nullable=False, default=0,
+                            server_default='0')
     replies = db.relationship(
         'Comment', backref=db.backref('parent', remote_side=[id]),
         lazy='dynamic', cascade='all, delete-orphan'
     )
 
+    @staticmethod
+    def update_reply_counts(comment_ids=None):
+        """
+        Recounts direct replies for the given comment ids, or for every
+        comment if None. Only rows that were wrong are written; returns how
+        many. Runs inside the caller's transaction.
+        """
+        if comment_ids is not None and not comment_ids:
+            return 0
+        reply = so.aliased(Comment)
+        actual_count = (
+            sa.select(sa.func.count(reply.id))
+            .where(reply.parent_id == Comment.id)
+            .scalar_subquery()
+        )
+        stmt = (sa.update(Comment).values(reply_count=actual_count)
+                .where(Comment.reply_count != actual_count))
+        if comment_ids is not None:
+            stmt = stmt.where(Comment.id.in_(comment_ids))
+        db.session.flush()
+        return db.session.execute(
+            stmt.execution_options(synchronize_session=False)).rowcount
+
+    @staticmethod
+    def build_threads(top_level_comments):
+        """
+        Loads every reply beneath the given comments, at any depth, with one
+        recursive query (commenters included) and returns a CommentNode tree
+        per top-level comment, replies in posting order.
+        """
+        nodes = {comment.id: CommentNode(comment) for comment in top_level_comments}
+        if not nodes:
+            return []
+
+        subtree = (sa.select(Comment.id)
+                   .where(Comment.parent_id.in_(list(nodes)))
+                   .cte('reply_tree', recursive=True))
+        subtree = subtree.union_all(
+            sa.select(Comment.id).where(Comment.parent_id == subtree.c.id))
+        replies = db.session.scalars(
+            sa.select(Comment)
+            .options(so.joinedload(Comment.commenter))
+            .where(Comment.id.in_(sa.select(subtree.c.id)))
+            .order_by(Comment.timestamp.asc(), Comment.id.asc())
+        ).all()
+
+        for reply in replies:
+            nodes[reply.id] = CommentNode(reply)
+        for reply in replies:
+            nodes[reply.parent_id].replies.append(nodes[reply.id])
+        return [nodes[comment.id] for comment in top_level_comments]
+
+
+class CommentNode:
+    """A comment together with its already-loaded replies, for rendering threads."""
+
+    def __init__(self, comment):
+        self.comment = comment
+        self.replies = []
+
+
+class RelatedPost(db.Model):
+    """A precomputed "You Might Also Like" neighbour of a post (see app/related.py)."""
+    __tablename__ = 'related_posts'
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                           primary_key=True, index=True)
+    score = db.Column(db.Float, nullable=False)
+
 
 class CommentLike(db.Model):
     __tablename__ = 'comment_likes'
@@ -97,7 +362,7 @@ class CommentLike(db.Model):
     comment_id = db.Column(db.Integer, db.ForeignKey('comments.id'),
                            nullable=False)
     timestamp = db.Column(db.DateTime,
-                          default=lambda: datetime.now(timezone.utc))
+                          default=datetime.utcnow)
     user = db.relationship('User', backref='comment_likes')
     comment = db.relationship('Comment', backref='likes')
 
@@ -106,6 +371,52 @@ class Subscriber(db.Model):
     __tablename__ = 'subscribers'
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
-    subscribed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    subscribed_at = db.Column(db.DateTime, default=datetime.utcnow)
     confirmed = db.Column(db.Boolean, default=False)
     token = db.Column(db.String(100), unique=True)
+
+
+class OutboxMessage(db.Model):
+    """An email waiting in the outbox, or the record of one sent (see app/outbox.py)."""
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        # What drain_outbox() looks for: due messages of a given status
+        db.Index('ix_mail_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.Text, nullable=False)  # Comma-separated addresses
+    reply_to = db.Column(db.String(255))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    headers = db.Column(db.Text)  # Extra headers as a JSON object, e.g. List-Unsubscribe
+    # pending -> sending -> sent, back to pending to retry, or failed for good
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # When a pending message is due, or a sending one's claim runs out
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+
+class NewsletterBroadcast(db.Model):
+    """A post being mailed to the confirmed subscribers (see app/newsletter.py)."""
+    __tablename__ = 'newsletter_broadcasts'
+    id = db.Column(db.Integer, primary_key=True)
+    # Unique: a post is only ever broadcast once, however often it's republished
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='SET NULL'),
+                        unique=True)
+    subject = db.Column(db.String(255), nullable=False)
+    base_url = db.Column(db.String(255), nullable=False)  # For links in the email
+    # sending -> done, or cancelled if the post was unpublished or deleted
+    status = db.Column(db.String(10), nullable=False, default='sending')
+    # Subscribers up to this id have been queued in the outbox
+    last_subscriber_id = db.Column(db.Integer, nullable=False, default=0)
+    queued = db.Column(db.Integer, nullable=False, default=0)
+    # When the next queued message may go out, to keep to NEWSLETTER_SEND_RATE
+    next_send_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
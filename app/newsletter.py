@@ -0,0 +1,159 @@
+# app/newsletter.py
+"""
+Mailing a post to the confirmed newsletter subscribers.
+
+start_broadcast() records a NewsletterBroadcast in the transaction that
+publishes the post. The outbox's senders (app/outbox.py) then queue it a
+batch at a time as they wake: NEWSLETTER_BATCH_SIZE subscribers read in id
+order, one rendering of the email for the whole batch, and the messages
+added to the outbox in the same transaction that moves the broadcast's
+cursor past them. A crash loses at most an uncommitted batch, which the
+next sender queues again; no subscriber is queued twice.
+
+Each message carries List-Unsubscribe and List-Unsubscribe-Post headers
+(RFC 8058), so mail clients can offer one-click unsubscribing.
+
+Messages are queued with due times spaced NEWSLETTER_SEND_RATE a second
+apart, so the outbox sends them at that pace over its open connections,
+while confirmation emails queued meanwhile go out straight away.
+"""
+import json
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import current_app, request, url_for
+
+from app import db
+from app.models import NewsletterBroadcast, OutboxMessage, Post, Subscriber
+from app.outbox import wake_on_commit
+from app.signals import outbox_draining
+
+# Rendered into the email in place of each subscriber's token
+_TOKEN_PLACEHOLDER = 'subscribertoken'
+
+
+def start_broadcast(post):
+    """
+    Schedules a newly published post to be mailed to subscribers once the
+    caller commits. Returns the broadcast, or None if the post has had one.
+    """
+    if db.session.scalar(sa.select(NewsletterBroadcast.id)
+                         .where(NewsletterBroadcast.post_id == post.id)):
+        return None
+    broadcast = NewsletterBroadcast(
+        post_id=post.id,
+        subject=f"[{current_app.config.get('BLOG_NAME')}] {post.title}",
+        base_url=request.url_root)
+    db.session.add(broadcast)
+    wake_on_commit()
+    return broadcast
+
+
+def _render(post):
+    # jinja_env directly: render_template would run the sidebar context processor
+    env = current_app.jinja_env
+    context = {
+        'post': post,
+        'blog_name': current_app.config.get('BLOG_NAME'),
+        'post_url': url_for('main.post', slug=post.slug, _external=True),
+        'unsubscribe_url': url_for('main.unsubscribe', token=_TOKEN_PLACEHOLDER,
+                                   _external=True),
+    }
+    one_click_url = url_for('main.unsubscribe_one_click', token=_TOKEN_PLACEHOLDER,
+                            _external=True)
+    headers = {'List-Unsubscribe': f'<{one_click_url}>',
+               'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click'}
+    return (env.get_template('email/newsletter.txt').render(context),
+            env.get_template('email/newsletter.html').render(context),
+            json.dumps(headers))
+
+
+def _finish(broadcast, status):
+    broadcast.status = status
+    broadcast.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def queue_next_batch(broadcast_id, batch_size=None):
+    """
+    Queues the next batch of a broadcast's subscribers in the outbox.
+    Returns how many were queued; 0 once the broadcast is finished, or if
+    another sender queued this batch first.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('NEWSLETTER_BATCH_SIZE', 500)
+    broadcast = db.session.get(NewsletterBroadcast, broadcast_id)
+    if broadcast is None or broadcast.status != 'sending':
+        return 0
+    post = db.session.get(Post, broadcast.post_id) if broadcast.post_id else None
+    if post is None or not post.status:
+        _finish(broadcast, 'cancelled')
+        return 0
+
+    cursor = broadcast.last_subscriber_id
+    subscribers = db.session.execute(
+        sa.select(Subscriber.id, Subscriber.email, Subscriber.token)
+        .where(Subscriber.confirmed == True, Subscriber.id > cursor)
+        .order_by(Subscriber.id).limit(batch_size)).all()
+    if not subscribers:
+        _finish(broadcast, 'done')
+        return 0
+
+    # Move the cursor first: only one sender's UPDATE matches, and it holds
+    # the row until this batch's messages are committed with it
+    rate = config.get('NEWSLETTER_SEND_RATE', 10)
+    interval = timedelta(seconds=1 / rate) if rate else timedelta(0)
+    now = datetime.utcnow()
+    start = max(broadcast.next_send_at or now, now)
+    moved = db.session.execute(
+        sa.update(NewsletterBroadcast)
+        .where(NewsletterBroadcast.id == broadcast.id,
+               NewsletterBroadcast.last_subscriber_id == cursor)
+        .values(last_subscriber_id=subscribers[-1].id,
+                queued=NewsletterBroadcast.queued + len(subscribers),
+                next_send_at=start + interval * len(subscribers)),
+        execution_options={'synchronize_session': False})
+    if moved.rowcount != 1:
+        db.session.rollback()
+        return 0
+
+    with current_app.test_request_context(base_url=broadcast.base_url):
+        body, html, headers = _render(post)
+    sender = config.get('MAIL_DEFAULT_SENDER')
+    db.session.execute(sa.insert(OutboxMessage), [
+        {'subject': broadcast.subject, 'sender': sender, 'recipients': email,
+         'body': body.replace(_TOKEN_PLACEHOLDER, token or ''),
+         'html': html.replace(_TOKEN_PLACEHOLDER, token or ''),
+         'headers': headers.replace(_TOKEN_PLACEHOLDER, token or ''),
+         'next_attempt_at': start + interval * position}
+        for position, (_, email, token) in enumerate(subscribers)])
+    wake_on_commit()
+    db.session.commit()
+    return len(subscribers)
+
+
+def queue_broadcasts(batch_size=None):
+    """Queues every unfinished broadcast's remaining subscribers. Returns how many."""
+    total = 0
+    for broadcast_id in db.session.scalars(
+            sa.select(NewsletterBroadcast.id)
+            .where(NewsletterBroadcast.status == 'sending')
+            .order_by(NewsletterBroadcast.id)).all():
+        while queued := queue_next_batch(broadcast_id, batch_size):
+            total += queued
+    return total
+
+
+def broadcast_stats():
+    """Progress of the latest broadcasts, for /admin/mail-outbox."""
+    broadcasts = db.session.scalars(
+        sa.select(NewsletterBroadcast).order_by(NewsletterBroadcast.id.desc()).limit(10))
+    return [{'id': b.id, 'post_id': b.post_id, 'status': b.status, 'queued': b.queued,
+             'created_at': b.created_at.isoformat(),
+             'finished_at': b.finished_at.isoformat() if b.finished_at else None}
+            for b in broadcasts]
+
+
+@outbox_draining.connect
+def _queue_broadcasts(app, **extra):
+    queue_broadcasts()
@@ -0,0 +1,375 @@
+# app/outbox.py
+"""
+Outgoing email goes through the mail_outbox table instead of a thread per
+message.
+
+enqueue_email() adds a message in the caller's transaction, so it exists
+exactly when the write that prompted it (a signup, a subscription...) was
+committed, and survives a worker restart. drain_outbox() claims due
+messages, sends them over one SMTP connection and records what happened;
+failures are retried with exponential backoff until MAIL_OUTBOX_MAX_ATTEMPTS.
+Sent and failed messages are kept MAIL_OUTBOX_RETENTION_DAYS, then purged
+by whichever sender runs.
+
+Draining happens either in each app process, in a fixed pool of
+MAIL_OUTBOX_WORKERS threads started with its first request (so mail left
+over from before a restart goes out) and woken whenever a commit enqueued
+mail, or, with
+MAIL_OUTBOX_WORKERS = 0, in a separate `flask mail-worker` process. Each
+sender keeps its SMTP connection open while more mail is due within
+MAIL_OUTBOX_KEEPALIVE seconds, so throttled bulk mail (app/newsletter.py),
+which is queued with spaced-out due times, doesn't reconnect per message.
+"""
+import json
+import os
+import random
+import secrets
+import smtplib
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
+from flask_mail import Message
+
+from app import db, mail
+from app.models import OutboxMessage
+from app.signals import outbox_draining
+
+DRAINABLE = ('pending', 'sending')
+
+
+class OutboxMetrics:
+    """Counters for one process's deliveries, for /admin/mail-outbox."""
+
+    def __init__(self):
+        self.sent = self.retried = self.failed = self.batches = 0
+        self.send_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, sent=0, retried=0, failed=0, seconds=0.0):
+        with self._lock:
+            self.sent += sent
+            self.retried += retried
+            self.failed += failed
+            self.batches += 1
+            self.send_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'retried': self.retried, 'failed': self.failed,
+                    'batches': self.batches,
+                    'avg_send_ms': round(self.send_seconds * 1000 / self.sent, 1)
+                    if self.sent else None}
+
+
+def enqueue_email(subject, recipients, body=None, html=None, sender=None, reply_to=None,
+                  headers=None):
+    """
+    Adds an email to the outbox in the current transaction; it goes out once
+    the caller commits. `headers` is a dict of extra headers. Returns the
+    OutboxMessage.
+    """
+    message = OutboxMessage(
+        subject=subject,
+        sender=sender or current_app.config.get('MAIL_DEFAULT_SENDER'),
+        recipients=','.join(recipients), reply_to=reply_to, body=body, html=html,
+        headers=json.dumps(headers) if headers else None)
+    db.session.add(message)
+    wake_on_commit()
+    return message
+
+
+def wake_on_commit():
+    """Has the outbox's senders woken once the current transaction commits."""
+    db.session.info['outbox_enqueued'] = True
+
+
+def _backoff(attempts):
+    config = current_app.config
+    delay = min(config.get('MAIL_OUTBOX_BACKOFF_BASE', 30) * 2 ** (attempts - 1),
+                config.get('MAIL_OUTBOX_BACKOFF_MAX', 3600))
+    # Jitter so a burst that failed together doesn't retry together
+    return timedelta(seconds=delay + random.uniform(0, delay / 4))
+
+
+def _claim(batch_size, lease_seconds):
+    """Marks up to batch_size due messages as this caller's and returns them."""
+    now = datetime.utcnow()
+    due = [OutboxMessage.status.in_(DRAINABLE), OutboxMessage.next_attempt_at <= now]
+    ids = db.session.scalars(
+        sa.select(OutboxMessage.id).where(*due)
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(batch_size)).all()
+    if not ids:
+        return []
+    # Re-checked by the UPDATE, so two drainers never get the same message;
+    # a crashed drainer's claims lapse after lease_seconds
+    token = secrets.token_hex(16)
+    db.session.execute(
+        sa.update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids), *due)
+        .values(status='sending', claimed_by=token,
+                next_attempt_at=now + timedelta(seconds=lease_seconds)),
+        execution_options={'synchronize_session': False})
+    db.session.commit()
+    return db.session.scalars(
+        sa.select(OutboxMessage).where(OutboxMessage.claimed_by == token,
+                                       OutboxMessage.status == 'sending')
+        .order_by(OutboxMessage.id)).all()
+
+
+def _to_mail_message(message):
+    return Message(subject=message.subject, sender=message.sender,
+                   recipients=message.recipients.split(','),
+                   reply_to=message.reply_to, body=message.body, html=message.html,
+                   extra_headers=json.loads(message.headers) if message.headers else None)
+
+
+def _record_failure(message, error):
+    message.attempts += 1
+    message.last_error = str(error)[:1000]
+    message.claimed_by = None
+    if message.attempts >= current_app.config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        message.status = 'failed'
+        current_app.logger.error(
+            f"OUTBOX: giving up on message {message.id} to {message.recipients} "
+            f"after {message.attempts} attempts: {error}")
+        return 'failed'
+    message.status = 'pending'
+    message.next_attempt_at = datetime.utcnow() + _backoff(message.attempts)
+    return 'retried'
+
+
+def _send_batch(connection, claimed, outcomes):
+    """
+    Sends claimed messages over an open connection, committing each outcome.
+    Returns False if the connection was lost, after rescheduling the rest.
+    """
+    remaining = list(claimed)
+    try:
+        while remaining:
+            message = remaining[0]
+            try:
+                connection.send(_to_mail_message(message))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                    smtplib.SMTPSenderRefused) as e:
+                # The server turned down this message; the connection is fine
+                outcomes[_record_failure(message, e)] += 1
+            else:
+                message.status, message.claimed_by = 'sent', None
+                message.sent_at = datetime.utcnow()
+                message.attempts += 1
+                outcomes['sent'] += 1
+            remaining.pop(0)
+            db.session.commit()
+    except (smtplib.SMTPException, OSError) as e:
+        # Lost the connection: try the rest again later
+        current_app.logger.warning(f"OUTBOX: SMTP connection failed: {e}")
+        for message in remaining:
+            outcomes[_record_failure(message, e)] += 1
+        db.session.commit()
+        return False
+    return True
+
+
+def drain_outbox(batch_size=None, metrics=None, idle_wait=None):
+    """
+    Sends every due message, batch_size claimed at a time, over one SMTP
+    connection opened for the first of them. With idle_wait (a function
+    taking seconds), waits for mail due within MAIL_OUTBOX_KEEPALIVE
+    seconds on the same connection. Returns how many messages were claimed.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('MAIL_OUTBOX_BATCH_SIZE', 50)
+    lease = config.get('MAIL_OUTBOX_LEASE_SECONDS', 300)
+    keepalive = config.get('MAIL_OUTBOX_KEEPALIVE', 10)
+    total = 0
+    with ExitStack() as stack:
+        connection = None
+        while True:
+            claimed = _claim(batch_size, lease)
+            if not claimed:
+                wait = next_due_in()
+                if idle_wait is None or wait is None or wait > keepalive:
+                    return total
+                idle_wait(wait)
+                continue
+            total += len(claimed)
+            outcomes = {'sent': 0, 'retried': 0, 'failed': 0}
+            started = time.perf_counter()
+            if connection is None:
+                try:
+                    connection = stack.enter_context(mail.connect())
+                except (smtplib.SMTPException, OSError) as e:
+                    current_app.logger.warning(f"OUTBOX: SMTP connection failed: {e}")
+                    for message in claimed:
+                        outcomes[_record_failure(message, e)] += 1
+                    db.session.commit()
+                    connected = False
+                else:
+                    connected = _send_batch(connection, claimed, outcomes)
+            else:
+                connected = _send_batch(connection, claimed, outcomes)
+            if metrics is not None:
+                metrics.record(seconds=time.perf_counter() - started, **outcomes)
+            if not connected:
+                if connection is not None and connection.host is not None:
+                    # Don't QUIT over a broken connection on the way out
+                    stack.pop_all()
+                    connection.host.close()
+                return total
+
+
+def next_due_in():
+    """Seconds until the next pending message is due (0 if one is), or None."""
+    due = db.session.scalar(
+        sa.select(sa.func.min(OutboxMessage.next_attempt_at))
+        .where(OutboxMessage.status == 'pending'))
+    if due is None:
+        return None
+    return max((due - datetime.utcnow()).total_seconds(), 0)
+
+
+def purge_outbox(retention_days=None):
+    """
+    Deletes sent and failed messages older than MAIL_OUTBOX_RETENTION_DAYS
+    and commits. Returns how many were deleted.
+    """
+    if retention_days is None:
+        retention_days = current_app.config.get('MAIL_OUTBOX_RETENTION_DAYS', 30)
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = db.session.execute(
+        sa.delete(OutboxMessage)
+        .where(OutboxMessage.status.in_(('sent', 'failed')),
+               sa.func.coalesce(OutboxMessage.sent_at, OutboxMessage.created_at) < cutoff),
+        execution_options={'synchronize_session': False}).rowcount
+    db.session.commit()
+    return deleted
+
+
+def queue_stats():
+    """Messages per status and the age of the oldest one still waiting."""
+    counts = dict(db.session.execute(
+        sa.select(OutboxMessage.status, sa.func.count(OutboxMessage.id))
+        .group_by(OutboxMessage.status)).all())
+    oldest = db.session.scalar(
+        sa.select(sa.func.min(OutboxMessage.created_at))
+        .where(OutboxMessage.status.in_(DRAINABLE)))
+    return {'pending': counts.get('pending', 0), 'sending': counts.get('sending', 0),
+            'sent': counts.get('sent', 0), 'failed': counts.get('failed', 0),
+            'oldest_waiting_seconds':
+                round((datetime.utcnow() - oldest).total_seconds()) if oldest else None}
+
+
+class OutboxDispatcher:
+    """
+    A fixed pool of threads that drain the outbox when started, whenever
+    woken, when the next queued message falls due, and every poll_interval
+    seconds regardless. Threads start on the first request or wake in each
+    process, so forked server workers each start their own, and CLI
+    commands don't start any. Old messages are purged every
+    MAIL_OUTBOX_PURGE_INTERVAL seconds.
+    """
+
+    def __init__(self, app, workers=2, poll_interval=30):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.metrics = OutboxMetrics()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._pid = None  # The process the threads were started in
+        self._purged_at = None  # time.monotonic() of the last purge
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the threads in this process, which first drain any backlog."""
+        if not self.workers or self._pid == os.getpid():
+            return  # Left to `flask mail-worker`, or already running
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork; a child starts its own
+                self._pid, self._stopping = os.getpid(), False
+                self._threads = []
+                for number in range(self.workers):
+                    thread = threading.Thread(target=self._run, daemon=True,
+                                              name=f"mail-outbox-{number}")
+                    thread.start()
+                    self._threads.append(thread)
+        self._wake.set()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Lets the threads finish their current drain and exit."""
+        self._stopping = True
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _idle(self, seconds):
+        # Woken early by newly queued mail, which the next claim picks up
+        if self._wake.wait(seconds):
+            self._wake.clear()
+
+    def _purge_if_due(self):
+        interval = self.app.config.get('MAIL_OUTBOX_PURGE_INTERVAL', 3600)
+        with self._lock:
+            now = time.monotonic()
+            if self._purged_at is not None and now - self._purged_at < interval:
+                return
+            self._purged_at = now  # One thread purges; the others carry on
+        purge_outbox()
+
+    def _run(self):
+        timeout = self.poll_interval
+        while True:
+            self._wake.wait(timeout)
+            if self._stopping:
+                return
+            self._wake.clear()
+            timeout = self.poll_interval
+            with self.app.app_context():
+                try:
+                    outbox_draining.send(self.app)
+                    drain_outbox(metrics=self.metrics, idle_wait=self._idle)
+                    self._purge_if_due()
+                    due = next_due_in()
+                    if due is not None:
+                        timeout = min(due, self.poll_interval)
+                except Exception as e:
+                    self.app.logger.error(f"OUTBOX: drain failed: {e}", exc_info=True)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def init_outbox(app):
+    """Creates the outbox dispatcher sized by MAIL_OUTBOX_* settings."""
+    dispatcher = OutboxDispatcher(
+        app, app.config.get('MAIL_OUTBOX_WORKERS', 2),
+        app.config.get('MAIL_OUTBOX_POLL_INTERVAL', 30))
+    app.extensions['mail_outbox'] = dispatcher
+    # Not at import: under gunicorn that may be a parent process that forks
+    app.before_request(dispatcher.start)
+
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop('outbox_enqueued', False):
+        dispatcher = current_app.extensions.get('mail_outbox')
+        if dispatcher is not None:
+            dispatcher.wake()
+
+
+@sa.event.listens_for(so.Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('outbox_enqueued', None)
@@ -0,0 +1,206 @@
+# app/page_cache.py
+import hashlib
+import os
+import pickle
+import shutil
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, make_response, request, session, url_for
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from app.signals import post_changed, comment_changed
+
+# Per-visitor values in a rendered page are swapped for these markers before
+# the page is stored, and filled back in for whoever receives the cached copy.
+CSRF_PLACEHOLDER = b'__PAGE_CACHE_CSRF_TOKEN__'
+NONCE_PLACEHOLDER = b'__PAGE_CACHE_CSP_NONCE__'
+
+
+class MemoryPageCache:
+    """Keeps cached pages in a bounded, least-recently-used dict."""
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, path, variant):
+        with self._lock:
+            entry = self._entries.get((path, variant))
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                del self._entries[(path, variant)]
+                return None
+            self._entries.move_to_end((path, variant))
+            return entry
+
+    def set(self, path, variant, entry):
+        with self._lock:
+            self._entries[(path, variant)] = entry
+            self._entries.move_to_end((path, variant))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_path(self, path):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemPageCache:
+    """
+    Keeps cached pages as files under `cache_dir`, one directory per URL path,
+    so every worker process on the machine shares them (and their invalidations).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path_dir(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path.encode()).hexdigest())
+
+    def _entry_file(self, path, variant):
+        return os.path.join(self._path_dir(path),
+                            hashlib.sha1(variant.encode()).hexdigest())
+
+    def get(self, path, variant):
+        try:
+            with open(self._entry_file(path, variant), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        if entry['expires_at'] < time.time():
+            return None
+        return entry
+
+    def set(self, path, variant, entry):
+        entry_file = self._entry_file(path, variant)
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        # Write to a temp file and rename so readers never see half a page
+        tmp_file = f"{entry_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_file, entry_file)
+
+    def invalidate_path(self, path):
+        shutil.rmtree(self._path_dir(path), ignore_errors=True)
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+def init_page_cache(app):
+    """Creates the page cache backend named by PAGE_CACHE_BACKEND."""
+    backend = app.config.get('PAGE_CACHE_BACKEND', 'memory')
+    if backend == 'filesystem':
+        cache = FileSystemPageCache(app.config.get('PAGE_CACHE_DIR') or
+                                    os.path.join(app.instance_path, 'page_cache'))
+    elif backend == 'memory':
+        cache = MemoryPageCache(app.config.get('PAGE_CACHE_MAX_ENTRIES', 500))
+    else:
+        raise ValueError(f"Unknown PAGE_CACHE_BACKEND: {backend!r}")
+    app.extensions['page_cache'] = cache
+
+
+def _cache_variant():
+    """Everything besides the path that changes what an anonymous visitor sees."""
+    consent = request.cookies.get('cookie_consent', '')
+    return f"{request.host}|{request.query_string.decode()}|{consent}"
+
+
+def _request_is_cacheable():
+    return (current_app.config.get('PAGE_CACHE_ENABLED')
+            and request.method == 'GET'
+            and not current_user.is_authenticated
+            # A pending flash message would be baked into the page
+            and '_flashes' not in session)
+
+
+def _response_is_cacheable(response):
+    return (response.status_code == 200
+            and not response.direct_passthrough
+            and '_flashes' not in session)
+
+
+def _strip_visitor_values(body):
+    body = body.replace(generate_csrf().encode(), CSRF_PLACEHOLDER)
+    nonce = getattr(request, 'csp_nonce', None)
+    if nonce:
+        body = body.replace(nonce.encode(), NONCE_PLACEHOLDER)
+    return body
+
+
+def _fill_visitor_values(body):
+    body = body.replace(CSRF_PLACEHOLDER, generate_csrf().encode())
+    nonce = getattr(request, 'csp_nonce', None)
+    if nonce:
+        body = body.replace(NONCE_PLACEHOLDER, nonce.encode())
+    return body
+
+
+def cached_page(view):
+    """
+    Serves anonymous GETs of the wrapped view from the page cache.
+    Opt-in through PAGE_CACHE_ENABLED; logged-in users, non-GET requests
+    and anything involving flashed messages always bypass it.
+    """
+
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if not _request_is_cacheable():
+            return view(*args, **kwargs)
+
+        cache = current_app.extensions['page_cache']
+        variant = _cache_variant()
+        entry = cache.get(request.path, variant)
+        if entry is not None:
+            response = make_response(_fill_visitor_values(entry['body']),
+                                     entry['status'])
+            response.mimetype = entry['mimetype']
+            for header in ('ETag', 'Last-Modified'):
+                if entry.get(header):
+                    response.headers[header] = entry[header]
+            response.headers['X-Page-Cache'] = 'HIT'
+            # Answer the client's If-None-Match/If-Modified-Since too
+            return response.make_conditional(request)
+
+        response = make_response(view(*args, **kwargs))
+        if _response_is_cacheable(response):
+            cache.set(request.path, variant, {
+                'body': _strip_visitor_values(response.get_data()),
+                'status': response.status_code,
+                'mimetype': response.mimetype,
+                'ETag': response.headers.get('ETag'),
+                'Last-Modified': response.headers.get('Last-Modified'),
+                'expires_at': time.time() + current_app.config.get('PAGE_CACHE_TIMEOUT', 300),
+            })
+            response.headers['X-Page-Cache'] = 'MISS'
+        return response
+
+    return decorated_function
+
+
+@post_changed.connect
+def _clear_page_cache(app, **extra):
+    # Every page carries the sidebar's recent posts and tags, so drop them all
+    cache = app.extensions.get('page_cache')
+    if cache is not None:
+        cache.clear()
+
+
+@comment_changed.connect
+def _invalidate_post_page(app, post_slug=None, **extra):
+    cache = app.extensions.get('page_cache')
+    if cache is not None and post_slug:
+        cache.invalidate_path(url_for('main.post', slug=post_slug))
@@ -0,0 +1,90 @@
+# app/pagination.py
+import base64
+import binascii
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app import db
+
+
+def encode_cursor(values):
+    """Turns a (datetime, id) sort key into an opaque, URL-safe token."""
+    timestamp, row_id = values
+    raw = f"{timestamp.isoformat()}~{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Reverses encode_cursor(). Returns None for a malformed token."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, row_id = raw.rsplit('~', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+class KeysetPage:
+    """One page of keyset-paginated results, without a total count."""
+
+    def __init__(self, items, sort_columns, has_next, has_prev):
+        self.items = items
+        # An empty page (stale cursor, or past the end) has nowhere to link to
+        self.has_next = has_next and bool(items)
+        self.has_prev = has_prev and bool(items)
+        self._sort_keys = [tuple(getattr(item, column.key) for column in sort_columns)
+                           for item in items]
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self._sort_keys[-1]) if self.has_next else None
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self._sort_keys[0]) if self.has_prev else None
+
+
+def keyset_paginate(query, sort_columns, per_page, after=None, before=None,
+                    page=None):
+    """
+    Paginates `query` newest-first on `sort_columns` (a timestamp column
+    followed by the primary key) by seeking past a cursor instead of using
+    OFFSET, and without a COUNT(*).
+
+    `after`/`before` are tokens from a previous page's next_cursor/prev_cursor.
+    A plain `page` number is still honoured for old ?page= links; it is
+    served with a single OFFSET query but the page it returns links onward
+    with cursors.
+    """
+    sort_key = sa.tuple_(*sort_columns)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key is not None:
+        # Walk backwards (oldest-first) from the cursor, then flip the rows
+        rows = db.session.scalars(
+            query.where(sort_key > sa.tuple_(*before_key))
+            .order_by(*[column.asc() for column in sort_columns])
+            .limit(per_page + 1)
+        ).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(items, sort_columns, has_next=True, has_prev=has_prev)
+
+    ordered = query.order_by(*[column.desc() for column in sort_columns])
+    if after_key is not None:
+        ordered = ordered.where(sort_key < sa.tuple_(*after_key))
+        has_prev = True
+    elif page and page > 1:
+        ordered = ordered.offset((page - 1) * per_page)
+        has_prev = True
+    else:
+        has_prev = False
+
+    rows = db.session.scalars(ordered.limit(per_page + 1)).all()
+    items = rows[:per_page]
+    return KeysetPage(items, sort_columns, has_next=len(rows) > per_page,
+                      has_prev=has_prev)
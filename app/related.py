@@ -0,0 +1,108 @@
+# app/related.py
+"""
+Related-posts engine. Posts are compared by a weighted Jaccard score over
+their tags, where rarer tags weigh more (a smoothed IDF computed from
+Tag.post_count). The top neighbours of every published post are stored in
+the related_posts table, so a page view is a single indexed lookup.
+"""
+import math
+from collections import defaultdict
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app import db
+from app.models import Post, Tag, RelatedPost, post_tags
+
+
+def _published_tag_pairs(where_clause):
+    rows = db.session.execute(
+        sa.select(post_tags.c.post_id, post_tags.c.tag_id)
+        .join(Post, Post.id == post_tags.c.post_id)
+        .where(Post.status == True, Post.published_at != None, where_clause)
+    ).all()
+    tags_by_post = defaultdict(set)
+    for post_id, tag_id in rows:
+        tags_by_post[post_id].add(tag_id)
+    return tags_by_post
+
+
+def _tag_weights(tag_ids):
+    total_posts = db.session.scalar(
+        sa.select(sa.func.count(Post.id))
+        .where(Post.status == True, Post.published_at != None)) or 0
+    counts = dict(db.session.execute(
+        sa.select(Tag.id, Tag.post_count).where(Tag.id.in_(tag_ids))).all())
+    return {tag_id: math.log((total_posts + 1) / (counts.get(tag_id, 0) + 1)) + 1
+            for tag_id in tag_ids}
+
+
+def _score(tags_a, tags_b, weights):
+    shared = sum(weights[tag_id] for tag_id in tags_a & tags_b)
+    if not shared:
+        return 0.0
+    return shared / sum(weights[tag_id] for tag_id in tags_a | tags_b)
+
+
+def compute_related_posts(post_ids=None):
+    """
+    Recomputes and stores the neighbours of the given posts (all published
+    posts if None). Runs inside the caller's transaction; the caller commits.
+    Expects Tag.post_count to be current.
+    """
+    limit = current_app.config.get('RELATED_POSTS_COUNT', 3)
+    db.session.flush()
+
+    if post_ids is None:
+        target_tags = _published_tag_pairs(sa.true())
+        db.session.execute(sa.delete(RelatedPost))
+    else:
+        post_ids = list(post_ids)
+        if not post_ids:
+            return
+        target_tags = _published_tag_pairs(post_tags.c.post_id.in_(post_ids))
+        db.session.execute(sa.delete(RelatedPost).where(RelatedPost.post_id.in_(post_ids)))
+
+    all_tag_ids = set().union(*target_tags.values()) if target_tags else set()
+    if not all_tag_ids:
+        return
+
+    # Every published post sharing at least one tag with a target, with its full tag set
+    candidate_ids = db.session.scalars(
+        sa.select(post_tags.c.post_id).where(post_tags.c.tag_id.in_(all_tag_ids))
+        .distinct()).all()
+    candidate_tags = _published_tag_pairs(post_tags.c.post_id.in_(candidate_ids))
+    weights = _tag_weights(set().union(*candidate_tags.values()))
+
+    posts_by_tag = defaultdict(set)
+    for candidate_id, tags in candidate_tags.items():
+        for tag_id in tags:
+            posts_by_tag[tag_id].add(candidate_id)
+
+    rows = []
+    for post_id, tags in target_tags.items():
+        candidates = set().union(*(posts_by_tag[tag_id] for tag_id in tags))
+        candidates.discard(post_id)
+        scored = sorted(((_score(tags, candidate_tags[other], weights), other)
+                         for other in candidates), reverse=True)
+        rows.extend({'post_id': post_id, 'related_id': other, 'score': score}
+                    for score, other in scored[:limit])
+    if rows:
+        db.session.execute(sa.insert(RelatedPost), rows)
+
+
+def refresh_related_posts(post_ids, tag_ids):
+    """
+    Updates the neighbour lists affected by a change to some posts: the posts
+    themselves and every post that shares (or shared) a tag with them.
+    `tag_ids` must include the posts' tags from before the change.
+    """
+    post_ids = set(post_ids)
+    db.session.flush()
+    # The posts may have been deleted or unpublished; stop recommending them
+    db.session.execute(sa.delete(RelatedPost).where(
+        sa.or_(RelatedPost.post_id.in_(post_ids), RelatedPost.related_id.in_(post_ids))))
+    affected_ids = set(db.session.scalars(
+        sa.select(post_tags.c.post_id).where(post_tags.c.tag_id.in_(tag_ids)))) \
+        if tag_ids else set()
+    compute_related_posts(affected_ids | post_ids)
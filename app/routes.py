@@ -1,28 +1,39 @@
 import secrets
 import bleach
 
-from flask import make_response, jsonify, request, Response, send_from_directory
-from datetime import datetime, timezone
-from flask_mail import Message
-from app import mail, limiter, db
-from feedgen.feed import FeedGenerator
+from flask import make_response, jsonify, request, Response, send_from_directory, session
+from datetime import datetime
+from app import limiter, db, csrf
 from app.forms import (LoginForm, RegistrationForm, PostForm, CommentForm, ReplyForm,
                        ContactForm, RequestPasswordResetForm,
                        ResetPasswordForm, ChangePasswordForm, EditCommentForm,
                        SubscriptionForm, ChangeUsernameForm, DeleteAccountForm)
-from threading import Thread
 from flask import copy_current_request_context
 
 # --- Core Flask & Extension Imports ---
 from flask import (render_template, flash, redirect, url_for, request,
-                   Blueprint, current_app)
+                   Blueprint, current_app, abort)
 from flask_login import login_user, logout_user, current_user, login_required
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from functools import wraps
-import re
 
 # --- App Specific Imports ---
-from app.models import User, Post, Comment, Tag, Subscriber
+from app.models import User, Post, Comment, Tag, Subscriber, RelatedPost, SlugHistory
+from app.cache import slug_cache
+from app.related import refresh_related_posts
+from app.newsletter import broadcast_stats, start_broadcast
+from app.outbox import enqueue_email, queue_stats
+from app.search import did_you_mean, index_posts, search_posts
+from app.suggest import suggestion_index
+from app.signals import post_changed, comment_changed
+from app.page_cache import cached_page
+from app.feeds import FEED_MIMETYPES, SITE_FEED, get_feed
+from app.sitemap import (has_post_shard, index_chunks, pages_chunks, posts_chunks,
+                         sitemap_response)
+from app.conditional import make_etag, not_modified_response, set_validators
+from app.context_processors import cached_sidebar_data
+from app.pagination import keyset_paginate
 
 # --- Image Handling Imports ---
 from werkzeug.utils import secure_filename
@@ -32,11 +43,6 @@ import cloudinary.uploader
 # --- Create Blueprint ---
 bp = Blueprint('main', __name__)
 
-# === Helper Functions ===
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
 # --- Decorator for Admin Routes ---
 def admin_required(f):
     """Ensures the user is logged in and is an admin."""
@@ -55,14 +61,9 @@ def admin_required(f):
 # --- Helper function to upload to Cloudinary (MODIFIED for public_id) ---
 
 def send_confirmation_email(user):
-    """Generates a confirmation token and sends the email."""
+    """Generates a confirmation token and queues the email; the caller commits."""
     token = user.get_reset_password_token()
-    msg = Message(
-        subject=f"[{current_app.config.get('BLOG_NAME')}] Please Confirm Your Email",
-        sender=current_app.config.get('MAIL_DEFAULT_SENDER'),
-        recipients=[user.email]
-    )
-    msg.body = f"""Dear {user.username},
+    body = f"""Dear {user.username},
 
 Welcome to {current_app.config.get('BLOG_NAME')}!
 
@@ -74,7 +75,8 @@ If you did not sign up for an account, please ignore this email.
 Sincerely,
 The Liquid Blossom Team
 """
-    Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
+    enqueue_email(f"[{current_app.config.get('BLOG_NAME')}] Please Confirm Your Email",
+                  [user.email], body)
 
 def upload_to_cloudinary(file_to_upload):
     """
@@ -127,18 +129,66 @@ def upload_to_cloudinary(file_to_upload):
 
 # === End of upload_to_cloudinary function ===
 
-# --- Helper functions for RSS feed text processing ---
-def custom_striptags(html_string):
-    if not html_string: return ""
-    return re.sub(r'<[^>]+>', '', str(html_string))
+def assign_tags(post_obj, tag_string):
+    """
+    Replaces a post's tags with the comma-separated names in tag_string,
+    creating any tags that don't exist yet. Returns the ids of every tag
+    whose published post count may have changed (old and new tags).
+    """
+    affected_tags = set(post_obj.tags)
+    post_obj.tags.clear()
+    if tag_string:
+        tag_names = [name.strip().lower() for name in tag_string.split(',')
+                     if name.strip()]
+        for tag_name in tag_names:
+            with db.session.no_autoflush:
+                tag_obj = db.session.scalar(
+                    sa.select(Tag).filter_by(name=tag_name))
+            if tag_obj is None:
+                tag_obj = Tag(name=tag_name)
+                db.session.add(tag_obj)
+            if tag_obj not in post_obj.tags:
+                post_obj.tags.append(tag_obj)
+    affected_tags.update(post_obj.tags)
+    db.session.flush()  # Assigns ids to any new tags
+    return {tag_obj.id for tag_obj in affected_tags}
+
+def sync_post_changes(post_ids, tag_ids):
+    """
+    Updates everything derived from posts and their tags after the given
+    posts were created, edited or deleted: tag counts, related posts and the
+    search index. `tag_ids` are the tags the posts had before and after.
+    Call it before committing.
+    """
+    Tag.update_post_counts(tag_ids)
+    refresh_related_posts(post_ids, tag_ids)
+    index_posts(post_ids)
+
+def get_post_by_slug(slug):
+    """
+    Finds the post for a slug, checking the slug cache before the slug
+    index and falling back to old slugs. The returned post's slug differs
+    from the one asked for when it was found through its history.
+    """
+    post_id = slug_cache.get(slug)
+    if post_id is not None:
+        post_obj = db.session.get(Post, post_id)
+        if post_obj is not None and post_obj.slug == slug:
+            return post_obj
 
+    post_obj = db.session.scalar(sa.select(Post).filter_by(slug=slug))
+    if post_obj is not None:
+        slug_cache.set(slug, post_obj.id)
+        return post_obj
+    return db.session.scalar(
+        sa.select(Post).join(SlugHistory).where(SlugHistory.slug == slug))
 
-def custom_truncate(text, length=300, end='...'):
-    if not text: return ""
-    text_str = str(text)
-    if len(text_str) <= length:
-        return text_str
-    return text_str[:length - len(end)] + end
+def paginate_from_request(query, sort_columns, per_page):
+    """Keyset-paginates a listing using the cursor (or legacy ?page=) in the URL."""
+    return keyset_paginate(query, sort_columns, per_page,
+                           after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           page=request.args.get('page', 1, type=int))
 
 
 # === Health Check Route for Pinger Operation===
@@ -166,36 +216,67 @@ def before_request():
 
 @bp.route('/')
 @bp.route('/index')
+@cached_page
 def index():
     """Displays the homepage with paginated posts."""
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config.get('POSTS_PER_PAGE', 5)
-    query = sa.select(Post).where(Post.status == True,
-                                  Post.published_at != None).order_by(
-        Post.published_at.desc())
-    pagination = db.paginate(query, page=page, per_page=per_page,
-                             error_out=False)
+    query = Post.listing_select().where(Post.status == True,
+                                        Post.published_at != None)
+    pagination = paginate_from_request(query, (Post.published_at, Post.id),
+                                       per_page)
     posts = pagination.items
 
     next_url = url_for('main.index',
-                       page=pagination.next_num) if pagination.has_next else None
+                       after=pagination.next_cursor) if pagination.has_next else None
     prev_url = url_for('main.index',
-                       page=pagination.prev_num) if pagination.has_prev else None
+                       before=pagination.prev_cursor) if pagination.has_prev else None
 
     return render_template('index.html', title='Home', posts=posts,
                            next_url=next_url, prev_url=prev_url,
                            pagination=pagination)
 
 @bp.route('/post/<string:slug>', methods=['GET', 'POST'])
+@cached_page
 def post(slug):
     """Displays a single post and handles comment and reply submissions."""
-    post_obj = db.session.scalar(sa.select(Post).filter_by(slug=slug))
+    post_obj = get_post_by_slug(slug)
 
     if post_obj is None or (not post_obj.status and not (
             current_user.is_authenticated and current_user.is_admin)):
         flash('Post not found or is currently a draft.', 'warning')
         return redirect(url_for('main.index'))
 
+    # An old slug from before the title was edited
+    if post_obj.slug != slug and request.method == 'GET':
+        return redirect(url_for('main.post', slug=post_obj.slug,
+                                **request.args.to_dict()), 301)
+
+    # Anonymous readers (and crawlers) all get the same page, so it can be
+    # validated by everything it shows: the post's edit time, its latest new
+    # or edited comment, its related posts' edit times and the sidebar
+    use_validators = (request.method == 'GET'
+                      and not current_user.is_authenticated
+                      and '_flashes' not in session)
+    if use_validators:
+        latest_related = (
+            sa.select(sa.func.max(Post.updated_at))
+            .join(RelatedPost, RelatedPost.related_id == Post.id)
+            .where(RelatedPost.post_id == post_obj.id).scalar_subquery())
+        comment_count, latest_comment, latest_related = db.session.execute(
+            sa.select(sa.func.count(Comment.id),
+                      sa.func.max(sa.func.coalesce(Comment.edited_at, Comment.timestamp)),
+                      latest_related)
+            .where(Comment.post_id == post_obj.id)).one()
+        last_modified = max(filter(None, [post_obj.updated_at, latest_comment,
+                                          latest_related]), default=None)
+        etag = make_etag(post_obj.id, post_obj.updated_at, comment_count,
+                         latest_comment, latest_related,
+                         make_etag(cached_sidebar_data()), request.query_string,
+                         request.cookies.get('cookie_consent', ''))
+        not_modified = not_modified_response(etag, last_modified, weak=True)
+        if not_modified:
+            return not_modified
+
     comment_form = CommentForm()
     reply_form = ReplyForm()
 
@@ -220,7 +301,12 @@ def post(slug):
                             post=post_obj,
                             parent=parent_comment)
             db.session.add(reply)
+            # Bump the counters in SQL so concurrent comments can't lose an update
+            post_obj.comment_count = Post.comment_count + 1
+            parent_comment.reply_count = Comment.reply_count + 1
             db.session.commit()
+            comment_changed.send(current_app._get_current_object(),
+                                 post_id=post_obj.id, post_slug=post_obj.slug)
             flash('Your reply has been posted.', 'success')
         else:
             flash('Parent comment not found.', 'danger')
@@ -245,7 +331,10 @@ def post(slug):
                           commenter=current_user,
                           post=post_obj)
         db.session.add(comment)
+        post_obj.comment_count = Post.comment_count + 1
         db.session.commit()
+        comment_changed.send(current_app._get_current_object(),
+                             post_id=post_obj.id, post_slug=post_obj.slug)
         flash('Your comment has been published.', 'success')
         return redirect(url_for('main.post', slug=post_obj.slug,
                                 _anchor=f'comment-{comment.id}'))
@@ -253,30 +342,35 @@ def post(slug):
     # --- Paginate top-level comments ---
     page = request.args.get('page', 1, type=int)
     per_page = 5  # Comments per page
-    comments_query = post_obj.comments.filter(
+    comments_query = sa.select(Comment).options(
+        so.joinedload(Comment.commenter)).where(
+        Comment.post_id == post_obj.id,
         Comment.parent_id.is_(None)).order_by(Comment.timestamp.asc())
     comment_pagination = db.paginate(comments_query, page=page,
                                      per_page=per_page, error_out=False)
-    top_level_comments = comment_pagination.items
+    # Whole reply threads for this page, fetched in one query
+    comment_threads = Comment.build_threads(comment_pagination.items)
 
-    # Simple related posts query
+    # Neighbours are precomputed from tag overlap (see app/related.py)
     related_posts = []
     if post_obj.tags:
-        first_tag = post_obj.tags[0]
         related_posts = db.session.scalars(
             sa.select(Post)
-            .join(Post.tags)
-            .where(Tag.id == first_tag.id, Post.id != post_obj.id,
-                   Post.status == True)
-            .order_by(Post.published_at.desc())
-            .limit(3)
+            .join(RelatedPost, RelatedPost.related_id == Post.id)
+            .where(RelatedPost.post_id == post_obj.id, Post.status == True)
+            .options(so.defer(Post.body), so.defer(Post.plain_text))
+            .order_by(RelatedPost.score.desc(), Post.published_at.desc())
         ).all()
 
-    return render_template('post.html', title=post_obj.title, post=post_obj,
-                           comment_form=comment_form, reply_form=reply_form,
-                           comments=top_level_comments,
-                           comment_pagination=comment_pagination,
-                           related_posts=related_posts)
+    response = make_response(render_template(
+        'post.html', title=post_obj.title, post=post_obj,
+        comment_form=comment_form, reply_form=reply_form,
+        comments=comment_threads,
+        comment_pagination=comment_pagination,
+        related_posts=related_posts))
+    if use_validators:
+        set_validators(response, etag, last_modified, weak=True)
+    return response
 
 # === Public User Registration Route ===
 @bp.route('/signup', methods=['GET', 'POST'])
@@ -299,7 +393,6 @@ def signup():
         )
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
 
         if auto_confirm:
             user.confirmed_on = datetime.utcnow()
@@ -309,7 +402,11 @@ def signup():
                 'success')
             return redirect(url_for('main.login'))
         else:
+            # The token needs the user's id; the account and its email
+            # are committed together
+            db.session.flush()
             send_confirmation_email(user)
+            db.session.commit()
             flash(
                 'A confirmation email has been sent. Please check your inbox.',
                 'success')
@@ -344,13 +441,7 @@ def contact():
                 'danger')
             return redirect(url_for('main.contact'))
 
-        msg = Message(
-            subject=f"[{current_app.config.get('BLOG_NAME', 'Fragrance Blog')} Contact] {subject_from_form}",
-            sender=mail_default_sender,
-            recipients=[admin_email_recipient],
-            reply_to=sender_email
-        )
-        msg.body = f"""
+        body = f"""
         You have received a new message from your blog contact form:
 
         Name: {name}
@@ -363,13 +454,18 @@ def contact():
         Reply directly to {sender_email}.
         """
         try:
-            Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
+            enqueue_email(
+                f"[{current_app.config.get('BLOG_NAME', 'Fragrance Blog')} Contact] {subject_from_form}",
+                [admin_email_recipient], body, sender=mail_default_sender,
+                reply_to=sender_email)
+            db.session.commit()
             current_app.logger.info(
-                f"Contact form email sent from {sender_email} to {admin_email_recipient}")
+                f"Contact form email queued from {sender_email} to {admin_email_recipient}")
             flash(
                 'Your message has been sent successfully! We will get back to you soon.',
                 'success')
         except Exception as e:
+            db.session.rollback()
             current_app.logger.error(
                 f"Failed to send contact form email from {sender_email}: {e}",
                 exc_info=True)
@@ -382,11 +478,13 @@ def contact():
     return render_template('contact.html', title='Contact Us', form=form)
 
 @bp.route('/privacy-policy')
+@cached_page
 def privacy_policy():
     """Displays the privacy policy page."""
     return render_template('privacy_policy.html', title='Privacy Policy')
 
 @bp.route('/about')
+@cached_page
 def about():
     """Displays the about page."""
     return render_template('about.html', title='About')
@@ -406,14 +504,15 @@ def subscribe():
                 category = 'info'
             else:
                 send_subscription_confirmation_email(existing_subscriber)
+                db.session.commit()
                 msg = 'A new confirmation email has been sent. Please check your inbox.'
                 category = 'success'
         else:
             token = secrets.token_urlsafe(16)
             new_subscriber = Subscriber(email=email, token=token, confirmed=False)
             db.session.add(new_subscriber)
-            db.session.commit()
             send_subscription_confirmation_email(new_subscriber)
+            db.session.commit()
             msg = 'A confirmation email has been sent. Please check your inbox.'
             category = 'success'
 
@@ -451,6 +550,39 @@ def confirm_subscription(token):
 
     return redirect(url_for('main.index'))
 
+@bp.route('/unsubscribe/<token>', methods=['GET', 'POST'])
+def unsubscribe(token):
+    """
+    Removes a subscriber, from the link in every newsletter. A GET only asks
+    to confirm, so link scanners that follow it unsubscribe nobody.
+    """
+    subscriber = db.session.scalar(sa.select(Subscriber).filter_by(token=token))
+    if subscriber is None:
+        flash('That unsubscribe link is invalid or has already been used.', 'warning')
+        return redirect(url_for('main.index'))
+    if request.method == 'POST':
+        db.session.delete(subscriber)
+        db.session.commit()
+        flash('You have been unsubscribed and will not receive further emails.', 'info')
+        return redirect(url_for('main.index'))
+    return render_template('unsubscribe.html', title='Unsubscribe',
+                           subscriber=subscriber, token=token)
+
+
+@bp.route('/unsubscribe/<token>/one-click', methods=['GET', 'POST'])
+@csrf.exempt
+def unsubscribe_one_click(token):
+    """
+    The newsletter's List-Unsubscribe address (RFC 8058): mail clients POST
+    "List-Unsubscribe=One-Click" here, without a CSRF token, so the token in
+    the URL is all that authorises it. Anything else gets the confirmation page.
+    """
+    if request.method == 'GET' or request.form.get('List-Unsubscribe') != 'One-Click':
+        return redirect(url_for('main.unsubscribe', token=token))
+    db.session.execute(sa.delete(Subscriber).where(Subscriber.token == token))
+    db.session.commit()
+    return '', 204
+
 # === Authentication Routes ===
 @bp.route('/login', methods=['GET', 'POST'])
 @limiter.limit("20 per minute") # Increased from 5 to prevent false lockouts
@@ -525,9 +657,11 @@ def resend_confirmation():
         return redirect(url_for('main.index'))
     try:
         send_confirmation_email(current_user)
+        db.session.commit()
         flash('A new confirmation email has been sent to your email address.',
               'success')
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(
             f"Error resending confirmation for {current_user.email}: {e}",
             exc_info=True)
@@ -538,15 +672,9 @@ def resend_confirmation():
 
 # --- Password Reset Helper Function ---
 def send_password_reset_email_helper(user_obj):
-    """Generates reset token and sends password reset email."""
+    """Generates reset token and queues the password reset email."""
     token = user_obj.get_reset_password_token()
-    msg = Message(
-        subject=f"[{current_app.config.get('BLOG_NAME', 'Fragrance Blog')}] Password Reset Request",
-        sender=current_app.config.get('MAIL_DEFAULT_SENDER',
-                                      current_app.config.get('MAIL_USERNAME')),
-        recipients=[user_obj.email]
-    )
-    msg.body = f"""Dear {user_obj.username},
+    body = f"""Dear {user_obj.username},
 
 To reset your password, please visit the following link:
 {url_for('main.reset_password', token=token, _external=True)}
@@ -559,10 +687,14 @@ The Blog Team
 """
     try:
         if current_app.config.get('MAIL_SERVER'):
-            Thread(target=send_async_email,
-                   args=(current_app._get_current_object(), msg)).start()
+            enqueue_email(
+                f"[{current_app.config.get('BLOG_NAME', 'Fragrance Blog')}] Password Reset Request",
+                [user_obj.email], body,
+                sender=current_app.config.get('MAIL_DEFAULT_SENDER',
+                                              current_app.config.get('MAIL_USERNAME')))
+            db.session.commit()
             current_app.logger.info(
-                f"Password reset email successfully sent to {user_obj.email}")
+                f"Password reset email queued for {user_obj.email}")
         else:
             current_app.logger.warning(
                 f"Mail server not configured. Password reset email for {user_obj.email} NOT sent.")
@@ -574,6 +706,7 @@ The Blog Team
                 "Mail server not configured. For development, check console for reset link.",
                 "info")
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(
             f"Failed to send password reset email to {user_obj.email}: {e}",
             exc_info=True)
@@ -676,13 +809,34 @@ def account():
         original_username = current_user.username
         current_user.username = username_form.new_username.data
         db.session.commit()
+        # Their name is on every post, feed and listing of theirs; nothing
+        # about the posts changed, so no version would notice by itself
+        post_changed.send(current_app._get_current_object(), post_id=None,
+                          author_id=current_user.id)
         flash(f'Username successfully changed from "{original_username}" to "{current_user.username}".', 'success')
         return redirect(url_for('main.account'))
 
     if 'submit_delete' in request.form and delete_form.validate_on_submit():
         if current_user.check_password(delete_form.confirm_password.data):
+            # The user's posts go with them, so their tags need recounting
+            tag_ids = set(db.session.scalars(
+                sa.select(Tag.id).join(Post.tags)
+                .where(Post.user_id == current_user.id)))
+            deleted_post_ids = set(db.session.scalars(
+                sa.select(Post.id).where(Post.user_id == current_user.id)))
+            # ...and their comments (with any replies to them) leave other posts
+            commented_post_ids = set(db.session.scalars(
+                sa.select(Comment.post_id).where(Comment.user_id == current_user.id)))
+            replied_to_ids = set(db.session.scalars(
+                sa.select(Comment.parent_id).where(Comment.user_id == current_user.id,
+                                                   Comment.parent_id != None)))
             db.session.delete(current_user)
+            sync_post_changes(deleted_post_ids, tag_ids)
+            Post.update_comment_counts(commented_post_ids)
+            Comment.update_reply_counts(replied_to_ids)
             db.session.commit()
+            # Their posts and comments are gone too; no single post to point at
+            post_changed.send(current_app._get_current_object(), post_id=None)
             flash('Your account has been successfully deleted.', 'info')
             return redirect(url_for('main.index'))
         else:
@@ -696,17 +850,16 @@ def account():
 @admin_required
 def admin_dashboard():
     """Displays the admin dashboard with posts to manage."""
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config.get('ADMIN_POSTS_PER_PAGE', 10)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    pagination = db.paginate(query, page=page, per_page=per_page,
-                             error_out=False)
+    query = Post.listing_select(with_tags=False)
+    pagination = paginate_from_request(query, (Post.timestamp, Post.id),
+                                       per_page)
     posts = pagination.items
 
     next_url = url_for('main.admin_dashboard',
-                       page=pagination.next_num) if pagination.has_next else None
+                       after=pagination.next_cursor) if pagination.has_next else None
     prev_url = url_for('main.admin_dashboard',
-                       page=pagination.prev_num) if pagination.has_prev else None
+                       before=pagination.prev_cursor) if pagination.has_prev else None
 
     return render_template('admin/dashboard.html', title='Admin Dashboard',
                            posts=posts,
@@ -714,6 +867,22 @@ def admin_dashboard():
                            pagination=pagination)
 
 
+@bp.route('/admin/search-cache')
+@admin_required
+def search_cache_stats():
+    """Hit/miss counters for this worker's search result cache, as JSON."""
+    return jsonify(current_app.extensions['search_cache'].stats())
+
+
+@bp.route('/admin/mail-outbox')
+@admin_required
+def mail_outbox_stats():
+    """The outbox's backlog, and this worker's delivery counters, as JSON."""
+    return jsonify({'queue': queue_stats(),
+                    'workers': current_app.extensions['mail_outbox'].metrics.stats(),
+                    'broadcasts': broadcast_stats()})
+
+
 @bp.route('/admin/post/new', methods=['GET', 'POST'])
 @admin_required
 def create_post():
@@ -729,11 +898,11 @@ def create_post():
                     "Image upload failed, post will be created without an image.",
                     "warning")
 
-        new_slug = Post.generate_unique_slug(form.title.data)
+        # By id rather than author=, which would queue the post for the
+        # session through current_user before it has a slug
         post_obj = Post(title=form.title.data,
                         body=form.body.data,
-                        author=current_user,
-                        slug=new_slug,
+                        user_id=current_user.id,
                         image_url=image_url,
                         image_public_id=image_public_id,
                         status=form.status.data)
@@ -741,21 +910,16 @@ def create_post():
         if post_obj.status:
             post_obj.published_at = datetime.utcnow()
 
-        tag_string = form.tags.data
-        if tag_string:
-            tag_names = [name.strip().lower() for name in tag_string.split(',')
-                         if name.strip()]
-            for tag_name in tag_names:
-                tag_obj = db.session.scalar(
-                    sa.select(Tag).filter_by(name=tag_name))
-                if tag_obj is None:
-                    tag_obj = Tag(name=tag_name)
-                    db.session.add(tag_obj)
-                post_obj.tags.append(tag_obj)
-
-        db.session.add(post_obj)
         try:
+            post_obj.allocate_slug(form.title.data)  # Also adds it to the session
+            tag_ids = assign_tags(post_obj, form.tags.data)
+            sync_post_changes({post_obj.id}, tag_ids)
+            if post_obj.status and current_app.config.get('NEWSLETTER_ON_PUBLISH'):
+                start_broadcast(post_obj)
             db.session.commit()
+            post_changed.send(current_app._get_current_object(),
+                              post_id=post_obj.id, tag_ids=tag_ids,
+                              author_id=post_obj.user_id)
             flash('Your post has been created!', 'success')
             return redirect(url_for('main.admin_dashboard'))
         except Exception as e:
@@ -811,34 +975,33 @@ def edit_post(post_id):
                 flash("New image upload failed. Existing image was retained.",
                       "warning")
 
+        post_to_edit.updated_at = datetime.utcnow()
+        title_changed = post_to_edit.title != form.title.data
         post_to_edit.title = form.title.data
         post_to_edit.body = form.body.data
-        if post_to_edit.is_modified('title'):
-            post_to_edit.slug = Post.generate_unique_slug(post_to_edit.title)
 
         original_status = post_to_edit.status
         post_to_edit.status = form.status.data
+        publishing = post_to_edit.status and not original_status
         # If the post is being published for the first time
-        if post_to_edit.status and not original_status:
+        if publishing:
             post_to_edit.published_at = datetime.utcnow()
         # If a post is being unpublished, remove its publish date
         elif not post_to_edit.status:
             post_to_edit.published_at = None
 
-        post_to_edit.tags.clear()
-        tag_string = form.tags.data
-        if tag_string:
-            tag_names = [name.strip().lower() for name in tag_string.split(',')
-                         if name.strip()]
-            for tag_name in tag_names:
-                tag_obj = db.session.scalar(
-                    sa.select(Tag).filter_by(name=tag_name))
-                if tag_obj is None:
-                    tag_obj = Tag(name=tag_name)
-                    db.session.add(tag_obj)
-                post_to_edit.tags.append(tag_obj)
         try:
+            if title_changed:
+                post_to_edit.allocate_slug(post_to_edit.title)
+            tag_ids = assign_tags(post_to_edit, form.tags.data)
+            sync_post_changes({post_to_edit.id}, tag_ids)
+            # Only ever once per post; republishing doesn't mail it again
+            if publishing and current_app.config.get('NEWSLETTER_ON_PUBLISH'):
+                start_broadcast(post_to_edit)
             db.session.commit()
+            post_changed.send(current_app._get_current_object(),
+                              post_id=post_to_edit.id, tag_ids=tag_ids,
+                              author_id=post_to_edit.user_id)
             flash('Your post has been updated!', 'success')
             return redirect(url_for('main.post', slug=post_to_edit.slug))
         except Exception as e:
@@ -862,7 +1025,23 @@ def edit_post(post_id):
                                'TINYMCE_API_KEY'), post=post_to_edit)
 
 
+@bp.route('/admin/post/<int:post_id>/newsletter', methods=['POST'])
+@admin_required
+def send_newsletter(post_id):
+    """Mails a published post to the confirmed subscribers, if it hasn't been."""
+    post_to_send = db.get_or_404(Post, post_id)
+    if not post_to_send.status:
+        flash('Only published posts can be sent to subscribers.', 'warning')
+    elif start_broadcast(post_to_send) is None:
+        flash(f'"{post_to_send.title}" has already been sent to subscribers.', 'info')
+    else:
+        db.session.commit()
+        flash(f'"{post_to_send.title}" is being sent to subscribers.', 'success')
+    return redirect(url_for('main.admin_dashboard'))
+
+
 @bp.route('/tag/<string:tag_name>')
+@cached_page
 def tag(tag_name):
     """Displays posts associated with a specific tag."""
     tag_obj = db.session.scalar(sa.select(Tag).filter_by(name=tag_name.lower()))
@@ -870,20 +1049,19 @@ def tag(tag_name):
         flash(f'Tag "{tag_name}" not found.', 'warning')
         return redirect(url_for('main.index'))
 
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config.get('TAG_POSTS_PER_PAGE', 5)
-    query = sa.select(Post).join(Post.tags).where(Tag.id == tag_obj.id,
-                                                  Post.status == True,
-                                                  Post.published_at != None).order_by(
-        Post.published_at.desc())
-    pagination = db.paginate(query, page=page, per_page=per_page,
-                             error_out=False)
+    query = Post.listing_select().join(Post.tags).where(
+        Tag.id == tag_obj.id,
+        Post.status == True,
+        Post.published_at != None)
+    pagination = paginate_from_request(query, (Post.published_at, Post.id),
+                                       per_page)
     posts_on_page = pagination.items
 
     next_url = url_for('main.tag', tag_name=tag_name,
-                       page=pagination.next_num) if pagination.has_next else None
+                       after=pagination.next_cursor) if pagination.has_next else None
     prev_url = url_for('main.tag', tag_name=tag_name,
-                       page=pagination.prev_num) if pagination.has_prev else None
+                       before=pagination.prev_cursor) if pagination.has_prev else None
 
     return render_template('tag_posts.html', tag=tag_obj, posts=posts_on_page,
                            title=f"Posts tagged '{tag_obj.name}'",
@@ -912,8 +1090,13 @@ def delete_post(post_id):
                     "Post deleted, but failed to remove image from cloud storage.",
                     "warning")
 
+        tag_ids = {tag_obj.id for tag_obj in post_to_delete.tags}
+        author_id = post_to_delete.user_id
         db.session.delete(post_to_delete)
+        sync_post_changes({post_id}, tag_ids)
         db.session.commit()
+        post_changed.send(current_app._get_current_object(), post_id=post_id,
+                          tag_ids=tag_ids, author_id=author_id)
         flash(f'Post "{post_title}" has been deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -926,46 +1109,45 @@ def delete_post(post_id):
     return redirect(url_for('main.admin_dashboard'))
 
 
+def _feed_response(kind, scope=SITE_FEED, label=None):
+    feed = get_feed(kind, scope, label)
+    not_modified = not_modified_response(feed.etag, feed.last_modified)
+    if not_modified:
+        return not_modified
+    response = Response(feed.body, mimetype=FEED_MIMETYPES[kind])
+    return set_validators(response, feed.etag, feed.last_modified)
+
+
 @bp.route('/feed.xml')
 def rss_feed():
-    """Generates the RSS feed for the blog."""
-    fg = FeedGenerator()
-
-    blog_name = current_app.config.get('BLOG_NAME', 'My Fragrance Blog')
-    blog_author_name = current_app.config.get('BLOG_AUTHOR_NAME', 'Blog Admin')
-    blog_author_email = current_app.config.get('BLOG_AUTHOR_EMAIL',
-                                               'noreply@example.com')
-    posts_for_feed = current_app.config.get('RSS_FEED_POST_LIMIT', 20)
-
-    fg.id(request.url_root)
-    fg.title(f'{blog_name} - Latest Posts')
-    fg.link(href=url_for('main.index', _external=True), rel='alternate')
-    fg.subtitle(current_app.config.get('BLOG_SUBTITLE',
-                                       'Reviews, musings, and guides on the world of scents.'))
-    fg.language(current_app.config.get('BLOG_LANGUAGE', 'en'))
-    fg.author({'name': blog_author_name, 'email': blog_author_email})
-    fg.link(href=url_for('main.rss_feed', _external=True), rel='self')
-
-    latest_posts = db.session.scalars(sa.select(Post).where(Post.status == True,
-                                                            Post.published_at != None).order_by(
-        Post.published_at.desc()).limit(20)).all()
-
-
-    for post_item in latest_posts:
-        fe = fg.add_entry()
-        entry_url = url_for('main.post', slug=post_item.slug, _external=True)
-        fe.id(entry_url)
-        fe.title(post_item.title)
-        fe.link(href=entry_url)
-        stripped_body = custom_striptags(post_item.body)
-        summary = custom_truncate(stripped_body, length=300, end='...')
-        fe.summary(summary)
-        fe.pubDate(post_item.timestamp)
-        if post_item.author:
-            fe.author({'name': post_item.author.username})
-
-    rss_feed_xml = fg.rss_str(pretty=True)
-    return Response(rss_feed_xml, mimetype='application/rss+xml')
+    """Serves the pre-rendered RSS feed of the latest posts."""
+    return _feed_response('rss')
+
+
+@bp.route('/feed.atom')
+def atom_feed():
+    """Serves the pre-rendered Atom feed of the latest posts."""
+    return _feed_response('atom')
+
+
+@bp.route('/feed.json')
+def json_feed():
+    """Serves the pre-rendered JSON Feed of the latest posts."""
+    return _feed_response('json')
+
+
+@bp.route('/tag/<tag_name>/feed.xml')
+def tag_feed(tag_name):
+    """Serves the RSS feed of the latest posts with one tag."""
+    tag_obj = db.first_or_404(sa.select(Tag).filter_by(name=tag_name.lower()))
+    return _feed_response('rss', ('tag', tag_obj.id), tag_obj.name)
+
+
+@bp.route('/author/<username>/feed.xml')
+def author_feed(username):
+    """Serves the RSS feed of the latest posts by one author."""
+    user = db.first_or_404(sa.select(User).filter_by(username=username))
+    return _feed_response('rss', ('author', user.id), user.username)
 
 
 @bp.route('/comment/<int:comment_id>/edit', methods=['GET', 'POST'])
@@ -982,9 +1164,13 @@ def edit_comment(comment_id):
         # FIX: Bleach the edited input before saving it to the database
         clean_edit_body = bleach.clean(form.body.data)
         comment.body = clean_edit_body
+        comment.edited_at = datetime.utcnow()
 
         try:
             db.session.commit()
+            comment_changed.send(current_app._get_current_object(),
+                                 post_id=comment.post_id,
+                                 post_slug=comment.post.slug)
             flash('Your comment has been updated.', 'success')
             return redirect(url_for('main.post', slug=comment.post.slug,
                                     _anchor=f'comment-{comment.id}'))
@@ -1014,8 +1200,16 @@ def delete_comment(comment_id):
         return redirect(url_for('main.post', slug=post_slug))
 
     try:
+        post_id = comment.post_id
+        parent_id = comment.parent_id
+        # Replies are deleted along with the comment, so recount rather than decrement
         db.session.delete(comment)
+        Post.update_comment_counts([post_id])
+        if parent_id:
+            Comment.update_reply_counts([parent_id])
         db.session.commit()
+        comment_changed.send(current_app._get_current_object(),
+                             post_id=post_id, post_slug=post_slug)
         flash('Your comment has been deleted.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1039,87 +1233,86 @@ def search():
 
     if not query_param:
         return render_template('search_results.html', title="Search", query='',
-                               posts=[], pagination=None)
+                               posts=[], snippets={}, next_url=None, prev_url=None,
+                               corrected_query=None, suggestions=[])
 
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config.get('SEARCH_RESULTS_PER_PAGE', 10)
-    search_term = f"%{query_param}%"
-
-    query = sa.select(Post).where(
-        Post.status == True,
-        sa.or_(
-            Post.title.ilike(search_term),
-            Post.body.ilike(search_term)
-        )
-    ).order_by(Post.published_at.desc())
-
-    pagination = db.paginate(query, page=page, per_page=per_page,
-                             error_out=False)
-    posts = pagination.items
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    # Ranked hits from the full-text index, one extra to see if there's more
+    hits = search_posts(query_param, limit=per_page + 1,
+                        offset=(page - 1) * per_page)
+
+    # Nothing found: try the closest spellings that do find something
+    corrected_query, suggestions = None, []
+    if not hits and page == 1:
+        suggestions = [candidate for candidate in did_you_mean(query_param)
+                       if search_posts(candidate, limit=per_page + 1)]
+        if suggestions:
+            corrected_query = suggestions.pop(0)
+            hits = search_posts(corrected_query, limit=per_page + 1)
+    shown_query = corrected_query or query_param
+
+    has_next = len(hits) > per_page
+    snippets = {hit.post_id: hit.snippet for hit in hits[:per_page]}
+    posts_by_id = {p.id: p for p in db.session.scalars(
+        Post.listing_select().where(Post.id.in_(snippets)))}
+    posts = [posts_by_id[post_id] for post_id in snippets if post_id in posts_by_id]
+
+    next_url = url_for('main.search', q=shown_query,
+                       page=page + 1) if has_next else None
+    prev_url = url_for('main.search', q=shown_query,
+                       page=page - 1) if page > 1 and posts else None
 
     return render_template('search_results.html',
                            title=f"Search Results for '{query_param}'",
                            query=query_param,
-                           posts=posts,
-                           pagination=pagination)
+                           posts=posts, snippets=snippets,
+                           next_url=next_url, prev_url=prev_url,
+                           corrected_query=corrected_query,
+                           suggestions=suggestions)
+
+
+@bp.route('/search/suggest')
+@limiter.limit(lambda: current_app.config.get('SUGGEST_RATE_LIMIT', "60 per minute"))
+def search_suggest():
+    """Typeahead suggestions (post titles and tags) for the search box, as JSON."""
+    query_param = request.args.get('q', '', type=str).strip()
+    if len(query_param) < 2:
+        return jsonify(query=query_param, suggestions=[])
+
+    suggestions = []
+    for kind, label, target in suggestion_index.suggest(
+            query_param, limit=current_app.config.get('SUGGEST_MAX_RESULTS', 8),
+            timeout=current_app.config.get('SUGGEST_INDEX_TIMEOUT', 600)):
+        if kind == 'post':
+            url = url_for('main.post', slug=target)
+        else:
+            url = url_for('main.tag', tag_name=target)
+        suggestions.append({'type': kind, 'label': label, 'url': url})
+    return jsonify(query=query_param, suggestions=suggestions)
 
 
 @bp.route('/sitemap.xml')
 def sitemap():
-    """Generates an XML sitemap for search engines."""
-    pages_for_sitemap = []
-
-    static_page_definitions = [
-        {'endpoint': 'main.index', 'priority': '1.0', 'changefreq': 'daily'},
-        {'endpoint': 'main.contact', 'priority': '0.7',
-         'changefreq': 'monthly'},
-    ]
-    for page_def in static_page_definitions:
-        try:
-            pages_for_sitemap.append({
-                'loc': url_for(page_def['endpoint'], _external=True),
-                'lastmod': datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-                'priority': page_def['priority'],
-                'changefreq': page_def['changefreq']
-            })
-        except Exception as e:
-            current_app.logger.error(
-                f"Error generating URL for static sitemap page '{page_def['endpoint']}': {e}")
+    """Sitemap index for search engines, listing the child sitemaps below."""
+    return sitemap_response('index', index_chunks)
 
-    try:
-        posts = db.session.scalars(
-            sa.select(Post).order_by(Post.timestamp.desc())).all()
-        for post_item in posts:
-            pages_for_sitemap.append({
-                'loc': url_for('main.post', slug=post_item.slug,
-                               _external=True),
-                'lastmod': post_item.timestamp.strftime("%Y-%m-%d"),
-                'priority': '0.9',
-                'changefreq': 'weekly'
-            })
-    except Exception as e:
-        current_app.logger.error(f"Error fetching posts for sitemap: {e}",
-                                 exc_info=True)
 
-    try:
-        tags = db.session.scalars(sa.select(Tag).order_by(Tag.name)).all()
-        for tag_item in tags:
-            pages_for_sitemap.append({
-                'loc': url_for('main.tag', tag_name=tag_item.name,
-                               _external=True),
-                'lastmod': datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-                'priority': '0.5',
-                'changefreq': 'weekly'
-            })
-    except Exception as e:
-        current_app.logger.error(f"Error fetching tags for sitemap: {e}",
-                                 exc_info=True)
+@bp.route('/sitemap-pages.xml')
+def sitemap_pages():
+    """Sitemap of the home, contact and tag pages."""
+    return sitemap_response('pages', pages_chunks)
 
-    sitemap_xml_content = render_template('sitemap_template.xml',
-                                          pages=pages_for_sitemap)
-    response = make_response(sitemap_xml_content)
-    response.headers["Content-Type"] = "application/xml"
-    return response
+
+@bp.route('/sitemap-posts-<int:shard>.xml')
+def sitemap_posts(shard):
+    """Sitemap of the published posts in one SITEMAP_MAX_URLS-wide range of ids."""
+    # Only the shards the index lists; any other number would be an empty,
+    # cached sitemap
+    if not has_post_shard(shard):
+        abort(404)
+    return sitemap_response(f'posts-{shard}', lambda version: posts_chunks(shard))
 
 
 # === ADMIN ACCOUNT MANAGEMENT ROUTE (CORRECTED) ===
@@ -1181,6 +1374,10 @@ def change_username():
         original_username = current_user.username
         current_user.username = username_form.new_username.data
         db.session.commit()
+        # Their name is on every post, feed and listing of theirs; nothing
+        # about the posts changed, so no version would notice by itself
+        post_changed.send(current_app._get_current_object(), post_id=None,
+                          author_id=current_user.id)
         flash(
             f'Username successfully changed from "{original_username}" to "{current_user.username}".',
             'success')
@@ -1207,14 +1404,9 @@ def set_cookie_consent():
 
 # === Helper function to send subscription confirmation email ===
 def send_subscription_confirmation_email(subscriber):
-    """Generates a confirmation token and sends the email."""
+    """Queues the subscription confirmation email; the caller commits."""
     token = subscriber.token
-    msg = Message(
-        subject=f"[{current_app.config.get('BLOG_NAME')}] Please Confirm Your Subscription",
-        sender=current_app.config.get('MAIL_DEFAULT_SENDER'),
-        recipients=[subscriber.email]
-    )
-    msg.body = f"""Dear reader,
+    body = f"""Dear reader,
 
     Thank you for your interest in {current_app.config.get('BLOG_NAME')}!
 
@@ -1226,4 +1418,5 @@ def send_subscription_confirmation_email(subscriber):
     Sincerely,
     The Liquid Blossom Team
     """
-    Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
+    enqueue_email(f"[{current_app.config.get('BLOG_NAME')}] Please Confirm Your Subscription",
+                  [subscriber.email], body)
@@ -0,0 +1,489 @@
+# app/search.py
+"""
+Full-text search over published posts: title, plain-text body and tag names.
+
+SQLite keeps them in an FTS5 table ranked with BM25; PostgreSQL keeps a
+weighted tsvector per post under a GIN index, ranked with ts_rank. Both sit
+behind the same functions: index_posts() after a post changes, search_posts()
+to query, rebuild_index() to start over.
+
+Result snippets are cut from the body by the database around the matches,
+with the matches marked; Snippet turns that into offsets and escaped HTML.
+
+Misspelled searches ('xerjof', 'tobaco') fall back to did_you_mean(), which
+looks the words up in a trigram index of the words in titles and tag names:
+pg_trgm's GIN index on PostgreSQL, a trigram -> word table on SQLite.
+"""
+import re
+import time
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+import sqlalchemy as sa
+from flask import current_app
+from markupsafe import Markup, escape
+
+from app import db
+from app.signals import post_changed
+from app.suggest import normalize
+
+# Terms beyond this are ignored; a search box isn't a place for essays
+MAX_TERMS = 10
+# Body words per result snippet
+SNIPPET_WORDS = 40
+# The database wraps each match in these control characters
+MATCH_START, MATCH_END = '\x02', '\x03'
+# Shorter words are too short to have useful trigrams
+MIN_WORD_LENGTH = 3
+# Words sharing the most trigrams with a misspelling, before scoring
+TRIGRAM_CANDIDATES = 50
+
+SearchHit = namedtuple('SearchHit', 'post_id snippet')
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_search "
+    "USING fts5(title, body, tags, tokenize='porter unicode61')",
+    "CREATE TABLE IF NOT EXISTS post_search_words ("
+    "word TEXT PRIMARY KEY, trigram_count INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS post_search_trigrams ("
+    "trigram TEXT NOT NULL, word TEXT NOT NULL, "
+    "PRIMARY KEY (trigram, word)) WITHOUT ROWID",
+]
+POSTGRES_DDL = [
+    "CREATE TABLE IF NOT EXISTS post_search ("
+    "post_id INTEGER PRIMARY KEY REFERENCES posts (id) ON DELETE CASCADE, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_post_search_document "
+    "ON post_search USING GIN (document)",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE IF NOT EXISTS post_search_words (word TEXT PRIMARY KEY)",
+    "CREATE INDEX IF NOT EXISTS ix_post_search_words_trgm "
+    "ON post_search_words USING GIN (word gin_trgm_ops)",
+]
+
+# The published posts to (re)index, with their tags as one string.
+# {tag_list} is the dialect's string aggregate; {post_filter} narrows it down.
+_DOCUMENTS_SQL = """
+    SELECT posts.id AS post_id, posts.title AS title,
+           COALESCE(posts.plain_text, '') AS body,
+           COALESCE((SELECT {tag_list} FROM tags
+                     JOIN post_tags ON post_tags.tag_id = tags.id
+                     WHERE post_tags.post_id = posts.id), '') AS tags
+    FROM posts
+    WHERE posts.status = :published AND posts.published_at IS NOT NULL {post_filter}
+"""
+
+# The titles and tag names of the published posts, for the trigram index
+_VOCABULARY_SQL = """
+    SELECT posts.title FROM posts
+    WHERE posts.status = :published AND posts.published_at IS NOT NULL {post_filter}
+    UNION
+    SELECT tags.name FROM tags
+    JOIN post_tags ON post_tags.tag_id = tags.id
+    JOIN posts ON posts.id = post_tags.post_id
+    WHERE posts.status = :published AND posts.published_at IS NOT NULL {post_filter}
+"""
+
+
+def search_terms(query):
+    """Splits a raw search box query into at most MAX_TERMS lower-case words."""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+class Snippet:
+    """
+    A piece of text and the (start, end) offsets of the matches in it.
+    Renders in templates as escaped HTML with the matches in <mark>.
+    """
+
+    def __init__(self, text, highlights=()):
+        self.text = text
+        self.highlights = list(highlights)
+
+    @classmethod
+    def from_marked(cls, marked):
+        """Builds a Snippet from text with MATCH_START/MATCH_END around matches."""
+        text, highlights, start = [], [], None
+        length = 0
+        for part in re.split(f'([{MATCH_START}{MATCH_END}])', marked or ''):
+            if part == MATCH_START:
+                start = length
+            elif part == MATCH_END:
+                if start is not None and length > start:
+                    highlights.append((start, length))
+                start = None
+            else:
+                text.append(part)
+                length += len(part)
+        return cls(''.join(text), highlights)
+
+    def __html__(self):
+        html, position = [], 0
+        for start, end in self.highlights:
+            html.append(escape(self.text[position:start]))
+            html.append(Markup('<mark>%s</mark>') % self.text[start:end])
+            position = end
+        html.append(escape(self.text[position:]))
+        return Markup('').join(html)
+
+    def __str__(self):
+        return self.text
+
+    def __bool__(self):
+        return bool(self.text)
+
+
+@lru_cache(maxsize=256)
+def _terms_pattern(terms):
+    # Longest first so 'roses' isn't cut short by 'rose'; prefixes, like the index
+    alternatives = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf'\b(?:{alternatives})\w*', re.IGNORECASE)
+
+
+def highlight(text, query):
+    """
+    Jinja filter: marks every word in `text` starting with one of the
+    query's terms. The result is escaped, so any text is safe to pass.
+    """
+    terms = tuple(search_terms(query))
+    if not text or not terms:
+        return Snippet(text or '')
+    return Snippet(text, [match.span() for match in _terms_pattern(terms).finditer(text)])
+
+
+def trigrams(word):
+    """The word's trigrams, padded the way pg_trgm pads them: 'oud' -> '  o', ' ou', 'oud', 'ud '."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _vocabulary(texts):
+    # Accents are dropped so 'epice' finds 'Épice'; numbers aren't misspelled
+    return {word for text in texts for word in re.findall(r'\w+', normalize(text))
+            if len(word) >= MIN_WORD_LENGTH and not word.isdigit()}
+
+
+class SQLiteSearch:
+    """FTS5 table keyed by post id (its rowid)."""
+
+    def _documents(self, post_filter=''):
+        return _DOCUMENTS_SQL.format(tag_list="group_concat(tags.name, ' ')",
+                                     post_filter=post_filter)
+
+    def index_posts(self, post_ids):
+        params = {'ids': list(post_ids), 'published': True}
+        db.session.execute(sa.text(
+            "DELETE FROM post_search WHERE rowid IN :ids"
+        ).bindparams(sa.bindparam('ids', expanding=True)), params)
+        db.session.execute(sa.text(
+            "INSERT INTO post_search (rowid, title, body, tags) "
+            "SELECT post_id, title, body, tags FROM ("
+            + self._documents('AND posts.id IN :ids') + ")"
+        ).bindparams(sa.bindparam('ids', expanding=True)), params)
+
+    def rebuild(self):
+        db.session.execute(sa.text("DELETE FROM post_search"))
+        db.session.execute(sa.text(
+            "INSERT INTO post_search (rowid, title, body, tags) "
+            "SELECT post_id, title, body, tags FROM (" + self._documents() + ")"),
+            {'published': True})
+        db.session.execute(sa.text("DELETE FROM post_search_trigrams"))
+        db.session.execute(sa.text("DELETE FROM post_search_words"))
+
+    def add_words(self, words):
+        known = set(db.session.scalars(sa.text(
+            "SELECT word FROM post_search_words WHERE word IN :words"
+        ).bindparams(sa.bindparam('words', expanding=True)), {'words': list(words)}))
+        new_words = sorted(set(words) - known)
+        if not new_words:
+            return
+        db.session.execute(sa.text(
+            "INSERT INTO post_search_words (word, trigram_count) VALUES (:word, :count)"),
+            [{'word': word, 'count': len(trigrams(word))} for word in new_words])
+        db.session.execute(sa.text(
+            "INSERT INTO post_search_trigrams (trigram, word) VALUES (:trigram, :word)"),
+            [{'trigram': trigram, 'word': word}
+             for word in new_words for trigram in trigrams(word)])
+
+    def similar_words(self, word, threshold, limit):
+        # Only the postings of the word's own trigrams are read; the score is
+        # pg_trgm's: shared trigrams over all the trigrams of either word
+        word_trigrams = trigrams(word)
+        return db.session.execute(sa.text("""
+            SELECT post_search_words.word,
+                   shared * 1.0 / (:size + trigram_count - shared) AS score
+            FROM (SELECT word, count(*) AS shared FROM post_search_trigrams
+                  WHERE trigram IN :trigrams GROUP BY word
+                  ORDER BY shared DESC LIMIT :candidates) AS matches
+            JOIN post_search_words ON post_search_words.word = matches.word
+            WHERE shared * 1.0 / (:size + trigram_count - shared) >= :threshold
+            ORDER BY score DESC, post_search_words.word
+            LIMIT :limit
+        """).bindparams(sa.bindparam('trigrams', expanding=True)),
+            {'trigrams': sorted(word_trigrams), 'size': len(word_trigrams),
+             'candidates': TRIGRAM_CANDIDATES, 'threshold': threshold,
+             'limit': limit}).all()
+
+    def search(self, terms, limit, offset):
+        # Each term is quoted (so it can't be FTS syntax) and prefix-matched
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # Rank everything, but only cut snippets for the page being shown
+        return db.session.execute(sa.text("""
+            SELECT rowid, snippet(post_search, 1, :mark_start, :mark_end, '…', :words)
+            FROM post_search
+            WHERE post_search MATCH :match AND rowid IN (
+                SELECT post_search.rowid FROM post_search
+                JOIN posts ON posts.id = post_search.rowid
+                WHERE post_search MATCH :match
+                  AND posts.status = :published AND posts.published_at IS NOT NULL
+                ORDER BY bm25(post_search, 10.0, 1.0, 5.0), posts.id DESC
+                LIMIT :limit OFFSET :offset)
+            ORDER BY bm25(post_search, 10.0, 1.0, 5.0), rowid DESC
+        """), {'match': match, 'published': True, 'limit': limit, 'offset': offset,
+               'mark_start': MATCH_START, 'mark_end': MATCH_END,
+               'words': SNIPPET_WORDS}).all()
+
+
+class PostgresSearch:
+    """tsvector per post: title weighted A, tags B, body C."""
+
+    _DOCUMENT_VECTOR = (
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', tags), 'B') || "
+        "setweight(to_tsvector('english', body), 'C')")
+
+    def _documents(self, post_filter=''):
+        return _DOCUMENTS_SQL.format(tag_list="string_agg(tags.name, ' ')",
+                                     post_filter=post_filter)
+
+    def index_posts(self, post_ids):
+        params = {'ids': list(post_ids), 'published': True}
+        db.session.execute(sa.text(
+            "DELETE FROM post_search WHERE post_id IN :ids"
+        ).bindparams(sa.bindparam('ids', expanding=True)), params)
+        db.session.execute(sa.text(
+            f"INSERT INTO post_search (post_id, document) "
+            f"SELECT post_id, {self._DOCUMENT_VECTOR} FROM ("
+            + self._documents('AND posts.id IN :ids') + ") AS documents"
+        ).bindparams(sa.bindparam('ids', expanding=True)), params)
+
+    def rebuild(self):
+        db.session.execute(sa.text("DELETE FROM post_search"))
+        db.session.execute(sa.text(
+            f"INSERT INTO post_search (post_id, document) "
+            f"SELECT post_id, {self._DOCUMENT_VECTOR} FROM ("
+            + self._documents() + ") AS documents"), {'published': True})
+        db.session.execute(sa.text("DELETE FROM post_search_words"))
+
+    def add_words(self, words):
+        db.session.execute(sa.text(
+            "INSERT INTO post_search_words (word) VALUES (:word) "
+            "ON CONFLICT (word) DO NOTHING"),
+            [{'word': word} for word in sorted(words)])
+
+    def similar_words(self, word, threshold, limit):
+        # % is answered from the GIN index (at pg_trgm.similarity_threshold,
+        # 0.3 by default); the explicit comparison applies ours on top
+        return db.session.execute(sa.text("""
+            SELECT word, similarity(word, :word) AS score
+            FROM post_search_words
+            WHERE word % :word AND similarity(word, :word) >= :threshold
+            ORDER BY score DESC, word
+            LIMIT :limit
+        """), {'word': word, 'threshold': threshold, 'limit': limit}).all()
+
+    def search(self, terms, limit, offset):
+        # \w+ terms can't carry tsquery operators; ':*' makes them prefixes
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        # ts_headline re-parses the body, so only run it on the page's rows
+        return db.session.execute(sa.text("""
+            SELECT ranked.post_id,
+                   ts_headline('english', COALESCE(posts.plain_text, ''),
+                               ranked.query, :headline_options)
+            FROM (
+                SELECT post_search.post_id, query,
+                       ts_rank(post_search.document, query) AS rank
+                FROM post_search JOIN posts ON posts.id = post_search.post_id,
+                     to_tsquery('english', :tsquery) AS query
+                WHERE post_search.document @@ query
+                  AND posts.status = :published AND posts.published_at IS NOT NULL
+                ORDER BY rank DESC, post_search.post_id DESC
+                LIMIT :limit OFFSET :offset
+            ) AS ranked
+            JOIN posts ON posts.id = ranked.post_id
+            ORDER BY ranked.rank DESC, ranked.post_id DESC
+        """), {'tsquery': tsquery, 'published': True, 'limit': limit,
+               'offset': offset,
+               'headline_options': (f'StartSel={MATCH_START}, StopSel={MATCH_END}, '
+                                    f'MaxWords={SNIPPET_WORDS}, '
+                                    f'MinWords={SNIPPET_WORDS // 2}, '
+                                    f'MaxFragments=1')}).all()
+
+
+_BACKENDS = {'sqlite': SQLiteSearch(), 'postgresql': PostgresSearch()}
+
+
+def _backend():
+    return _BACKENDS[db.session.get_bind().dialect.name]
+
+
+def index_posts(post_ids):
+    """
+    Brings the index entries for the given posts up to date: published posts
+    are (re)indexed, drafts and deleted posts dropped. Runs inside the
+    caller's transaction.
+    """
+    post_ids = set(post_ids)
+    if post_ids:
+        db.session.flush()
+        _backend().index_posts(post_ids)
+        _index_words('AND posts.id IN :ids', {'ids': list(post_ids)})
+
+
+def rebuild_index():
+    """Re-indexes every published post. The caller commits."""
+    db.session.flush()
+    _backend().rebuild()
+    _index_words()
+
+
+def _index_words(post_filter='', params=None):
+    # Words are only ever added here: one that no post uses any more is
+    # harmless, since did_you_mean's callers check a correction has results,
+    # and the next rebuild_index() drops it.
+    statement = sa.text(_VOCABULARY_SQL.format(post_filter=post_filter))
+    if params:
+        statement = statement.bindparams(
+            *(sa.bindparam(name, expanding=True) for name in params))
+    words = _vocabulary(db.session.scalars(statement, {'published': True, **(params or {})}))
+    if words:
+        _backend().add_words(words)
+
+
+def did_you_mean(query, limit=3):
+    """
+    Returns up to `limit` respellings of `query`, best first, built from the
+    words in post titles and tag names that look most like each of its words
+    (by shared trigrams, at SEARCH_SIMILARITY_THRESHOLD or better). Returns
+    an empty list when every word is already spelled like an indexed one.
+    """
+    threshold = current_app.config.get('SEARCH_SIMILARITY_THRESHOLD', 0.3)
+    terms = [normalize(term) for term in search_terms(query)]
+    options = []
+    for term in terms:
+        similar = []
+        if len(term) >= MIN_WORD_LENGTH and not term.isdigit():
+            similar = _backend().similar_words(term, threshold, limit)
+        if not similar or similar[0][0] == term:
+            similar = [(term, 1.0)]
+        options.append([(word, float(score)) for word, score in similar])
+    if all(len(choices) == 1 and choices[0][0] == term
+           for choices, term in zip(options, terms)):
+        return []
+
+    # The best word for each term, then one word swapped for a runner-up
+    best = [choices[0] for choices in options]
+    respellings = [best]
+    for position, choices in enumerate(options):
+        for choice in choices[1:]:
+            respellings.append(best[:position] + [choice] + best[position + 1:])
+    respellings.sort(key=lambda words: -sum(score for _, score in words))
+    return [' '.join(word for word, _ in words) for words in respellings[:limit]]
+
+
+class SearchResultCache:
+    """
+    Remembers the hits for recent searches in a bounded, least-recently-used
+    dict, keyed by the normalized terms and the page window, and counts hits
+    and misses so its size can be tuned. Entries expire after `timeout`
+    seconds, which bounds how stale another worker process's copy can get.
+    """
+
+    def __init__(self, max_entries=1000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, hits):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, hits)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else None}
+
+
+def init_search_cache(app):
+    """Creates the search result cache sized by SEARCH_CACHE_* settings."""
+    app.extensions['search_cache'] = SearchResultCache(
+        app.config.get('SEARCH_CACHE_MAX_ENTRIES', 1000),
+        app.config.get('SEARCH_CACHE_TIMEOUT', 300))
+
+
+def search_posts(query, limit, offset=0):
+    """
+    Returns SearchHits for the published posts matching `query`, best match
+    first, each with a Snippet of the body around the matches. Repeated
+    searches are answered from the search result cache.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    cache = current_app.extensions.get('search_cache')
+    # 'Vanilla!' and 'vanilla' are the same search
+    key = (tuple(terms), limit, offset)
+    hits = cache.get(key) if cache is not None else None
+    if hits is None:
+        hits = [SearchHit(post_id, Snippet.from_marked(marked))
+                for post_id, marked in _backend().search(terms, limit, offset)]
+        if cache is not None:
+            cache.set(key, hits)
+    return hits
+
+
+# db.create_all() (the tests, a fresh dev database) builds the index too;
+# deployed databases get it from the migration.
+for _statement in SQLITE_DDL:
+    sa.event.listen(db.metadata, 'after_create',
+                    sa.DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in POSTGRES_DDL:
+    sa.event.listen(db.metadata, 'after_create',
+                    sa.DDL(_statement).execute_if(dialect='postgresql'))
+for _table in ('post_search', 'post_search_trigrams', 'post_search_words'):
+    sa.event.listen(db.metadata, 'before_drop',
+                    sa.DDL(f"DROP TABLE IF EXISTS {_table}"))
+
+
+@post_changed.connect
+def _clear_search_cache(app, **extra):
+    # Any publish, edit or delete can change the results of any search
+    cache = app.extensions.get('search_cache')
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,18 @@
+# app/signals.py
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Sent after a post (or its tags) has been created, edited or deleted and the
+# change is committed. Caches that depend on post data subscribe to this.
+# post_id is None when the change touched many posts (e.g. a deleted account).
+# For a single post, tag_ids (the tags it had before and after) and author_id
+# may be sent as well so caches can drop only what that post appears in.
+post_changed = _signals.signal('post-changed')
+
+# Sent after a comment or reply on a post is created, edited or deleted.
+comment_changed = _signals.signal('comment-changed')
+
+# Sent in a sender thread or `flask mail-worker` before it drains the mail
+# outbox, for anything that queues mail in the background (newsletters).
+outbox_draining = _signals.signal('outbox-draining')
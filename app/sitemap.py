@@ -0,0 +1,206 @@
+# app/sitemap.py
+"""
+The XML sitemap, as a sitemap index (/sitemap.xml) pointing at one child
+sitemap for the static and tag pages and one per SITEMAP_MAX_URLS-wide range
+of post ids, so no child goes over the protocol's 50,000 URL limit.
+
+Children are streamed straight from the database, only the slug and dates
+of published posts, and gzipped as they go out. The compressed bytes are
+kept until the posts change, then served as they are.
+"""
+import gzip
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from xml.sax.saxutils import escape
+
+import sqlalchemy as sa
+from flask import current_app, request, Response, stream_with_context, url_for
+
+from app import db
+from app.conditional import make_etag, not_modified_response, set_validators
+from app.models import Post, Tag
+from app.signals import post_changed
+
+# Rows fetched from the database (and URLs compressed) at a time
+SITEMAP_BATCH_SIZE = 1000
+
+_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<{root} xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+
+class SitemapCache:
+    """
+    The gzipped sitemaps for the latest version of the posts, in a bounded,
+    least-recently-used dict keyed by host and name.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._sitemaps = OrderedDict()  # (url_root, name) -> (version, gzipped bytes)
+        self._lock = Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            stored = self._sitemaps.get(key)
+            if stored is None or stored[0] != version:
+                return None
+            self._sitemaps.move_to_end(key)
+            return stored[1]
+
+    def set(self, key, version, compressed):
+        with self._lock:
+            self._sitemaps[key] = (version, compressed)
+            self._sitemaps.move_to_end(key)
+            while len(self._sitemaps) > self.max_entries:
+                self._sitemaps.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._sitemaps.clear()
+
+    def __len__(self):
+        return len(self._sitemaps)
+
+
+def init_sitemap_cache(app):
+    """Creates the store for compressed sitemaps sized by SITEMAP_CACHE_MAX_ENTRIES."""
+    app.extensions['sitemap_cache'] = SitemapCache(
+        app.config.get('SITEMAP_CACHE_MAX_ENTRIES', 100))
+
+
+def _shard_size():
+    return current_app.config.get('SITEMAP_MAX_URLS', 50000)
+
+
+def _lastmod(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def _url(loc, lastmod=None, changefreq=None, priority=None):
+    parts = [f'<url><loc>{escape(loc)}</loc>']
+    if lastmod:
+        parts.append(f'<lastmod>{lastmod}</lastmod>')
+    if changefreq:
+        parts.append(f'<changefreq>{changefreq}</changefreq>')
+    if priority:
+        parts.append(f'<priority>{priority}</priority>')
+    parts.append('</url>\n')
+    return ''.join(parts)
+
+
+def post_shards():
+    """(shard, latest update) for every post id range holding published posts."""
+    shard = (Post.id // _shard_size()).label('shard')
+    return db.session.execute(
+        sa.select(shard, sa.func.max(sa.func.coalesce(Post.updated_at, Post.timestamp)))
+        .where(Post.status == True, Post.published_at != None)
+        .group_by(shard).order_by(shard)).all()
+
+
+def _shard_select(shard, *columns):
+    size = _shard_size()
+    return (sa.select(*columns)
+            .where(Post.status == True, Post.published_at != None,
+                   Post.id >= shard * size, Post.id < (shard + 1) * size))
+
+
+def has_post_shard(shard):
+    """Whether `shard` is one of post_shards(), i.e. holds a published post."""
+    return db.session.scalar(_shard_select(shard, Post.id).limit(1)) is not None
+
+
+def index_chunks(version):
+    yield _HEADER.format(root='sitemapindex')
+    children = [(url_for('main.sitemap_pages', _external=True), version[1])]
+    children += [(url_for('main.sitemap_posts', shard=shard, _external=True), lastmod)
+                 for shard, lastmod in post_shards()]
+    for loc, lastmod in children:
+        entry = f'<sitemap><loc>{escape(loc)}</loc>'
+        if lastmod:
+            entry += f'<lastmod>{_lastmod(lastmod)}</lastmod>'
+        yield entry + '</sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def pages_chunks(version):
+    yield _HEADER.format(root='urlset')
+    yield _url(url_for('main.index', _external=True), _lastmod(version[1]), 'daily', '1.0')
+    yield _url(url_for('main.contact', _external=True), None, 'monthly', '0.7')
+    # Tags without published posts are empty pages
+    result = db.session.execute(
+        sa.select(Tag.name).where(Tag.post_count > 0).order_by(Tag.name)
+        .execution_options(yield_per=SITEMAP_BATCH_SIZE))
+    for names in result.partitions():
+        yield ''.join(_url(url_for('main.tag', tag_name=name, _external=True),
+                           None, 'weekly', '0.5') for name, in names)
+    yield '</urlset>\n'
+
+
+def posts_chunks(shard):
+    yield _HEADER.format(root='urlset')
+    result = db.session.execute(
+        _shard_select(shard, Post.slug, Post.updated_at, Post.timestamp)
+        .order_by(Post.id)
+        .execution_options(yield_per=SITEMAP_BATCH_SIZE))
+    for rows in result.partitions():
+        yield ''.join(_url(url_for('main.post', slug=slug, _external=True),
+                           _lastmod(updated_at or timestamp), 'weekly', '0.9')
+                      for slug, updated_at, timestamp in rows)
+    yield '</urlset>\n'
+
+
+def _stream_and_store(chunks, cache, key, version, send_gzip):
+    # Compresses as the XML is generated; the client gets either side of
+    # the compressor, the cache always gets the gzip
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    compressed = []
+    for chunk in chunks:
+        data = chunk.encode()
+        packed = compressor.compress(data)
+        compressed.append(packed)
+        if not send_gzip:
+            yield data
+        elif packed:
+            yield packed
+    tail = compressor.flush()
+    compressed.append(tail)
+    if send_gzip:
+        yield tail
+    cache.set(key, version, b''.join(compressed))
+
+
+def sitemap_response(name, chunks):
+    """
+    Serves the sitemap called `name`, generated by the `chunks(version)`
+    generator function, from the cache or streamed from the database.
+    """
+    version = Post.content_version()
+    send_gzip = 'gzip' in request.accept_encodings
+    etag = make_etag('sitemap', name, *version, 'gzip' if send_gzip else 'identity')
+    not_modified = not_modified_response(etag, version[1])
+    if not_modified:
+        return not_modified
+
+    cache = current_app.extensions['sitemap_cache']
+    key = (request.url_root, name)
+    compressed = cache.get(key, version)
+    if compressed is not None:
+        response = Response(compressed if send_gzip else gzip.decompress(compressed),
+                            mimetype='application/xml')
+    else:
+        response = Response(stream_with_context(_stream_and_store(
+            chunks(version), cache, key, version, send_gzip)),
+            mimetype='application/xml')
+    if send_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return set_validators(response, etag, version[1])
+
+
+@post_changed.connect
+def _drop_sitemaps(app, **extra):
+    # Keys already carry the version; this frees the memory straight away
+    cache = app.extensions.get('sitemap_cache')
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,141 @@
+# app/suggest.py
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from threading import Lock
+
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Tag
+from app.signals import post_changed
+
+
+def normalize(text):
+    """Lower-cases text, strips accents and squeezes spaces: 'Épice  Noire' -> 'epice noire'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.lower().split())
+
+
+def _word_suffixes(key):
+    # 'tobacco vanille review' is found by 'tob', 'vanille r' and 'rev'
+    words = key.split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class SuggestionIndex:
+    """
+    Post titles and tag names in a sorted array of (key, kind, ident)
+    entries, one per word a label can be found from, searched with bisect.
+    Built from the database on first use and then kept current one post at
+    a time; other worker processes pick up changes when `timeout` expires.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._items = {}  # (kind, ident) -> (label, target, weight, key)
+        self._built_at = None
+        self._lock = Lock()
+
+    def _index(self, kind, ident, label, target, weight=0):
+        # Records the item and returns its entries, for the caller to place
+        key = normalize(label)
+        self._items[(kind, ident)] = (label, target, weight, key)
+        return [(suffix, kind, ident) for suffix in _word_suffixes(key)]
+
+    def _add(self, kind, ident, label, target, weight=0):
+        for entry in self._index(kind, ident, label, target, weight):
+            insort(self._entries, entry)
+
+    def _remove(self, kind, ident):
+        item = self._items.pop((kind, ident), None)
+        if item is None:
+            return
+        for suffix in _word_suffixes(item[3]):
+            entry = (suffix, kind, ident)
+            position = bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def _load_tags(self):
+        # Swaps in the current tags' entries and sorts everything once; an
+        # insert per entry would shift the whole array each time
+        for key in [k for k in self._items if k[0] == 'tag']:
+            del self._items[key]
+        entries = [entry for entry in self._entries if entry[1] != 'tag']
+        for tag_id, name, post_count in db.session.execute(
+                sa.select(Tag.id, Tag.name, Tag.post_count).where(Tag.post_count > 0)):
+            entries += self._index('tag', tag_id, name, name, post_count)
+        entries.sort()
+        self._entries = entries
+
+    def rebuild(self):
+        """Loads every published post title and used tag from the database."""
+        with self._lock:
+            self._items, entries = {}, []
+            for post_id, slug, title in db.session.execute(
+                    sa.select(Post.id, Post.slug, Post.title)
+                    .where(Post.status == True, Post.published_at != None)):
+                entries += self._index('post', post_id, title, slug)
+            self._entries = entries  # Sorted along with the tags'
+            self._load_tags()
+            self._built_at = time.monotonic()
+
+    def refresh_post(self, post_id):
+        """Re-reads one post, and the tags (whose counts it may have changed)."""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove('post', post_id)
+            row = db.session.execute(
+                sa.select(Post.slug, Post.title)
+                .where(Post.id == post_id, Post.status == True,
+                       Post.published_at != None)).first()
+            if row is not None:
+                self._add('post', post_id, row.title, row.slug)
+            self._load_tags()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def suggest(self, query, limit=8, timeout=None):
+        """
+        Returns up to `limit` (kind, label, target) suggestions for what has
+        been typed so far: labels starting with it first, then tags by how
+        many posts use them, then alphabetically. Only touches the database
+        when the index needs (re)building.
+        """
+        if self._built_at is None or (
+                timeout is not None and time.monotonic() - self._built_at > timeout):
+            self.rebuild()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        from_start = {}
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            while (position < len(self._entries)
+                   and self._entries[position][0].startswith(prefix)
+                   and len(from_start) < limit * 5):
+                suffix, kind, ident = self._entries[position]
+                whole = suffix == self._items[(kind, ident)][3]
+                from_start[(kind, ident)] = from_start.get((kind, ident), False) or whole
+                position += 1
+            matches = [(from_start[k], k[0], *self._items[k][:3]) for k in from_start]
+
+        matches.sort(key=lambda m: (not m[0], -m[4], m[2].lower()))
+        return [(kind, label, target) for _, kind, label, target, _ in matches[:limit]]
+
+
+suggestion_index = SuggestionIndex()
+
+
+@post_changed.connect
+def _update_suggestions(app, post_id=None, **extra):
+    if post_id is None:
+        suggestion_index.invalidate()
+    else:
+        suggestion_index.refresh_post(post_id)
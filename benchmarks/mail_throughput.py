@@ -0,0 +1,180 @@
+# benchmarks/mail_throughput.py
+"""
+Times a burst of signups or subscriptions through the real routes, mail included.
+
+    python benchmarks/mail_throughput.py --flow subscribe --requests 500 --smtp-delay 20
+
+Each request is made with the Flask test client against a throwaway SQLite
+database, and its email is delivered to an in-process SMTP sink
+(tests/smtp_sink.py) that spends --smtp-delay ms on each message, as a real
+mail host would. Three ways of sending are compared, each in a fresh process:
+
+  none     no email at all: the cost of the request itself
+  thread   the previous send_async_email: a thread and an SMTP connection per message
+  outbox   the mail outbox (app/outbox.py) and its MAIL_OUTBOX_WORKERS senders
+
+and for each the script reports messages delivered per second, the peak
+number of threads, and the p50/p99 request latency. Runs are separate
+processes with their own noise, so compare latencies against the `none`
+row rather than reading differences between runs as exact.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+
+from flask import current_app
+from flask_mail import Message
+
+from app import create_app, db, limiter, mail
+from config import Config
+from smtp_sink import SMTPSink
+
+MODES = ('none', 'thread', 'outbox')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ThreadPeak:
+    """Samples threading.active_count() in the background and keeps the highest."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def thread_per_email(subject, recipients, body=None, html=None, sender=None, reply_to=None):
+    """The previous implementation: a new thread, and connection, per message."""
+    app = current_app._get_current_object()
+    msg = Message(subject=subject, recipients=recipients, body=body, html=html,
+                  sender=sender or app.config.get('MAIL_DEFAULT_SENDER'),
+                  reply_to=reply_to)
+
+    def send_async_email(app, msg):
+        with app.app_context():
+            mail.send(msg)
+
+    threading.Thread(target=send_async_email, args=(app, msg)).start()
+
+
+def no_email(*args, **kwargs):
+    pass
+
+
+def run(mode, flow, requests, smtp_delay, workers, timeout):
+    """Runs one burst in this process and returns its measurements."""
+    import app.routes
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    with SMTPSink(delay=smtp_delay / 1000) as sink:
+        class BenchmarkConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{database}'
+            WTF_CSRF_ENABLED = False
+            RECAPTCHA_ENABLED = False
+            SERVER_NAME = 'localhost.localdomain'
+            MAIL_SUPPRESS_SEND = False
+            MAIL_SERVER, MAIL_PORT = sink.host, sink.port
+            MAIL_USE_TLS = MAIL_USE_SSL = False
+            MAIL_USERNAME = MAIL_PASSWORD = None
+            MAIL_OUTBOX_WORKERS = workers if mode == 'outbox' else 0
+
+        flask_app = create_app(BenchmarkConfig)
+        with flask_app.app_context():
+            db.create_all()
+        limiter.enabled = False  # A burst from one address is the point
+        if mode == 'thread':
+            app.routes.enqueue_email = thread_per_email
+        elif mode == 'none':
+            app.routes.enqueue_email = no_email
+
+        client = flask_app.test_client()
+        latencies = []
+        with ThreadPeak() as threads:
+            start = time.perf_counter()
+            for number in range(requests):
+                if flow == 'signup':
+                    data = {'username': f'reader{number}', 'email': f'reader{number}@example.com',
+                            'password': 'password', 'password2': 'password'}
+                else:
+                    data = {'email': f'reader{number}@example.com'}
+                began = time.perf_counter()
+                response = client.post(f'/{flow}', data=data)
+                latencies.append(time.perf_counter() - began)
+                assert response.status_code == 302, response.status_code
+            expected = 0 if mode == 'none' else requests
+            deadline = time.perf_counter() + timeout
+            while len(sink.messages) < expected and time.perf_counter() < deadline:
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - start
+        delivered = len(sink.messages)
+    return {'mode': mode, 'delivered': delivered, 'expected': expected,
+            'elapsed': elapsed, 'connections': sink.connections,
+            'peak_threads': threads.peak,
+            'p50': percentile(latencies, 0.50), 'p99': percentile(latencies, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--flow', choices=('subscribe', 'signup'), default='subscribe',
+                        help='Route each request goes through.')
+    parser.add_argument('--requests', type=int, default=300,
+                        help='Signups or subscriptions in the burst.')
+    parser.add_argument('--smtp-delay', type=float, default=20,
+                        help='Milliseconds the SMTP sink spends on each message.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='MAIL_OUTBOX_WORKERS for the outbox run.')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='Seconds to wait for every message to arrive.')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    # 'none' first: the baseline row the others' latency is compared with
+    modes = ['none'] + [mode for mode in args.modes if mode != 'none']
+    results = []
+    for mode in modes:
+        # A process per run, so one run's threads can't count in the next
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(run, mode, args.flow, args.requests,
+                                       args.smtp_delay, args.workers,
+                                       args.timeout).result())
+
+    print(f"{args.requests} {args.flow} requests, SMTP sink taking {args.smtp_delay:g} ms "
+          f"per message:")
+    print(f"{'mode':<8} {'msgs/sec':>9} {'delivered':>10} {'SMTP conns':>11} "
+          f"{'peak threads':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        rate = result['delivered'] / result['elapsed'] if result['delivered'] else 0
+        print(f"{result['mode']:<8} {rate:9.1f} "
+              f"{result['delivered']:>4}/{result['expected']:<5} "
+              f"{result['connections']:>11} {result['peak_threads']:>13} "
+              f"{result['p50'] * 1000:8.2f} {result['p99'] * 1000:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/slug_allocation.py
+"""
+Times slug allocation for a title thousands of posts already share.
+
+    python benchmarks/slug_allocation.py --posts 5000
+
+Compares the old one-SELECT-per-candidate loop with
+Post.generate_unique_slug() on a throwaway SQLite database.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+
+import sqlalchemy as sa
+from slugify import slugify
+
+from app import create_app, db
+from app.models import User, Post
+from config import Config
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+
+
+def loop_slug(title):
+    """The previous implementation: one SELECT per candidate suffix."""
+    base_slug = slugify(title) or "post"
+    slug = base_slug
+    i = 1
+    while db.session.scalar(sa.select(Post.id).filter_by(slug=slug)):
+        slug = f"{base_slug}-{i}"
+        i += 1
+    return slug
+
+
+def timed(label, allocate, title, statements):
+    statements.clear()
+    start = time.perf_counter()
+    slug = allocate(title)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed * 1000:9.2f} ms  {len(statements):6d} queries  -> {slug}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--posts', type=int, default=5000,
+                        help='Posts already titled "Review".')
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        db.session.flush()
+        now = datetime.utcnow()
+        db.session.execute(sa.insert(Post), [
+            {'title': 'Review', 'body': '', 'user_id': user.id, 'timestamp': now,
+             'slug': 'review' if i == 0 else f'review-{i}'}
+            for i in range(args.posts)])
+        db.session.commit()
+
+        statements = []
+        sa.event.listen(db.engine, 'before_cursor_execute',
+                        lambda conn, cursor, statement, *rest: statements.append(statement))
+
+        print(f"Allocating a slug for 'Review' with {args.posts} collisions:")
+        timed('loop (old)', loop_slug, 'Review', statements)
+        timed('generate_unique_slug', Post.generate_unique_slug, 'Review', statements)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,21 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'admin@liquidblossom.com'
     ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
+    # Outbox (app/outbox.py): threads per app process draining it; 0 leaves it to `flask mail-worker`
+    MAIL_OUTBOX_WORKERS = int(os.environ.get('MAIL_OUTBOX_WORKERS', 2))
+    MAIL_OUTBOX_BATCH_SIZE = 50  # Messages a sender claims at a time
+    MAIL_OUTBOX_POLL_INTERVAL = 30  # Seconds between checks for due retries
+    MAIL_OUTBOX_MAX_ATTEMPTS = 5  # Then the message is marked failed
+    MAIL_OUTBOX_BACKOFF_BASE = 30  # Seconds before the first retry, doubling after each
+    MAIL_OUTBOX_BACKOFF_MAX = 3600
+    MAIL_OUTBOX_LEASE_SECONDS = 300  # A crashed sender's claimed messages go out again after this
+    MAIL_OUTBOX_KEEPALIVE = 10  # Seconds a sender keeps its SMTP connection open for mail about to fall due
+    MAIL_OUTBOX_RETENTION_DAYS = 30  # Sent and failed messages are deleted after this
+    MAIL_OUTBOX_PURGE_INTERVAL = 3600  # Seconds between those deletions in a running sender
+    # Newsletter (app/newsletter.py): mail confirmed subscribers a post when it's first published
+    NEWSLETTER_ON_PUBLISH = os.environ.get('NEWSLETTER_ON_PUBLISH', 'True').lower() in ('true', '1', 't')
+    NEWSLETTER_BATCH_SIZE = 500  # Subscribers queued (and the email rendered once) per transaction
+    NEWSLETTER_SEND_RATE = 10  # Messages per second; 0 sends as fast as the outbox can
     
     # --- COOKIES ---
     # Now we read from os.environ
@@ -56,6 +71,35 @@ class Config:
     GOOGLE_ANALYTICS_ID = os.environ.get('GOOGLE_ANALYTICS_ID')
     SIDEBAR_RECENT_POSTS_COUNT = 5
     SIDEBAR_POPULAR_TAGS_COUNT = 10
+    SIDEBAR_CACHE_TIMEOUT = 3600  # Seconds; edits clear it sooner
+    RELATED_POSTS_COUNT = 3  # Precomputed "You Might Also Like" neighbours per post
+    RSS_FEED_POST_LIMIT = 20  # Entries in the RSS, Atom and JSON feeds
+    FEED_CACHE_MAX_ENTRIES = 500  # Site, tag and author feeds kept rendered
+    SITEMAP_MAX_URLS = 50000  # Per child sitemap (the protocol's limit); posts are split by id range
+    SITEMAP_CACHE_MAX_ENTRIES = 100  # Gzipped sitemaps kept, per host and child
+    # Public URL `flask freeze` renders the static site for
+    FREEZE_BASE_URL = os.environ.get('FREEZE_BASE_URL', 'http://localhost')
     SIGNUP_RATE_LIMIT = "5 per hour;20 per day"
+    # Search box typeahead; its own limit since it fires on every keystroke
+    SUGGEST_RATE_LIMIT = "60 per minute;2000 per day"
+    SUGGEST_MAX_RESULTS = 8
+    SUGGEST_INDEX_TIMEOUT = 600  # Seconds before a worker rebuilds its index
+
+    # --- PAGE CACHE (anonymous visitors only) ---
+    PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'False').lower() in ('true', '1', 't')
+    PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'memory')  # 'memory' or 'filesystem'
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')  # Defaults to instance/page_cache
+    PAGE_CACHE_TIMEOUT = 300
+    PAGE_CACHE_MAX_ENTRIES = 500
+
+    # --- SEARCH RESULT CACHE (see /admin/search-cache for hit rates) ---
+    SEARCH_CACHE_MAX_ENTRIES = 1000
+    SEARCH_CACHE_TIMEOUT = 300  # Seconds; publishing, edits and deletes clear it sooner
+    # Trigram similarity (0-1) a word needs to be offered as a respelling
+    SEARCH_SIMILARITY_THRESHOLD = 0.3
+
+    # --- FRAGMENT CACHE ({% cache %} blocks in templates) ---
+    FRAGMENT_CACHE_ENABLED = os.environ.get('FRAGMENT_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    FRAGMENT_CACHE_MAX_ENTRIES = 2000
 
 
@@ -0,0 +1,32 @@
+"""Add slug prefix indexes
+
+Revision ID: 8b5e0c3a9f61
+Revises: d24e8a0b7c15
+Create Date: 2026-10-17 16:03:18.552471
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5e0c3a9f61'
+down_revision = 'd24e8a0b7c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL only uses an index for LIKE 'prefix%' under the C collation
+    # or with a pattern_ops index; Post.generate_unique_slug() relies on it.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_posts_slug_pattern', 'posts',
+                        [sa.text('slug varchar_pattern_ops')])
+        op.create_index('ix_slug_history_slug_pattern', 'slug_history',
+                        [sa.text('slug varchar_pattern_ops')])
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_slug_history_slug_pattern', table_name='slug_history')
+        op.drop_index('ix_posts_slug_pattern', table_name='posts')
@@ -0,0 +1,36 @@
+"""Add post search index
+
+Revision ID: c7d3f19e4a28
+Revises: 8b5e0c3a9f61
+Create Date: 2026-10-17 17:10:52.630184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3f19e4a28'
+down_revision = '8b5e0c3a9f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not autogenerated: the index is dialect-specific (see app/search.py).
+    # Existing posts are indexed by the next migration, once the trigram
+    # tables rebuild_index() also fills exist.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE post_search "
+                   "USING fts5(title, body, tags, tokenize='porter unicode61')")
+    elif dialect == 'postgresql':
+        op.execute("CREATE TABLE post_search ("
+                   "post_id INTEGER PRIMARY KEY REFERENCES posts (id) ON DELETE CASCADE, "
+                   "document TSVECTOR NOT NULL)")
+        op.execute("CREATE INDEX ix_post_search_document "
+                   "ON post_search USING GIN (document)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS post_search")
@@ -0,0 +1,47 @@
+"""Add search trigram index
+
+Revision ID: e41b6d2a9c73
+Revises: c7d3f19e4a28
+Create Date: 2026-10-17 18:02:41.218530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.extensions import migration_session
+from app.search import rebuild_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b6d2a9c73'
+down_revision = 'c7d3f19e4a28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not autogenerated: the index is dialect-specific (see app/search.py).
+    # Existing posts are indexed at the end; edits keep the index current.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE TABLE post_search_words ("
+                   "word TEXT PRIMARY KEY, trigram_count INTEGER NOT NULL)")
+        op.execute("CREATE TABLE post_search_trigrams ("
+                   "trigram TEXT NOT NULL, word TEXT NOT NULL, "
+                   "PRIMARY KEY (trigram, word)) WITHOUT ROWID")
+    elif dialect == 'postgresql':
+        # Creating an extension needs a role allowed to (pg_trgm is trusted
+        # from PostgreSQL 13, so the database owner is enough there)
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE TABLE post_search_words (word TEXT PRIMARY KEY)")
+        op.execute("CREATE INDEX ix_post_search_words_trgm "
+                   "ON post_search_words USING GIN (word gin_trgm_ops)")
+
+    if dialect in ('sqlite', 'postgresql'):
+        with migration_session(op.get_bind()):
+            rebuild_index()
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS post_search_trigrams")
+    op.execute("DROP TABLE IF EXISTS post_search_words")
@@ -7,7 +7,10 @@ from app.models import User
 
 import pytest
 from app import create_app, db
+from app.cache import sidebar_cache, slug_cache
+from app.suggest import suggestion_index
 from config import Config
+from smtp_sink import SMTPSink
 
 class TestConfig(Config):
     TESTING = True
@@ -18,6 +21,7 @@ class TestConfig(Config):
     MAIL_SERVER = 'localhost'
     MAIL_PORT = 25
     MAIL_DEFAULT_SENDER = 'test@example.com'
+    MAIL_OUTBOX_WORKERS = 0  # Tests drain the outbox themselves
 
 @pytest.fixture(scope='session')
 def app():
@@ -42,6 +46,24 @@ def _db(app):
         yield db
         db.session.remove()
         db.drop_all()
+        sidebar_cache.clear()
+        slug_cache.clear()
+        suggestion_index.invalidate()
+        app.extensions['search_cache'].clear()
+        app.extensions['fragment_cache'].clear()
+        app.extensions['feed_cache'].clear()
+        app.extensions['sitemap_cache'].clear()
+
+@pytest.fixture
+def smtp_sink(app, monkeypatch):
+    """Points Flask-Mail at a local SMTPSink, actually sending, for one test."""
+    state = app.extensions['mail']
+    with SMTPSink() as sink:
+        monkeypatch.setattr(state, 'suppress', False)
+        monkeypatch.setattr(state, 'server', sink.host)
+        monkeypatch.setattr(state, 'port', sink.port)
+        monkeypatch.setattr(state, 'use_tls', False)
+        yield sink
 
 @pytest.fixture
 def auth_client(client, app):
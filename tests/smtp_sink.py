@@ -0,0 +1,127 @@
+# tests/smtp_sink.py
+"""
+A minimal SMTP server that accepts mail and keeps it in memory, standing in
+for a real mail host in tests (and benchmarks). It speaks just enough SMTP
+for smtplib: no TLS, no auth.
+"""
+import socketserver
+import threading
+import time
+
+from email import message_from_bytes
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        sink._connected()
+        self._reply('220 localhost SMTP sink')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self._reply('250-localhost')
+                self._reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self._reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(), []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                if sink.delay:
+                    time.sleep(sink.delay)
+                if sink._accept(sender, recipients, b''.join(lines)):
+                    self._reply('250 OK: queued')
+                else:
+                    self._reply('451 Try again later')
+                sender, recipients = None, []
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self._reply('250 OK')
+            elif verb == 'NOOP':
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """
+    Runs the server on a free localhost port in a background thread:
+
+        with SMTPSink() as sink:
+            ...send to ('127.0.0.1', sink.port)...
+            sink.messages  # [email.message.Message, ...]
+
+    fail_next(n) turns down the next n messages with a temporary 451, and
+    `delay` seconds are spent on each message, as a real server would.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0):
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self.delay = delay
+        self.messages = []
+        self.envelopes = []  # (sender, recipients) per accepted message
+        self.connections = 0
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _accept(self, sender, recipients, data):
+        with self._lock:
+            if self._failures:
+                self._failures -= 1
+                return False
+            self.messages.append(message_from_bytes(data))
+            self.envelopes.append((sender, recipients))
+            return True
+
+    def fail_next(self, count=1):
+        with self._lock:
+            self._failures = count
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
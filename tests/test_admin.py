@@ -1,5 +1,13 @@
 # tests/test_admin.py
-from app.models import User, Post, db
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from app.cache import slug_cache
+from app.models import (User, Post, Tag, RelatedPost, SlugHistory, Subscriber,
+                        NewsletterBroadcast, OutboxMessage, db)
+from app.newsletter import queue_next_batch, queue_broadcasts
+from app.outbox import drain_outbox
 
 
 
@@ -64,3 +72,371 @@ def test_admin_can_create_post(client, app):
         assert post.body == 'This is the body of the test post.'
         assert post.status is True
         assert len(post.tags) == 2
+
+
+def test_sidebar_cache_cleared_on_post_create(client, app):
+    """
+    GIVEN a sidebar that has already been cached
+    WHEN an admin creates a new post
+    THEN check that the sidebar shows the new post on the next render
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+
+    # First render fills the cache with an empty sidebar
+    response = client.get('/about')
+    assert b'No recent posts to display.' in response.data
+
+    # A post written behind the cache's back is not picked up...
+    with app.app_context():
+        db.session.add(Post(title='Sneaky Post', body='Body.', slug='sneaky-post',
+                            author=db.session.get(User, admin_id), status=True))
+        db.session.commit()
+    response = client.get('/about')
+    assert b'Sneaky Post' not in response.data
+
+    # ...but creating one through the admin route clears it
+    client.post('/admin/post/new', data={
+        'title': 'Fresh Post',
+        'body': 'Fresh body.',
+        'tags': '',
+        'status': True
+    }, follow_redirects=True)
+    response = client.get('/about')
+    assert b'Fresh Post' in response.data
+    assert b'Sneaky Post' in response.data
+
+
+def test_tag_post_counts_follow_post_changes(client, app):
+    """
+    GIVEN a logged-in admin
+    WHEN they create, unpublish and delete tagged posts
+    THEN check that each tag's published post count stays in step
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Vanilla One', 'body': 'Body.', 'tags': 'vanilla, gourmand',
+        'status': True}, follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Vanilla Two', 'body': 'Body.', 'tags': 'vanilla',
+        'status': True}, follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Vanilla Draft', 'body': 'Body.', 'tags': 'vanilla'},
+        follow_redirects=True)
+
+    def counts():
+        return {t.name: t.post_count for t in db.session.scalars(sa.select(Tag))}
+
+    with app.app_context():
+        assert counts() == {'vanilla': 2, 'gourmand': 1}
+        post_one = Post.query.filter_by(title='Vanilla One').one()
+        post_two_id = Post.query.filter_by(title='Vanilla Two').one().id
+
+    # Unpublishing a post and moving it off a tag updates both tags
+    client.post(f'/admin/post/{post_one.id}/edit', data={
+        'title': 'Vanilla One', 'body': 'Body.', 'tags': 'vanilla'})
+    with app.app_context():
+        assert counts() == {'vanilla': 1, 'gourmand': 0}
+
+    client.post(f'/admin/post/{post_two_id}/delete', follow_redirects=True)
+    with app.app_context():
+        assert counts() == {'vanilla': 0, 'gourmand': 0}
+
+
+def test_rebuild_tag_counts_command(app):
+    """
+    GIVEN tag counts that have drifted from the post_tags table
+    WHEN the rebuild-tag-counts CLI command runs
+    THEN check that the counts are recomputed from published posts
+    """
+    with app.app_context():
+        user = User(username='admin', email='admin@example.com')
+        tag = Tag(name='niche', post_count=42)
+        post = Post(title='Niche', body='Body.', slug='niche', author=user,
+                    status=True, published_at=datetime.utcnow())
+        draft = Post(title='Draft', body='Body.', slug='draft', author=user,
+                     status=False)
+        post.tags.append(tag)
+        draft.tags.append(tag)
+        db.session.add_all([user, post, draft])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebuild-tag-counts'])
+    assert 'SUCCESS' in result.output
+
+    with app.app_context():
+        assert db.session.scalar(sa.select(Tag.post_count)) == 1
+
+
+def test_backfill_post_text_command(app):
+    """
+    GIVEN posts saved before plain_text and excerpt existed
+    WHEN the backfill-post-text CLI command runs in small batches
+    THEN check that every post gets its text fields filled in
+    """
+    with app.app_context():
+        user = User(username='admin', email='admin@example.com')
+        db.session.add_all([Post(title=f'Old {i}', body=f'<p>Old body {i}</p>',
+                                 slug=f'old-{i}', author=user) for i in range(5)])
+        db.session.commit()
+        db.session.execute(sa.update(Post).values(plain_text=None, excerpt=None))
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(
+        args=['backfill-post-text', '--batch-size', '2'])
+    assert 'Backfilled text for 5 posts' in result.output
+
+    with app.app_context():
+        assert db.session.scalar(
+            sa.select(Post.excerpt).where(Post.title == 'Old 3')) == 'Old body 3'
+
+
+def test_related_posts_follow_post_changes(client, app):
+    """
+    GIVEN a logged-in admin
+    WHEN they create, retag and delete tagged posts
+    THEN check that each post's precomputed neighbours are kept up to date
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    for title, tags in [('Alpha', 'vanilla, amber'), ('Bravo', 'vanilla, amber'),
+                        ('Charlie', 'vanilla'), ('Delta', 'rose')]:
+        client.post('/admin/post/new', data={
+            'title': title, 'body': 'Body.', 'tags': tags, 'status': True},
+            follow_redirects=True)
+
+    def neighbours(title):
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(title=title))
+        return db.session.scalars(
+            sa.select(Post.title).join(RelatedPost, RelatedPost.related_id == Post.id)
+            .where(RelatedPost.post_id == post_id)
+            .order_by(RelatedPost.score.desc())).all()
+
+    with app.app_context():
+        # Sharing both tags beats sharing one
+        assert neighbours('Alpha') == ['Bravo', 'Charlie']
+        assert neighbours('Delta') == []
+        charlie_id = Post.query.filter_by(title='Charlie').one().id
+        bravo_id = Post.query.filter_by(title='Bravo').one().id
+
+    response = client.get('/post/alpha')
+    assert b'You Might Also Like' in response.data
+    assert b'Bravo' in response.data
+
+    # Moving Charlie to another tag updates both its old and new neighbours
+    client.post(f'/admin/post/{charlie_id}/edit', data={
+        'title': 'Charlie', 'body': 'Body.', 'tags': 'rose', 'status': True})
+    with app.app_context():
+        assert neighbours('Alpha') == ['Bravo']
+        assert neighbours('Delta') == ['Charlie']
+
+    client.post(f'/admin/post/{bravo_id}/delete', follow_redirects=True)
+    with app.app_context():
+        assert neighbours('Alpha') == []
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(RelatedPost)
+                                 .where(RelatedPost.related_id == bravo_id)) == 0
+
+
+def test_rebuild_related_posts_command(app):
+    """
+    GIVEN published posts with overlapping tags and no stored neighbours
+    WHEN the rebuild-related-posts CLI command runs
+    THEN check that neighbours are computed for published posts only
+    """
+    with app.app_context():
+        user = User(username='admin', email='admin@example.com')
+        oud, rose = Tag(name='oud'), Tag(name='rose')
+        first = Post(title='First', body='Body.', slug='first', author=user,
+                     status=True, published_at=datetime.utcnow(), tags=[oud, rose])
+        second = Post(title='Second', body='Body.', slug='second', author=user,
+                      status=True, published_at=datetime.utcnow(), tags=[oud])
+        draft = Post(title='Draft', body='Body.', slug='draft', author=user,
+                     status=False, tags=[oud, rose])
+        db.session.add_all([first, second, draft])
+        db.session.commit()
+        Tag.update_post_counts()
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebuild-related-posts'])
+    assert 'SUCCESS' in result.output
+
+    with app.app_context():
+        pairs = db.session.execute(
+            sa.select(RelatedPost.post_id, RelatedPost.related_id)).all()
+        first_id = db.session.scalar(sa.select(Post.id).filter_by(slug='first'))
+        second_id = db.session.scalar(sa.select(Post.id).filter_by(slug='second'))
+        assert sorted(pairs) == sorted([(first_id, second_id), (second_id, first_id)])
+
+
+def test_renamed_post_old_slugs_redirect(client, app):
+    """
+    GIVEN a published post whose title an admin edits twice
+    WHEN a visitor follows a link using either old slug
+    THEN check that it is permanently redirected to the current slug
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Santal Notes', 'body': 'Body.', 'status': True},
+        follow_redirects=True)
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(slug='santal-notes'))
+
+    assert client.get('/post/santal-notes').status_code == 200
+    assert slug_cache.get('santal-notes') == post_id
+
+    for title in ('Santal Revisited', 'Santal Final'):
+        client.post(f'/admin/post/{post_id}/edit', data={
+            'title': title, 'body': 'Body.', 'status': True})
+    # The edit dropped the cached slug instead of serving the renamed post under it
+    assert slug_cache.get('santal-notes') is None
+
+    for old_slug in ('santal-notes', 'santal-revisited'):
+        response = client.get(f'/post/{old_slug}?page=2')
+        assert response.status_code == 301
+        assert response.location.endswith('/post/santal-final?page=2')
+    assert client.get('/post/santal-final').status_code == 200
+
+    client.post(f'/admin/post/{post_id}/delete', follow_redirects=True)
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count(SlugHistory.id))) == 0
+    assert client.get('/post/santal-notes').status_code == 302
+
+
+def test_unique_slug_allocation(app, monkeypatch):
+    """
+    GIVEN posts and old slugs already using a title's slug and some suffixes
+    WHEN new posts with the same title are given slugs
+    THEN check that the lowest free suffix is used and that a slug taken by a
+         concurrent insert is retried
+    """
+    with app.app_context():
+        user = User(username='admin', email='admin@example.com')
+        db.session.add(user)
+        for slug in ('review', 'review-1', 'review-2', 'review-3', 'review-notes'):
+            db.session.add(Post(title='Review', body='Body.', slug=slug, author=user))
+        db.session.commit()
+        renamed = db.session.scalar(sa.select(Post).filter_by(slug='review-3'))
+        renamed.change_slug('something-else')
+        db.session.commit()
+
+        # review-3 now only lives in slug history, so it stays reserved
+        assert Post.generate_unique_slug('Review') == 'review-4'
+        # A post may take back its own old slug
+        assert Post.generate_unique_slug('Review', exclude_post_id=renamed.id) == 'review-3'
+
+        original = Post.generate_unique_slug
+        stale = iter(['review-1'])  # As if read before another request's commit
+        monkeypatch.setattr(Post, 'generate_unique_slug', staticmethod(
+            lambda title, exclude_post_id=None: next(stale, None) or original(title)))
+        post = Post(title='Review', body='Body.', user_id=user.id)
+        assert post.allocate_slug('Review') == 'review-4'
+        db.session.commit()
+        assert db.session.scalar(sa.select(Post.slug).where(Post.id == post.id)) == 'review-4'
+
+
+def test_newsletter_broadcast_on_first_publish(client, app, smtp_sink):
+    """
+    GIVEN confirmed and unconfirmed subscribers
+    WHEN an admin publishes a post, then unpublishes and republishes it
+    THEN the confirmed subscribers are queued once each, in id-ordered
+    batches paced by NEWSLETTER_SEND_RATE, and mailed over one connection,
+    with links that only unsubscribe on a POST
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com', is_admin=True,
+                     confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        for number in range(3):
+            db.session.add(Subscriber(email=f'reader{number}@example.com',
+                                      token=f'token{number}', confirmed=True))
+        db.session.add(Subscriber(email='unconfirmed@example.com', token='token-u',
+                                  confirmed=False))
+        db.session.commit()
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+
+    client.post('/admin/post/new', data={'title': 'Vetiver Season',
+                                         'body': '<p>Earthy and green.</p>',
+                                         'tags': '', 'status': True})
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id))
+        broadcast = db.session.scalar(sa.select(NewsletterBroadcast))
+        assert broadcast.post_id == post_id and broadcast.status == 'sending'
+
+        # A crash after the first batch: the next sender carries on from it
+        assert queue_next_batch(broadcast.id, batch_size=2) == 2
+        assert queue_broadcasts(batch_size=2) == 1
+        db.session.refresh(broadcast)
+        assert (broadcast.status, broadcast.queued) == ('done', 3)
+
+        messages = db.session.scalars(sa.select(OutboxMessage).order_by(OutboxMessage.id)).all()
+        assert [m.recipients for m in messages] == [f'reader{n}@example.com' for n in range(3)]
+        assert all('/unsubscribe/token' in m.body and 'Vetiver Season' in m.html
+                   for m in messages)
+        gaps = [(b.next_attempt_at - a.next_attempt_at).total_seconds()
+                for a, b in zip(messages, messages[1:])]
+        assert all(gap >= 1 / app.config['NEWSLETTER_SEND_RATE'] - 0.001 for gap in gaps)
+
+    for status in (False, True):
+        client.post(f'/admin/post/{post_id}/edit', data={
+            'title': 'Vetiver Season', 'body': '<p>Earthy and green.</p>',
+            'tags': '', 'status': status})
+    response = client.post(f'/admin/post/{post_id}/newsletter', follow_redirects=True)
+    assert b'has already been sent to subscribers' in response.data
+
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count(NewsletterBroadcast.id))) == 1
+        assert queue_broadcasts() == 0
+        # Later messages are waited for on the open connection
+        assert drain_outbox(idle_wait=time.sleep) == 3
+    assert smtp_sink.connections == 1
+    assert sorted(m['To'] for m in smtp_sink.messages) == [
+        f'reader{n}@example.com' for n in range(3)]
+
+    # Mail clients unsubscribe in one click from the headers (RFC 8058)
+    message = next(m for m in smtp_sink.messages if m['To'] == 'reader1@example.com')
+    assert message['List-Unsubscribe-Post'] == 'List-Unsubscribe=One-Click'
+    one_click = message['List-Unsubscribe'].strip('<>')
+    assert one_click.endswith('/unsubscribe/token1/one-click')
+    assert client.post(one_click, data={'List-Unsubscribe': 'One-Click'}).status_code == 204
+
+    # A link scanner's GET only gets the confirmation page
+    page = client.get('/unsubscribe/token0')
+    assert page.status_code == 200 and b'reader0@example.com' in page.data
+    with app.app_context():
+        assert db.session.scalar(sa.select(Subscriber).filter_by(token='token0')) is not None
+    client.post('/unsubscribe/token0')
+    with app.app_context():
+        assert db.session.scalars(sa.select(Subscriber.token).order_by(Subscriber.id)).all() == [
+            'token2', 'token-u']
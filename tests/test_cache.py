@@ -0,0 +1,366 @@
+# tests/test_cache.py
+import gzip
+import json
+import re
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+from app.feeds import SITE_FEED
+from app.fragment_cache import FragmentCache
+from app.sitemap import SitemapCache
+from app.models import User, Post, Comment, Tag, RelatedPost, db
+
+
+@pytest.fixture
+def page_cache(app):
+    """Turns the anonymous page cache on for one test."""
+    app.config['PAGE_CACHE_ENABLED'] = True
+    cache = app.extensions['page_cache']
+    cache.clear()
+    yield cache
+    app.config['PAGE_CACHE_ENABLED'] = False
+    cache.clear()
+
+
+def test_anonymous_page_served_from_cache(client, page_cache):
+    """
+    GIVEN the page cache is enabled
+    WHEN an anonymous visitor requests the same page twice
+    THEN check that the second response is a cache hit carrying fresh per-visitor values
+    """
+    first = client.get('/about')
+    assert first.headers['X-Page-Cache'] == 'MISS'
+
+    second = client.get('/about')
+    assert second.headers['X-Page-Cache'] == 'HIT'
+    assert second.status_code == 200
+    assert b'__PAGE_CACHE_' not in second.data
+
+    # The nonce in the page must match this response's CSP header
+    nonce = re.search(rb'<script nonce="([^"]+)"', second.data).group(1).decode()
+    assert f"'nonce-{nonce}'" in second.headers['Content-Security-Policy']
+
+
+def test_page_cache_bypassed_for_logged_in_users(auth_client, page_cache):
+    """
+    GIVEN the page cache is enabled
+    WHEN a logged-in user requests a page
+    THEN check that it is always rendered fresh
+    """
+    auth_client.get('/about')
+    response = auth_client.get('/about')
+    assert 'X-Page-Cache' not in response.headers
+    assert b'Hi, testuser!' in response.data
+
+
+def test_page_cache_cleared_when_post_changes(client, app, page_cache):
+    """
+    GIVEN a cached homepage
+    WHEN an admin publishes a post
+    THEN check that anonymous visitors see the new post
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    assert client.get('/').headers['X-Page-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Page-Cache'] == 'HIT'
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    client.post('/admin/post/new', data={
+        'title': 'Cache Buster', 'body': 'Body.', 'tags': '', 'status': True})
+    client.get('/logout')
+    client.get('/')  # Shows (and consumes) the logout flash message
+
+    response = client.get('/')
+    assert response.headers['X-Page-Cache'] == 'MISS'
+    assert b'Cache Buster' in response.data
+
+
+def _published_post(app, slug='etag-post'):
+    with app.app_context():
+        user = User(username='validator', email='validator@test.com', confirmed=True)
+        post = Post(title='ETag Post', body='Body.', author=user, slug=slug,
+                    status=True, published_at=datetime.utcnow())
+        db.session.add(post)
+        db.session.commit()
+        return post.id, user.id
+
+
+def test_post_page_conditional_get(client, app):
+    """
+    GIVEN a published post an anonymous reader has already fetched
+    WHEN they revalidate it, before and after a new comment
+    THEN check that they get a 304 only while nothing has changed
+    """
+    post_id, user_id = _published_post(app)
+
+    first = client.get('/post/etag-post')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Last-Modified']
+
+    revalidated = client.get('/post/etag-post', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert 'Content-Security-Policy' not in revalidated.headers
+
+    with app.app_context():
+        db.session.add(Comment(body='New!', user_id=user_id, post_id=post_id))
+        db.session.commit()
+
+    changed = client.get('/post/etag-post', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+    # An edited comment, then an edited related post, change the page too
+    etag = changed.headers['ETag']
+    with app.app_context():
+        comment = db.session.scalar(sa.select(Comment))
+        comment.body, comment.edited_at = 'Edited!', datetime.utcnow()
+        neighbour = Post(title='Neighbour', slug='neighbour', body='...', user_id=user_id,
+                         status=True, published_at=datetime.utcnow())
+        db.session.add(neighbour)
+        db.session.flush()
+        db.session.add(RelatedPost(post_id=post_id, related_id=neighbour.id, score=1.0))
+        db.session.commit()
+    # The client's requests share the fixture's app context, and so a session
+    # that may still hold the comment as first loaded
+    db.session.expire_all()
+    edited = client.get('/post/etag-post', headers={'If-None-Match': etag})
+    assert edited.status_code == 200 and b'Edited!' in edited.data
+    etag = edited.headers['ETag']
+    with app.app_context():
+        db.session.scalar(sa.select(Post).filter_by(slug='neighbour')).updated_at = datetime.utcnow()
+        db.session.commit()
+    assert client.get('/post/etag-post', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.mark.parametrize('url', ['/feed.xml', '/feed.atom', '/feed.json', '/sitemap.xml'])
+def test_feed_and_sitemap_conditional_get(client, app, url):
+    """
+    GIVEN a feed or sitemap a crawler has already fetched
+    WHEN it polls again with If-Modified-Since or If-None-Match
+    THEN check that it gets a 304 until a post is deleted
+    """
+    post_id, _ = _published_post(app)
+
+    first = client.get(url)
+    assert first.status_code == 200
+
+    assert client.get(url, headers={
+        'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert client.get(url, headers={
+        'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+    with app.app_context():
+        db.session.delete(db.session.get(Post, post_id))
+        db.session.commit()
+
+    assert client.get(url, headers={
+        'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_feeds_rendered_on_publish(client, app):
+    """
+    GIVEN an admin publishing posts, with the feeds limited to two entries
+    WHEN readers fetch the RSS, Atom and JSON feeds
+    THEN check that the feeds were rendered by the publish, share the newest
+         two entries, and are served as the same bytes on every poll
+    """
+    app.config['RSS_FEED_POST_LIMIT'] = 2
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    for title in ('First Scent', 'Second Scent', 'Third Scent'):
+        client.post('/admin/post/new', data={
+            'title': title, 'body': f'<p>{title} notes.</p>', 'status': True})
+    client.get('/logout')
+
+    feed_cache = app.extensions['feed_cache']
+    with app.app_context():
+        version = Post.content_version()
+    stored = feed_cache.get(f"http://{app.config['SERVER_NAME']}/", SITE_FEED, version)
+    assert stored is not None  # Before any reader asked
+    rendered = stored[2]
+
+    rss = client.get('/feed.xml')
+    assert rss.data == rendered['rss'].body
+    assert rss.headers['ETag'] == f'"{rendered["rss"].etag}"'
+    assert client.get('/feed.xml').data == rss.data
+
+    items = json.loads(client.get('/feed.json').data)['items']
+    assert [item['title'] for item in items] == ['Third Scent', 'Second Scent']
+    atom = client.get('/feed.atom')
+    assert atom.mimetype == 'application/atom+xml'
+    assert atom.data.count(b'<entry>') == 2 and b'First Scent' not in atom.data
+    app.config['RSS_FEED_POST_LIMIT'] = 20
+
+
+def test_tag_and_author_feeds_invalidated_by_scope(client, app):
+    """
+    GIVEN rendered feeds for two tags, an author and the whole site
+    WHEN an admin retags a post from one tag to a new one, then renames themselves
+    THEN check that only the feeds that post appears in are dropped, the
+         tag feeds list the right posts afterwards, and the author feed
+         follows the rename
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    client.post('/admin/post/new', data={
+        'title': 'Vanilla Bomb', 'body': 'Sweet.', 'tags': 'gourmand', 'status': True})
+    client.post('/admin/post/new', data={
+        'title': 'Rare Oud', 'body': 'Smoky.', 'tags': 'niche', 'status': True})
+
+    gourmand = client.get('/tag/gourmand/feed.xml')
+    assert gourmand.mimetype == 'application/rss+xml'
+    assert b'Vanilla Bomb' in gourmand.data and b'Rare Oud' not in gourmand.data
+    assert b'Rare Oud' in client.get('/tag/niche/feed.xml').data
+    assert b'Vanilla Bomb' in client.get('/author/admin/feed.xml').data
+    assert client.get('/tag/nope/feed.xml').status_code == 404
+    assert client.get('/author/nobody/feed.xml').status_code == 404
+
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(slug='rare-oud'))
+        niche_id = db.session.scalar(sa.select(Tag.id).filter_by(name='niche'))
+        gourmand_id = db.session.scalar(sa.select(Tag.id).filter_by(name='gourmand'))
+        admin_id = db.session.scalar(sa.select(User.id).filter_by(username='admin'))
+    feed_cache = app.extensions['feed_cache']
+    scopes = lambda: {scope for _, scope in feed_cache._feeds}
+    assert ('tag', niche_id) in scopes() and ('tag', gourmand_id) in scopes()
+
+    client.post(f'/admin/post/{post_id}/edit', data={
+        'title': 'Rare Oud', 'body': 'Smoky.', 'tags': 'resinous', 'status': True})
+    assert ('tag', gourmand_id) in scopes()  # Not touched by the edit
+    assert ('tag', niche_id) not in scopes()
+    assert ('author', admin_id) not in scopes()
+    assert b'Rare Oud' not in client.get('/tag/niche/feed.xml').data
+    assert b'Rare Oud' in client.get('/tag/resinous/feed.xml').data
+
+    # A rename touches no post, but the author feed's title and link change
+    assert b'Vanilla Bomb' in client.get('/author/admin/feed.xml').data
+    client.post('/admin/account/change-username', data={'new_username': 'perfumer'})
+    assert client.get('/author/admin/feed.xml').status_code == 404
+    renamed = client.get('/author/perfumer/feed.xml')
+    assert b'perfumer' in renamed.data and b'/author/admin/' not in renamed.data
+
+
+def test_sitemap_sharded_streamed_and_gzipped(client, app):
+    """
+    GIVEN published posts and a draft, with child sitemaps limited to two URLs
+    WHEN a crawler fetches the sitemap index and its children
+    THEN check that the posts are split by id range, drafts are left out,
+         the gzip kept from the first fetch is served afterwards, and
+         shards the index doesn't list are not found
+    """
+    app.config['SITEMAP_MAX_URLS'] = 2
+    with app.app_context():
+        user = User(username='mapper', email='mapper@test.com')
+        db.session.add_all([
+            Post(id=id_, title=f'Post {id_}', slug=f'post-{id_}', body='Body.',
+                 author=user, status=status,
+                 published_at=datetime.utcnow() if status else None)
+            for id_, status in ((1, True), (2, True), (3, False), (5, True))])
+        db.session.commit()
+
+    index = client.get('/sitemap.xml').data.decode()
+    children = re.findall(r'<loc>http://[^/]+(/[^<]+)</loc>', index)
+    assert children == ['/sitemap-pages.xml', '/sitemap-posts-0.xml',
+                        '/sitemap-posts-1.xml', '/sitemap-posts-2.xml']
+
+    first = client.get('/sitemap-posts-1.xml')
+    assert re.findall(r'/post/([^<]+)</loc>', first.data.decode()) == ['post-2']
+    with app.app_context():
+        version = Post.content_version()
+    stored = app.extensions['sitemap_cache'].get(
+        (f"http://{app.config['SERVER_NAME']}/", 'posts-1'), version)
+    assert gzip.decompress(stored) == first.data  # Kept once streamed out
+
+    zipped = client.get('/sitemap-posts-1.xml', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.data == stored
+    assert zipped.headers['ETag'] != first.headers['ETag']
+
+    # Ids 6 and 7, and anything past them, hold no published post
+    cache = app.extensions['sitemap_cache']
+    cached = len(cache)
+    assert client.get('/sitemap-posts-3.xml').status_code == 404
+    assert client.get('/sitemap-posts-99999.xml').status_code == 404
+    assert len(cache) == cached
+    app.config['SITEMAP_MAX_URLS'] = 50000
+
+
+def test_post_fragments_reused_until_post_edited(client, app):
+    """
+    GIVEN a post page that has been rendered once
+    WHEN the stored body changes without an edit, and later through edit_post
+    THEN check that the cached article is reused until the edit drops it
+    """
+    post_id, _ = _published_post(app, slug='fragment-post')
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    assert b'Body.' in client.get('/post/fragment-post').data
+    with app.app_context():
+        db.session.execute(sa.update(Post).where(Post.id == post_id)
+                           .values(body='<p>Sneaky body.</p>'))
+        db.session.commit()
+    assert b'Sneaky body.' not in client.get('/post/fragment-post').data
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    client.post(f'/admin/post/{post_id}/edit', data={
+        'title': 'ETag Post', 'body': '<p>Edited body.</p>', 'status': True})
+    assert b'Edited body.' in client.get('/post/fragment-post').data
+
+
+def test_fragment_cache_is_bounded():
+    """
+    GIVEN a fragment cache with room for two entries
+    WHEN a third fragment is stored
+    THEN check that the least recently used one is evicted
+    """
+    cache = FragmentCache(max_entries=2)
+    cache.set(1, 'a', '<p>one</p>')
+    cache.set(2, 'b', '<p>two</p>')
+    cache.get(1, 'a')
+    cache.set(3, 'c', '<p>three</p>')
+    assert cache.get(2, 'b') is None
+    assert cache.get(1, 'a') == '<p>one</p>'
+    cache.invalidate_post(1)
+    assert len(cache) == 1
+
+
+def test_sitemap_cache_is_bounded():
+    """
+    GIVEN a sitemap cache with room for two sitemaps
+    WHEN a third host's sitemap is stored
+    THEN check that the least recently used one is evicted
+    """
+    cache = SitemapCache(max_entries=2)
+    version = (1, datetime(2024, 1, 1))
+    cache.set(('http://a/', 'pages'), version, b'a')
+    cache.set(('http://b/', 'pages'), version, b'b')
+    cache.get(('http://a/', 'pages'), version)
+    cache.set(('http://c/', 'pages'), version, b'c')
+    assert cache.get(('http://b/', 'pages'), version) is None
+    assert cache.get(('http://a/', 'pages'), version) == b'a'
+    assert len(cache) == 2
@@ -1,7 +1,21 @@
 # tests/test_main.py
+import json
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
 import pytest
-from app.models import User, Post, Comment, Tag, db, Subscriber
+import sqlalchemy as sa
+from app import create_app
+from app.models import User, Post, Comment, Tag, db, Subscriber, OutboxMessage
+from app.outbox import drain_outbox, enqueue_email, OutboxMetrics, purge_outbox
+from app.freeze import freeze_site
+from app.search import rebuild_index, highlight, Snippet, did_you_mean
 from slugify import slugify
+from config import Config
+from conftest import TestConfig
+from smtp_sink import SMTPSink
 
 
 def test_view_single_post(client, app):
@@ -175,3 +189,639 @@ def test_subscribe_and_confirm(client, app):
     with app.app_context():
         subscriber = Subscriber.query.filter_by(email='new.subscriber@example.com').first()
         assert subscriber.confirmed is True # They are now confirmed
+
+
+def test_mail_outbox_sends_and_retries(client, app, smtp_sink):
+    """
+    GIVEN an SMTP server that turns down the first message it gets
+    WHEN two people subscribe and the outbox is drained
+    THEN both emails were queued with their subscriptions, one is sent and the
+    other retried later, all over one connection per drain
+    """
+    with app.app_context():
+        # Rolled back with the write that queued it
+        enqueue_email('Never sent', ['nobody@example.com'], 'Body')
+        db.session.rollback()
+    for email in ('first@example.com', 'second@example.com'):
+        client.post('/subscribe', data={'email': email})
+    with app.app_context():
+        queued = db.session.scalars(sa.select(OutboxMessage).order_by(OutboxMessage.id)).all()
+        assert [m.recipients for m in queued] == ['first@example.com', 'second@example.com']
+        assert all(m.status == 'pending' for m in queued)
+
+    smtp_sink.fail_next(1)
+    metrics = OutboxMetrics()
+    with app.app_context():
+        assert drain_outbox(metrics=metrics) == 2
+        assert drain_outbox(metrics=metrics) == 0  # The failure isn't due yet
+        first, second = db.session.scalars(
+            sa.select(OutboxMessage).order_by(OutboxMessage.id)).all()
+        assert (first.status, first.attempts) == ('pending', 1)
+        assert '451' in first.last_error
+        assert first.next_attempt_at > datetime.utcnow()
+        assert second.status == 'sent'
+
+        first.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert drain_outbox(metrics=metrics) == 1
+        assert db.session.get(OutboxMessage, first.id).status == 'sent'
+
+    assert smtp_sink.connections == 2
+    assert [m['To'] for m in smtp_sink.messages] == ['second@example.com', 'first@example.com']
+    assert 'confirm-subscription' in smtp_sink.messages[0].get_payload()
+    assert metrics.stats()['sent'] == 2 and metrics.stats()['retried'] == 1
+
+
+def test_mail_outbox_backlog_sent_after_restart(tmp_path):
+    """
+    GIVEN mail queued, and a retry falling due, before the app process started
+    WHEN the new process serves its first request
+    THEN its sender threads deliver the backlog without any new mail queued
+    """
+    with SMTPSink() as sink:
+        class RestartedConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'restart.db'}"
+            MAIL_OUTBOX_WORKERS = 1
+            MAIL_SUPPRESS_SEND = False
+            MAIL_SERVER, MAIL_PORT = sink.host, sink.port
+            MAIL_USE_TLS = False
+
+        restarted = create_app(RestartedConfig)
+        with restarted.app_context():
+            db.create_all()
+            db.session.add_all([
+                OutboxMessage(subject='Left pending', sender='test@example.com',
+                              recipients='pending@example.com', body='Body'),
+                OutboxMessage(subject='Retry', sender='test@example.com',
+                              recipients='retry@example.com', body='Body', attempts=1,
+                              next_attempt_at=datetime.utcnow() - timedelta(seconds=1)),
+            ])
+            db.session.commit()
+        dispatcher = restarted.extensions['mail_outbox']
+        try:
+            restarted.test_client().get('/about')
+            deadline = datetime.utcnow() + timedelta(seconds=10)
+            while len(sink.messages) < 2 and datetime.utcnow() < deadline:
+                time.sleep(0.02)
+        finally:
+            dispatcher.stop(timeout=10)
+        assert sorted(m['To'] for m in sink.messages) == ['pending@example.com',
+                                                          'retry@example.com']
+        with restarted.app_context():
+            assert db.session.scalar(sa.select(sa.func.count(OutboxMessage.id))
+                                     .where(OutboxMessage.status == 'sent')) == 2
+            db.session.remove()
+
+
+def test_mail_outbox_purges_old_messages(client, app):
+    """
+    GIVEN sent, failed and pending messages of various ages
+    WHEN the outbox is purged
+    THEN only sent and failed ones past MAIL_OUTBOX_RETENTION_DAYS are deleted
+    """
+    old = datetime.utcnow() - timedelta(days=app.config['MAIL_OUTBOX_RETENTION_DAYS'] + 1)
+    with app.app_context():
+        for subject, status, created_at, sent_at in (
+                ('Old sent', 'sent', old, old),
+                ('Old failed', 'failed', old, None),
+                ('Old pending', 'pending', old, None),
+                ('Sent today', 'sent', old, datetime.utcnow())):
+            db.session.add(OutboxMessage(subject=subject, recipients='a@example.com',
+                                         status=status, created_at=created_at,
+                                         sent_at=sent_at))
+        db.session.commit()
+        assert purge_outbox() == 2
+        assert db.session.scalars(sa.select(OutboxMessage.subject)
+                                  .order_by(OutboxMessage.id)).all() == [
+            'Old pending', 'Sent today']
+
+
+def test_index_keyset_pagination(client, app):
+    """
+    GIVEN more published posts than fit on one page
+    WHEN a reader follows the Next and Previous links
+    THEN check that each page holds the right posts and old ?page= links still work
+    """
+    with app.app_context():
+        user = User(username='paginator', email='paginator@test.com', confirmed=True)
+        base_time = datetime(2025, 1, 1)
+        # Two posts share a publish time to exercise the id tie-breaker
+        for i in range(7):
+            db.session.add(Post(title=f'Paged Post {i}', body='Body.', author=user,
+                                slug=f'paged-post-{i}', status=True,
+                                published_at=base_time + timedelta(days=min(i, 5))))
+        db.session.commit()
+
+    def titles(response):
+        return re.findall(rb'class="article-title" href="[^"]+">(Paged Post \d)<', response.data)
+
+    first = client.get('/')
+    assert titles(first) == [b'Paged Post 6', b'Paged Post 5', b'Paged Post 4',
+                             b'Paged Post 3', b'Paged Post 2']
+
+    next_url = re.search(rb'href="([^"]*after=[^"]+)">Next', first.data).group(1)
+    second = client.get(next_url.decode().replace('&amp;', '&'))
+    assert titles(second) == [b'Paged Post 1', b'Paged Post 0']
+    assert b'<span class="page-link">Next</span>' in second.data
+
+    prev_url = re.search(rb'href="([^"]*before=[^"]+)">Previous', second.data).group(1)
+    assert titles(client.get(prev_url.decode().replace('&amp;', '&'))) == titles(first)
+
+    # Legacy offset links keep serving the same page
+    assert titles(client.get('/?page=2')) == titles(second)
+
+
+@contextmanager
+def count_queries(engine):
+    """Counts the SQL statements executed on `engine` inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.mark.parametrize('url, expected_queries', [
+    ('/', 2),                # posts + authors, tags
+    ('/tag/listed', 3),      # tag lookup, posts + authors, tags
+    ('/search?q=Listed', 2), # posts + authors, tags (ranked ids are cached)
+])
+def test_listing_query_count_is_constant(client, app, url, expected_queries):
+    """
+    GIVEN a page of posts with different authors and several tags each
+    WHEN a listing page is rendered
+    THEN check that authors and tags are batch-loaded, not fetched per post
+    """
+    with app.app_context():
+        shared_tag = Tag(name='listed')
+        for i in range(5):
+            author = User(username=f'lister{i}', email=f'lister{i}@test.com')
+            post = Post(title=f'Listed Post {i}', body='Body.', author=author,
+                        slug=f'listed-post-{i}', status=True,
+                        published_at=datetime(2025, 1, 1) + timedelta(days=i))
+            post.tags.extend([shared_tag, Tag(name=f'extra-{i}')])
+            db.session.add(post)
+        db.session.commit()
+        rebuild_index()
+        db.session.commit()
+
+        client.get(url)  # Warm the sidebar cache
+        with count_queries(db.engine) as statements:
+            response = client.get(url)
+
+    assert response.status_code == 200
+    assert b'lister4' in response.data and b'extra-4' in response.data
+    assert len(statements) == expected_queries, statements
+
+
+def test_post_excerpt_derived_from_body(client, app):
+    """
+    GIVEN a post whose body is HTML longer than an excerpt
+    WHEN it is saved and listed on the homepage
+    THEN check that the plain text and excerpt are stored and shown instead of the body
+    """
+    with app.app_context():
+        user = User(username='excerpter', email='excerpter@test.com')
+        body = '<p>Smoky &amp; <strong>sweet</strong> tobacco.</p>' + '<p>More notes.</p>' * 40
+        post = Post(title='Excerpt Post', body=body, author=user, slug='excerpt-post',
+                    status=True, published_at=datetime.utcnow())
+        db.session.add(post)
+        db.session.commit()
+
+        assert post.plain_text.startswith('Smoky & sweet tobacco. More notes.')
+        assert '<' not in post.plain_text
+        assert len(post.excerpt) == 300 and post.excerpt.endswith('...')
+
+        # Editing the body refreshes both fields
+        post.body = '<em>Rewritten</em>'
+        db.session.commit()
+        assert (post.plain_text, post.excerpt) == ('Rewritten', 'Rewritten')
+
+    response = client.get('/')
+    assert b'Rewritten' in response.data
+    assert b'<em>Rewritten</em>' not in response.data
+
+
+def test_comment_threads_load_in_fixed_queries(client, app):
+    """
+    GIVEN a post with a deep, branching reply thread from several commenters
+    WHEN the post page is rendered
+    THEN check that every reply is shown without a query per comment
+    """
+    with app.app_context():
+        author = User(username='threader', email='threader@test.com')
+        post = Post(title='Thread Post', body='Body.', author=author,
+                    slug='thread-post', status=True, published_at=datetime.utcnow())
+        root = Comment(body='Root comment', commenter=author, post=post)
+        db.session.add_all([post, root])
+        parent = root
+        for depth in range(6):
+            commenter = User(username=f'replier{depth}', email=f'replier{depth}@test.com')
+            reply = Comment(body=f'Reply depth {depth}', commenter=commenter,
+                            post=post, parent=parent)
+            sibling = Comment(body=f'Sibling depth {depth}', commenter=commenter,
+                              post=post, parent=parent)
+            db.session.add_all([reply, sibling])
+            parent = reply
+        db.session.commit()
+
+        client.get('/post/thread-post')  # Warm the sidebar cache
+        db.session.expunge_all()  # Load the post again, as a new request would
+        with count_queries(db.engine) as statements:
+            response = client.get('/post/thread-post')
+
+    assert response.status_code == 200
+    html = response.data.decode()
+    positions = [html.index(f'Reply depth {depth}') for depth in range(6)]
+    assert positions == sorted(positions)
+    assert 'Sibling depth 5' in html and 'replier5' in html
+    # post, its tags, comment validators, comment page + its count, reply tree
+    assert len(statements) == 6, statements
+
+
+def test_comment_counters_follow_comments(auth_client, app):
+    """
+    GIVEN a logged-in user on a post
+    WHEN they comment, reply, and then delete the comment with its replies
+    THEN check that the post's comment count and the comment's reply count keep up
+    """
+    with app.app_context():
+        user = User.query.filter_by(username='testuser').first()
+        db.session.add(Post(title='Counted Post', body='Body.', author=user,
+                            slug='counted-post', status=True,
+                            published_at=datetime.utcnow()))
+        db.session.commit()
+
+    auth_client.post('/post/counted-post', data={
+        'body': 'Top comment.', 'submit_comment': 'Submit Comment'})
+    with app.app_context():
+        top_id = Comment.query.one().id
+    for _ in range(2):
+        auth_client.post('/post/counted-post', data={
+            'body': 'A reply.', 'parent_id': top_id, 'submit_reply': 'Submit Reply'})
+
+    with app.app_context():
+        assert Post.query.one().comment_count == 3
+        assert db.session.get(Comment, top_id).reply_count == 2
+
+    response = auth_client.get('/')
+    assert b'3 comments' in response.data
+
+    auth_client.post(f'/comment/{top_id}/delete')
+    with app.app_context():
+        assert Comment.query.count() == 0
+        assert Post.query.one().comment_count == 0
+
+
+def test_reconcile_comment_counts_command(app):
+    """
+    GIVEN counters that have drifted from the comments table
+    WHEN the reconcile-comment-counts CLI command runs
+    THEN check that only the wrong rows are corrected
+    """
+    with app.app_context():
+        user = User(username='drifter', email='drifter@test.com')
+        post = Post(title='Drifted', body='Body.', author=user, slug='drifted',
+                    comment_count=7)
+        parent = Comment(body='Parent', commenter=user, post=post)
+        reply = Comment(body='Reply', commenter=user, post=post, parent=parent)
+        db.session.add_all([post, parent, reply])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['reconcile-comment-counts'])
+    assert 'Corrected 1 post(s) and 1 comment(s)' in result.output
+
+    with app.app_context():
+        assert Post.query.one().comment_count == 2
+        assert Comment.query.filter_by(body='Parent').one().reply_count == 1
+
+
+def test_freeze_exports_only_changed_pages(app, tmp_path):
+    """
+    GIVEN published posts, one tagged, and a draft
+    WHEN the site is frozen, frozen again, and frozen after an edit and a deletion
+    THEN check that public pages are written as static files, and later runs
+         only re-render what the changes touched and delete what is gone
+    """
+    with app.app_context():
+        user = User(username='freezer', email='freezer@test.com')
+        tag = Tag(name='amber', post_count=1)
+        db.session.add_all([
+            Post(title='Cold Amber', slug='cold-amber', body='Resin.', author=user,
+                 tags=[tag], status=True, published_at=datetime.utcnow()),
+            Post(title='Old Leather', slug='old-leather', body='Hide.', author=user,
+                 status=True, published_at=datetime.utcnow()),
+            Post(title='Secret Draft', slug='secret-draft', body='Shh.', author=user),
+        ])
+        db.session.commit()
+
+    def freeze(*extra):
+        result = app.test_cli_runner().invoke(args=[
+            'freeze', '--output', str(tmp_path), '--workers', '1',
+            '--base-url', f"http://{app.config['SERVER_NAME']}", *extra])
+        assert 'SUCCESS' in result.output, result.output
+        return re.search(r'(\d+) pages, (\d+) rendered', result.output).groups()
+
+    pages, rendered = freeze()
+    assert pages == rendered
+    for path in ('index.html', 'about/index.html', 'post/cold-amber/index.html',
+                 'tag/amber/index.html', 'tag/amber/feed.xml', 'feed.xml',
+                 'feed.json', 'sitemap.xml', 'author/freezer/feed.xml'):
+        assert (tmp_path / path).exists(), path
+    assert not (tmp_path / 'post' / 'secret-draft').exists()
+    assert 'Cold Amber' in (tmp_path / 'post/cold-amber/index.html').read_text()
+
+    assert freeze() == (pages, '0')
+
+    untouched = [(tmp_path / path).stat().st_mtime_ns for path in
+                 ('post/cold-amber/index.html', 'tag/amber/index.html')]
+    with app.app_context():
+        leather = db.session.scalar(sa.select(Post).filter_by(slug='old-leather'))
+        leather.body = 'Worn hide.'
+        leather.updated_at = datetime.utcnow()
+        db.session.commit()
+    _, rendered = freeze()
+    # The post, the index, the site feeds and sitemaps and its author's feed;
+    # not the other post, the amber tag or the about pages
+    assert 0 < int(rendered) < int(pages)
+    assert 'Worn hide' in (tmp_path / 'post/old-leather/index.html').read_text()
+    assert [(tmp_path / path).stat().st_mtime_ns for path in
+            ('post/cold-amber/index.html', 'tag/amber/index.html')] == untouched
+    manifest = json.loads((tmp_path / '.freeze-manifest.json').read_text())
+    assert manifest['pages']['/post/cold-amber']['version']
+
+    with app.app_context():
+        db.session.delete(db.session.scalar(sa.select(Post).filter_by(slug='old-leather')))
+        db.session.commit()
+    freeze()
+    assert not (tmp_path / 'post/old-leather/index.html').exists()
+    assert (tmp_path / 'post/cold-amber/index.html').exists()
+
+
+def test_freeze_in_worker_processes(tmp_path, monkeypatch):
+    """
+    GIVEN an app with its own database settings, and several batches of pages
+    WHEN the site is frozen by two worker processes, then after a comment edit
+    THEN check that the workers use the app's settings, POST forms and their
+         CSRF tokens are left out of the pages, and the edit is re-exported
+    """
+    class FrozenConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'frozen.db'}"
+
+    frozen = create_app(FrozenConfig)
+    output = tmp_path / 'site'
+    base_url = f"http://{FrozenConfig.SERVER_NAME}"
+    monkeypatch.setattr('app.freeze.FREEZE_BATCH_SIZE', 3)
+    with frozen.app_context():
+        db.create_all()
+        user = User(username='worker', email='worker@test.com')
+        posts = [Post(title=f'Scent {n}', slug=f'scent-{n}', body='Notes.', author=user,
+                      status=True, published_at=datetime.utcnow()) for n in range(3)]
+        db.session.add_all(posts)
+        db.session.flush()
+        comment = Comment(body='Lovely.', commenter=user, post=posts[0])
+        db.session.add(comment)
+        db.session.commit()
+
+        report = freeze_site(str(output), base_url, workers=2)
+        assert report.failed == 0 and report.rendered == report.pages > 3
+        page = (output / 'post/scent-0/index.html').read_text()
+        assert 'Lovely.' in page
+        assert 'method="POST"' not in page and 'csrf_token' not in page
+        assert '<meta name="csrf-token" content="">' in page
+
+        comment.body, comment.edited_at = 'Lovelier.', datetime.utcnow()
+        db.session.commit()
+        report = freeze_site(str(output), base_url, workers=2)
+        assert report.rendered == 1
+        assert 'Lovelier.' in (output / 'post/scent-0/index.html').read_text()
+        db.session.remove()
+
+
+def test_search_ranks_indexed_posts(client, app):
+    """
+    GIVEN an admin publishing, tagging and editing posts
+    WHEN a visitor searches
+    THEN check that the full-text index follows the changes and ranks title
+         matches above body matches
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Winter Picks', 'body': '<p>A cosy vetiver for cold days.</p>',
+        'status': True}, follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Vetiver Deep Dive', 'body': '<p>Roots and smoke.</p>',
+        'tags': 'earthy', 'status': True}, follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Unfinished Vetiver', 'body': 'Draft.'}, follow_redirects=True)
+    client.get('/logout')
+
+    def result_titles(query):
+        html = client.get(f'/search?q={query}').data.decode()
+        return [re.sub(r'<[^>]+>', '', title) for title in
+                re.findall(r'class="article-title[^"]*" href="[^"]+">(.*?)</a>', html)]
+
+    titles = result_titles('vetiver')
+    assert len(titles) == 2 and 'Unfinished' not in ' '.join(titles)
+    assert 'Deep Dive' in titles[0]  # The title match outranks the body match
+    assert len(result_titles('earth')) == 1  # Tags are indexed, prefixes match
+    assert result_titles('"vetiver*') == titles  # Query syntax is not passed through
+
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(slug='vetiver-deep-dive'))
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    client.post(f'/admin/post/{post_id}/delete', follow_redirects=True)
+    assert len(result_titles('vetiver')) == 1
+
+
+def test_search_snippets_centre_on_matches(client, app):
+    """
+    GIVEN a published post whose only mention of the query is deep in a long body
+    WHEN a visitor searches for two terms
+    THEN check that the snippet shows the matches, highlighted and escaped
+    """
+    filler = ' '.join(f'filler{i}' for i in range(300))
+    with app.app_context():
+        user = User(username='snipper', email='snipper@test.com')
+        db.session.add(Post(
+            title='Notes <b>on</b> Amber', slug='notes-on-amber', author=user,
+            body=f'<p>{filler}</p><p>A warm labdanum &amp; amber <i>accord</i>.</p>',
+            status=True, published_at=datetime.utcnow()))
+        db.session.commit()
+        rebuild_index()
+        db.session.commit()
+
+    html = client.get('/search?q=labdanum+amber').data.decode()
+    snippet = re.search(r'<p class="article-content">(.*?)</p>', html, re.S).group(1)
+    assert '<mark>labdanum</mark> &amp; <mark>amber</mark>' in snippet
+    assert 'filler10 ' not in snippet  # The window moved to the match
+    # Titles are escaped before highlighting
+    assert 'Notes &lt;b&gt;on&lt;/b&gt; <mark>Amber</mark>' in html
+
+
+def test_misspelled_search_falls_back_to_trigrams(client, app):
+    """
+    GIVEN published posts about a perfume house, one of them tagged
+    WHEN a visitor searches with the house and the tag misspelled
+    THEN check that the results for the closest spelling are shown, and
+         the respelling is looked up in the trigram index, not by scanning
+    """
+    with app.app_context():
+        user = User(username='typo', email='typo@test.com')
+        tag = Tag(name='tobacco')
+        db.session.add_all([
+            Post(title='Xerjoff Naxos Review', slug='xerjoff-naxos-review',
+                 author=user, body='Honey and lavender.', tags=[tag],
+                 status=True, published_at=datetime.utcnow()),
+            Post(title='Xerjoff Alexandria II', slug='xerjoff-alexandria-ii',
+                 author=user, body='Oud and rose.', status=True,
+                 published_at=datetime.utcnow()),
+        ])
+        db.session.commit()
+        rebuild_index()
+        db.session.commit()
+
+        assert did_you_mean('xerjoff naxos') == []  # Already spelled right
+        with count_queries(db.engine) as statements:
+            assert did_you_mean('xerjof tobaco')[0] == 'xerjoff tobacco'
+        assert len(statements) == 2  # One trigram lookup per word
+        assert all('post_search_trigrams' in s for s in statements)
+
+    html = client.get('/search?q=Xerjof+tobaco').data.decode()
+    assert 'Showing results for' in html and 'xerjoff tobacco' in html
+    titles = re.findall(r'class="article-title[^"]*" href="([^"]+)"', html)
+    assert titles == ['/post/xerjoff-naxos-review']
+    assert 'No posts found matching' not in html
+    # Nothing close enough: the plain "no results" message
+    assert 'No posts found matching' in client.get('/search?q=zzqqy').data.decode()
+
+
+def test_highlight_filter_and_snippet_offsets():
+    """
+    GIVEN text and a multi-term query
+    WHEN it is highlighted, or a database-marked snippet is parsed
+    THEN check the match offsets and the escaped HTML
+    """
+    result = highlight('Rose & Roses <3', 'rose')
+    assert result.highlights == [(0, 4), (7, 12)]
+    assert result.__html__() == '<mark>Rose</mark> &amp; <mark>Roses</mark> &lt;3'
+    assert highlight('Oud', '').__html__() == 'Oud'
+
+    parsed = Snippet.from_marked('…smoky \x02oud\x03 and \x02rose\x03…')
+    assert parsed.text == '…smoky oud and rose…'
+    assert [parsed.text[a:b] for a, b in parsed.highlights] == ['oud', 'rose']
+
+
+def test_search_suggest_from_memory(client, app):
+    """
+    GIVEN published posts and tags, and an admin who renames one post
+    WHEN a reader types into the search box
+    THEN check that titles and tags are suggested without database queries
+         and that the rename shows up straight away
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    for title, tags in [('Tobacco Vanille Review', 'tobacco, vanilla'),
+                        ('Épice Marine Notes', 'aquatic'),
+                        ('Tom Ford Ranking', 'tobacco')]:
+        client.post('/admin/post/new', data={'title': title, 'body': 'Body.',
+                                             'tags': tags, 'status': True},
+                    follow_redirects=True)
+
+    def labels(query):
+        return [(s['type'], s['label'])
+                for s in client.get(f'/search/suggest?q={query}').json['suggestions']]
+
+    # Labels starting with the prefix first; the busier tag before the quieter one
+    assert labels('to') == [('tag', 'tobacco'), ('post', 'Tobacco Vanille Review'),
+                            ('post', 'Tom Ford Ranking')]
+    assert labels('vanille r') == [('post', 'Tobacco Vanille Review')]
+    assert labels('epice') == [('post', 'Épice Marine Notes')]
+    assert labels('t') == []
+
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            client.get('/search/suggest?q=tob')
+    assert not [s for s in statements if 'post' in s.lower()]
+
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(title='Tom Ford Ranking'))
+    client.post(f'/admin/post/{post_id}/edit', data={
+        'title': 'Oud Ranking', 'body': 'Body.', 'tags': 'oud', 'status': True})
+    assert labels('tom') == []
+    assert ('post', 'Oud Ranking') in labels('oud')
+    assert labels('tobacco') == [('tag', 'tobacco'), ('post', 'Tobacco Vanille Review')]
+
+
+def test_search_suggest_has_its_own_rate_limit(client, app):
+    """
+    GIVEN a low typeahead rate limit
+    WHEN a reader exceeds it
+    THEN check that suggestions are refused while normal search still works
+    """
+    app.config['SUGGEST_RATE_LIMIT'] = '2 per minute'
+    try:
+        statuses = [client.get('/search/suggest?q=abc').status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        assert client.get('/search?q=abc').status_code == 200
+    finally:
+        app.config['SUGGEST_RATE_LIMIT'] = Config.SUGGEST_RATE_LIMIT
+
+
+def test_search_results_cached_until_posts_change(client, app):
+    """
+    GIVEN a search that has been run once
+    WHEN the same search is repeated in a different spelling, and again after an edit
+    THEN check that the repeat skips the index, and the edit clears the cache
+    """
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com',
+                     is_admin=True, confirmed=True)
+        admin.set_password('adminpass')
+        db.session.add(admin)
+        db.session.commit()
+
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'},
+                follow_redirects=True)
+    client.post('/admin/post/new', data={
+        'title': 'Summer Citrus', 'body': 'Bright.', 'status': True},
+        follow_redirects=True)
+    client.get('/logout')
+
+    search_cache = app.extensions['search_cache']
+    hits, misses = search_cache.hits, search_cache.misses
+    client.get('/search?q=summer')
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            response = client.get('/search?q=SUMMER!')
+    assert b'Summer Citrus' in response.data
+    assert not [s for s in statements if 'post_search' in s]
+    assert (search_cache.hits - hits, search_cache.misses - misses) == (1, 1)
+
+    with app.app_context():
+        post_id = db.session.scalar(sa.select(Post.id).filter_by(slug='summer-citrus'))
+    client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+    client.post(f'/admin/post/{post_id}/edit', data={
+        'title': 'Winter Citrus', 'body': 'Bright.', 'status': True})
+    assert b'No posts found matching' in client.get('/search?q=summer').data
+    assert client.get('/admin/search-cache').json['misses'] == misses + 2